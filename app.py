@@ -1,23 +1,47 @@
-import bcrypt
 from dotenv import load_dotenv
-import os
-import jwt
 load_dotenv()
 
-from flask import Flask, jsonify, request , g
+from flask import Flask, Response, jsonify, request , g
 from flask_cors import CORS 
 from post_routes import post_routes  
-from auth_middleware import token_required
-from db_utils import get_db_connection  # Import from db_utils.py
+from auth_middleware import token_required, decode_token, issue_token, verified_tokens
+from db_utils import DictRowCursor, get_db_connection, get_pool_stats, get_replicas, release_db_connection, init_app as init_db  # Import from db_utils.py
+from passwords import PasswordHasherBusy, check_password, hash_password, needs_rehash
+from enrichment import ASYNC_ENRICHMENT, get_enrichment_queue
+from trending import TRENDING_REFRESH, get_trending_refresher
+from related import RELATED_POSTS, get_related_sync
+from like_buffer import LIKE_WRITE_BEHIND, get_like_buffer
+from commands import register_commands
+from cache import read_cache
+from queries import FieldsError, bounded_int_arg
+from slow_queries import slow_query_log
+import metrics
+import responses
 
-import psycopg2, psycopg2.extras
+import psycopg2, psycopg2.errors
 
 app = Flask(__name__)
 CORS(app)
+init_db(app)  # Return each request's pooled connection on teardown
+metrics.init_app(app)  # Per-route latency, status and DB timings for /metrics
+responses.init_app(app)  # orjson serialization and gzip/brotli compression
+register_commands(app)  # flask --app app <command>
 
 
 app.register_blueprint(post_routes, url_prefix='/api')  # Prefix all post routes with /api
 
+if ASYNC_ENRICHMENT:
+    get_enrichment_queue().start()  # Resume tagging posts left pending by a previous process
+
+if TRENDING_REFRESH:
+    get_trending_refresher().start()  # Fold new like/comment events into the trending scores
+
+if RELATED_POSTS:
+    get_related_sync().start()  # Load the related-posts index from its snapshot (or the posts table) and keep it in sync
+
+if LIKE_WRITE_BEHIND:
+    get_like_buffer().start()  # From the main thread, so pending likes are flushed on SIGTERM too
+
 # def get_db_connection():
 #     connection = psycopg2.connect(
 #         host='localhost',
@@ -36,14 +60,14 @@ def sign_token():
         "email": "sai@email.com",
         "password": "kamara"
     }
-    token = jwt.encode(user, os.getenv('JWT_SECRET'), algorithm="HS256")    
+    token = issue_token(user)
     return jsonify({"token": token})
 
 @app.route('/verify-token', methods=['POST'])
 def verify_token():
     try:
         token = request.headers.get('Authorization').split(' ')[1]
-        decoded_token = jwt.decode(token, os.getenv('JWT_SECRET'), algorithms=["HS256"])
+        decoded_token = decode_token(token)
         return jsonify({"user": decoded_token})
     except Exception as error:
        return jsonify({"error": str(error)})
@@ -53,46 +77,107 @@ def verify_token():
 def signup():
     try:
         new_user_data = request.get_json()
+        # Hash before taking a connection so it isn't held while bcrypt runs
+        hashed_password = hash_password(new_user_data["password"])
         connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute("SELECT * FROM users WHERE username = %s or email = %s;", (new_user_data["username"], new_user_data["email"],)) 
-        existing_user = cursor.fetchone()
-        if existing_user:
-            cursor.close()
+        cursor = connection.cursor(cursor_factory=DictRowCursor)
+        try:
+            # The unique indexes on username and email reject duplicates
+            cursor.execute("INSERT INTO users (username,email, password) VALUES (%s, %s, %s) RETURNING id,username", (new_user_data["username"], new_user_data["email"],hashed_password))
+        except psycopg2.errors.UniqueViolation:
+            connection.rollback()
             return jsonify({"error": "Username already taken"}), 400
-        hashed_password = bcrypt.hashpw(bytes(new_user_data["password"], 'utf-8'), bcrypt.gensalt())
-        cursor.execute("INSERT INTO users (username,email, password) VALUES (%s, %s, %s) RETURNING id,username", (new_user_data["username"], new_user_data["email"],hashed_password.decode('utf-8')))
         created_user = cursor.fetchone()
         connection.commit()
         cursor.close()
-        connection.close()
         payload = {"username": created_user["username"], "id": created_user["id"]}
-        token = jwt.encode({ "payload": payload }, os.getenv('JWT_SECRET'))
+        token = issue_token({ "payload": payload })
         return jsonify({"token": token, "user": created_user}), 201
+    except PasswordHasherBusy as err:
+        return jsonify({"error": str(err)}), 503
     except Exception as err:
         return jsonify({"error":  str(err)}), 401
         
+def upgrade_password_hash(user, password):
+    # Re-hash at the configured work factor; a failure here must not fail the sign-in
+    try:
+        # Hash before taking a connection, so it isn't held while bcrypt runs
+        new_hash = hash_password(password)
+        connection = get_db_connection()
+        cursor = connection.cursor()
+        cursor.execute(
+            "UPDATE users SET password = %s WHERE id = %s AND password = %s;",
+            (new_hash, user["id"], user["password"])
+        )
+        connection.commit()
+    except Exception as err:
+        app.logger.warning("Could not upgrade password hash for user %s: %s", user["id"], err)
+
 @app.route('/auth/sign-in', methods=["POST"])
 def sign_in():
     try:
         sign_in_form_data = request.get_json()
         connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor = connection.cursor(cursor_factory=DictRowCursor)
         cursor.execute("SELECT * FROM users WHERE username = %s;", (sign_in_form_data["username"],))
         existing_user = cursor.fetchone()
         if existing_user is None:
             return jsonify({"err": "Wrong Username/Password"}), 401
-        password_is_valid = bcrypt.checkpw(bytes(
-            sign_in_form_data["password"], 'utf-8'), bytes(existing_user["password"], 'utf-8'))
+        # Don't hold the connection while bcrypt runs
+        release_db_connection()
+        password_is_valid = check_password(sign_in_form_data["password"], existing_user["password"])
         if not password_is_valid:
             return jsonify({"error": "Invalid credentials."}), 401
+        if needs_rehash(existing_user["password"]):
+            upgrade_password_hash(existing_user, sign_in_form_data["password"])
         payload = {"username": existing_user["username"], "id": existing_user["id"]}
-        token = jwt.encode({"payload": payload}, os.getenv('JWT_SECRET'))
+        if existing_user.get("is_admin"):
+            payload["is_admin"] = True  # Admin-only routes check the token, not the database
+        token = issue_token({"payload": payload})
         return jsonify({"token": token}), 200
+    except PasswordHasherBusy as err:
+        return jsonify({"error": str(err)}), 503
     except Exception as err:
         return jsonify({"err": "Wrong Username/Password."}), 500
-    finally: 
-            connection.close()   
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    # Connection pool usage, for sizing workers against Postgres max_connections
+    stats = {"db_pool": get_pool_stats(), "cache": read_cache.stats(), "verified_tokens": verified_tokens.stats()}
+    if get_replicas():
+        stats["db_replicas"] = [replica.stats() for replica in get_replicas()]
+    if ASYNC_ENRICHMENT:
+        stats["tag_enrichment"] = get_enrichment_queue().stats()
+    if TRENDING_REFRESH:
+        stats["trending"] = get_trending_refresher().stats()
+    if RELATED_POSTS:
+        stats["related_posts"] = get_related_sync().stats()
+    if LIKE_WRITE_BEHIND:
+        stats["like_buffer"] = get_like_buffer().stats()
+    return jsonify(stats)
+
+@app.route('/admin/slow-queries', methods=['GET'])
+@token_required
+def slow_queries():
+    # Statements over SLOW_QUERY_MS in this process, grouped by fingerprint, most total time first
+    if not g.user.get("is_admin"):
+        return jsonify({"error": "Admin access required"}), 403
+    if slow_query_log is None:
+        return jsonify({"error": "The slow-query log is off (SLOW_QUERY_MS=0)"}), 404
+    try:
+        limit = bounded_int_arg(request.args, 'limit', 50, 500)
+    except FieldsError as err:
+        return jsonify({"error": str(err)}), 400
+    return jsonify({
+        "threshold_ms": slow_query_log.threshold * 1000,
+        "explain_rate": slow_query_log.explain_rate,
+        "queries": slow_query_log.summary(limit),
+    })
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Prometheus text exposition format
+    return Response(metrics.render(get_pool_stats()), mimetype="text/plain; version=0.0.4")
 
 @app.route('/')
 def index():
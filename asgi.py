@@ -0,0 +1,26 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart
+from quart_cors import cors
+from app import app as wsgi_app
+from async_db import init_app as init_async_db
+from async_post_routes import async_post_routes
+
+# ASGI serving mode: the post routes run as async views on psycopg 3's async
+# pool, so one process can hold many slow requests without a thread each.
+# Everything outside /api (auth, /stats) is still served by the Flask app.
+#   hypercorn asgi:application
+async_app = cors(Quart(__name__))
+init_async_db(async_app)  # Open the async pool on startup, return each request's connection on teardown
+async_app.register_blueprint(async_post_routes, url_prefix='/api')
+
+_wsgi_application = WsgiToAsgi(wsgi_app)
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan" or scope.get("path", "").startswith("/api/"):
+        await async_app(scope, receive, send)
+    else:
+        await _wsgi_application(scope, receive, send)
@@ -0,0 +1,57 @@
+import os
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from quart import g
+from db_utils import get_connect_kwargs
+
+# psycopg 3 async pool for the ASGI serving mode (asgi.py). Rows come back as
+# plain dicts, so responses match the DictRowCursor rows of the sync handlers.
+_async_pool = None
+
+
+def get_async_pool():
+    if _async_pool is None:
+        raise RuntimeError("The async pool is opened when the ASGI app starts serving")
+    return _async_pool
+
+
+async def open_async_pool():
+    global _async_pool
+    _async_pool = AsyncConnectionPool(
+        make_conninfo(**get_connect_kwargs()),
+        min_size=int(os.getenv('ASYNC_DB_POOL_MIN', 1)),
+        max_size=int(os.getenv('ASYNC_DB_POOL_MAX', 20)),
+        timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        max_idle=float(os.getenv('DB_POOL_HEALTH_CHECK_AFTER', 30)),
+        kwargs={"row_factory": dict_row},
+        check=AsyncConnectionPool.check_connection,
+        open=False
+    )
+    await _async_pool.open()
+
+
+async def close_async_pool():
+    if _async_pool is not None:
+        await _async_pool.close()
+
+
+async def get_async_db_connection():
+    # One pooled connection per request, returned by the teardown hook registered in init_app
+    if 'db_connection' not in g:
+        g.db_connection = await get_async_pool().getconn()
+    return g.db_connection
+
+
+async def release_async_db_connection(exception=None):
+    connection = g.pop('db_connection', None)
+    if connection is not None:
+        if not connection.closed:
+            await connection.rollback()
+        await get_async_pool().putconn(connection)
+
+
+def init_app(app):
+    app.before_serving(open_async_pool)
+    app.after_serving(close_async_pool)
+    app.teardown_appcontext(release_async_db_connection)
@@ -0,0 +1,545 @@
+import os
+from functools import wraps
+import jwt
+import psycopg.errors
+from quart import Blueprint, Response, current_app, jsonify, request, g
+from auth_middleware import decode_token
+from async_db import get_async_db_connection, get_async_pool
+from tagging import suggest_tags_async, suggest_tags_many_async
+from enrichment import ASYNC_ENRICHMENT, get_enrichment_queue
+from pagination import PaginationError, get_page_args
+from queries import (
+    build_comments_query, build_posts_query, build_update_post_query, build_update_user_query,
+    build_user_posts_query, finish_comments_page, finish_posts_page, finish_user_posts_page,
+    FieldsError, bounded_int_arg, build_post_query, build_related_query, build_trending_query, finish_post, group_highlight, is_full_text
+)
+from cache import cache_key, read_cache
+from trending import DEFAULT_WINDOW, TRENDING_WINDOWS, get_trending_refresher
+from related import get_related_index, index_post, unindex_post
+from like_buffer import LIKE_STATE, LIKE_WRITE_BEHIND, get_like_buffer, pending_like_delta, with_pending_likes
+
+# Async mirror of post_routes for the ASGI serving mode (asgi.py). Endpoints,
+# status codes and response bodies match the sync blueprint; SQL comes from
+# the same builders in queries.py.
+
+async_post_routes = Blueprint('async_post_routes', __name__)
+
+CACHED_LIST_PAGES = int(os.getenv('CACHE_LIST_PAGES', 3))
+LIST_CACHE_TTL = float(os.getenv('CACHE_LIST_TTL', 10))
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 500))
+
+
+def async_token_required(f):
+    # Same checks and messages as auth_middleware.token_required
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        authorization_header = request.headers.get('Authorization')
+        if authorization_header is None:
+            return jsonify({"error": "Authorization header is missing"}), 401
+        try:
+            token = authorization_header.split(' ')[1]
+            token_data = decode_token(token)
+            g.user = token_data.get("payload") or token_data
+            if g.user is None:
+                return jsonify({"error": "Invalid token: 'payload' key not found"}), 401
+        except jwt.ExpiredSignatureError:
+            return jsonify({"error": "Token has expired"}), 401
+        except jwt.InvalidTokenError:
+            return jsonify({"error": "Invalid token"}), 401
+        except Exception as error:
+            return jsonify({"error": f"An error occurred: {str(error)}"}), 500
+        return await f(*args, **kwargs)
+    return decorated_function
+
+
+async def fetch_one(query, params):
+    connection = await get_async_db_connection()
+    cursor = await connection.execute(query, params)
+    return await cursor.fetchone()
+
+
+async def fetch_all(query, params):
+    connection = await get_async_db_connection()
+    cursor = await connection.execute(query, params)
+    return await cursor.fetchall()
+
+
+def stream_ndjson(query, params, transform=None):
+    # Quart tears the request context down before the body is sent, so the
+    # generator checks out its own connection for the server-side cursor
+    dumps = current_app.json.dumps
+
+    async def generate():
+        async with get_async_pool().connection() as connection:
+            async with connection.cursor(name="ndjson_export") as cursor:
+                await cursor.execute(query, params)
+                while True:
+                    rows = await cursor.fetchmany(EXPORT_BATCH_SIZE)
+                    if not rows:
+                        break
+                    yield "".join(dumps(transform(row) if transform else row) + "\n" for row in rows)
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+async def record_buffered_like(post_id, liked):
+    async def load_state():
+        state = await fetch_one(LIKE_STATE, (post_id, g.user["id"], post_id))
+        return state["liked"] if state["post_exists"] else None
+
+    return await get_like_buffer().record_async(g.user["id"], post_id, liked, load_state)
+
+
+@async_post_routes.route('/posts', methods=['POST'])
+@async_token_required
+async def create_post():
+    try:
+        current_user = g.user
+        post_data = await request.get_json()
+        if not post_data.get("title"):
+            return jsonify({"error": "Title is required"}), 400
+        if not post_data.get("content"):
+            return jsonify({"error": "Content is required"}), 400
+
+        # Use spaCy to suggest tags if none are provided, either now or in the background
+        tags = post_data.get("tags")
+        enrich_later = not tags and ASYNC_ENRICHMENT
+        if not tags and not enrich_later:
+            tags = ", ".join(await suggest_tags_async(post_data["content"]))
+
+        connection = await get_async_db_connection()
+        new_post = await fetch_one(
+            """
+            INSERT INTO posts (title, content, tags, tags_status, user_id, media_url)
+            VALUES (%s, %s, %s, %s, %s, %s) RETURNING *;
+            """,
+            (
+                post_data["title"],
+                post_data["content"],
+                tags or "",
+                "pending" if enrich_later else "done",
+                current_user["id"],
+                post_data.get("media_url")
+            )
+        )
+        await connection.commit()
+        read_cache.invalidate("posts")
+        index_post(new_post)
+
+        if enrich_later:
+            get_enrichment_queue().enqueue(new_post["id"])
+
+        return jsonify({"post": new_post, "suggested_tags": tags}), 201
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts', methods=['GET'])
+async def get_posts():
+    try:
+        page, limit, page_cursor = get_page_args(request.args)
+        query, params = build_posts_query(request.args, page, limit, page_cursor)
+
+        async def load_posts():
+            return await fetch_all(query, params)
+
+        if not request.args.get('q') and not page_cursor and page <= CACHED_LIST_PAGES:
+            rows = await read_cache.get_or_load_async(cache_key("posts", request.args), ["posts", "users"], load_posts, ttl=LIST_CACHE_TTL)
+        else:
+            rows = await load_posts()
+        posts, next_cursor = finish_posts_page(rows, limit, request.args)
+
+        return jsonify({"posts": with_pending_likes(posts), "page": page, "limit": limit, "next_cursor": next_cursor}), 200
+    except (PaginationError, FieldsError) as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/export', methods=['GET'])
+async def export_posts():
+    try:
+        query, params = build_posts_query(request.args, 1, None, None)
+        return stream_ndjson(query, params, group_highlight if is_full_text(request.args.get('q')) else None)
+    except FieldsError as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/trending', methods=['GET'])
+async def get_trending_posts():
+    try:
+        window = request.args.get('window', DEFAULT_WINDOW)
+        if window not in TRENDING_WINDOWS:
+            return jsonify({"error": "window must be one of: %s" % ", ".join(TRENDING_WINDOWS)}), 400
+        limit = bounded_int_arg(request.args, 'limit', 20, 100)
+        query, params = build_trending_query(request.args, window, TRENDING_WINDOWS[window][0], limit)
+
+        async def load_trending():
+            return await fetch_all(query, params)
+
+        posts = await read_cache.get_or_load_async(cache_key("trending", request.args), ["trending", "posts", "users"], load_trending, ttl=get_trending_refresher().interval)
+        return jsonify({"posts": with_pending_likes(posts), "window": window}), 200
+    except FieldsError as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/<int:post_id>', methods=['GET'])
+async def get_post(post_id):
+    try:
+        query, params, includes = build_post_query(post_id, request.args)
+
+        async def load_post():
+            return finish_post(await fetch_one(query, params))
+
+        namespaces = ["post:%d" % post_id, "users"]
+        if "comments" in includes:
+            namespaces.append("comments:%d" % post_id)
+        post = await read_cache.get_or_load_async(cache_key("post:%d" % post_id, request.args), namespaces, load_post)
+        if not post:
+            return jsonify({"error": "Post not found"}), 404
+        delta = pending_like_delta(post_id)
+        if delta and "like_count" in post:
+            post = dict(post, like_count=post["like_count"] + delta)
+        return jsonify({"post": post}), 200
+    except FieldsError as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/<int:post_id>/related', methods=['GET'])
+async def get_related_posts(post_id):
+    try:
+        index = get_related_index()
+        if index is None:
+            return jsonify({"error": "Related posts are not available yet"}), 503
+        limit = bounded_int_arg(request.args, 'limit', 10, 50)
+        related = index.related(post_id, limit)
+        if related is None:
+            if not await fetch_one("SELECT 1 FROM posts WHERE id = %s;", (post_id,)):
+                return jsonify({"error": "Post not found"}), 404
+            related = []
+
+        posts = {}
+        if related:
+            query, params = build_related_query(request.args, [related_id for related_id, _ in related])
+            posts = {post["id"]: post for post in await fetch_all(query, params)}
+        related = [dict(posts[related_id], similarity=round(score, 4)) for related_id, score in related if related_id in posts]
+        return jsonify({"posts": related}), 200
+    except FieldsError as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/<int:post_id>/tags-status', methods=['GET'])
+async def get_tags_status(post_id):
+    try:
+        status = await fetch_one("SELECT id AS post_id, tags, tags_status FROM posts WHERE id = %s;", (post_id,))
+        if not status:
+            return jsonify({"error": "Post not found"}), 404
+        return jsonify(status), 200
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/<int:post_id>', methods=['PUT'])
+@async_token_required
+async def update_post(post_id):
+    try:
+        current_user = g.user
+        post_data = await request.get_json()
+        if not post_data.get("title") and not post_data.get("content") and not post_data.get("tags") and not post_data.get("media_url"):
+            return jsonify({"error": "At least one field (title, content, tags, media_url) is required to update"}), 400
+        connection = await get_async_db_connection()
+        query, update_values = build_update_post_query(post_id, current_user["id"], post_data)
+        updated_post = await fetch_one(query, update_values)
+        if not updated_post:
+            return jsonify({"error": "Post not found or you are not authorized to update this post"}), 403
+        await connection.commit()
+        read_cache.invalidate("post:%d" % post_id, "posts")
+        index_post(updated_post)
+        return jsonify({"post": updated_post}), 200
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/<int:post_id>', methods=['DELETE'])
+@async_token_required
+async def delete_post(post_id):
+    try:
+        current_user = g.user
+        connection = await get_async_db_connection()
+        post = await fetch_one("DELETE FROM posts WHERE id = %s AND user_id = %s RETURNING id;", (post_id, current_user["id"]))
+        if not post:
+            return jsonify({"error": "Post not found or you are not authorized to delete this post"}), 403
+        await connection.commit()
+        read_cache.invalidate("post:%d" % post_id, "comments:%d" % post_id, "posts")
+        unindex_post(post_id)
+        return jsonify({"message": "Post deleted successfully"}), 200
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/<int:post_id>/comments', methods=['POST'])
+@async_token_required
+async def add_comment(post_id):
+    try:
+        current_user = g.user
+        comment_data = await request.get_json()
+        if not comment_data.get("content"):
+            return jsonify({"error": "Comment content is required"}), 400
+        connection = await get_async_db_connection()
+        try:
+            new_comment = await fetch_one(
+                """
+                INSERT INTO comments (content, user_id, post_id)
+                VALUES (%s, %s, %s) RETURNING *;
+                """,
+                (comment_data["content"], current_user["id"], post_id)
+            )
+        except psycopg.errors.ForeignKeyViolation as err:
+            await connection.rollback()
+            if err.diag.constraint_name == "comments_post_id_fkey":
+                return jsonify({"error": "Post not found"}), 404
+            # The token outlived its user (deleted account)
+            return jsonify({"error": "User not found"}), 401
+        await connection.commit()
+        read_cache.invalidate("comments:%d" % post_id, "post:%d" % post_id)
+        return jsonify({"comment": new_comment}), 201
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/<int:post_id>/comments', methods=['GET'])
+async def get_comments(post_id):
+    try:
+        page, limit, page_cursor = get_page_args(request.args)
+        query, params = build_comments_query(post_id, page, limit, page_cursor)
+
+        async def load_comments():
+            post = await fetch_one("SELECT * FROM posts WHERE id = %s;", (post_id,))
+            if not post:
+                return None
+            return await fetch_all(query, params)
+
+        if not page_cursor and page <= CACHED_LIST_PAGES:
+            rows = await read_cache.get_or_load_async(cache_key("comments:%d" % post_id, request.args), ["comments:%d" % post_id, "users"], load_comments, ttl=LIST_CACHE_TTL)
+        else:
+            rows = await load_comments()
+        if rows is None:
+            return jsonify({"error": "Post not found"}), 404
+        comments, next_cursor = finish_comments_page(rows, limit)
+
+        return jsonify({"comments": comments, "page": page, "limit": limit, "next_cursor": next_cursor}), 200
+    except PaginationError as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/<int:post_id>/comments/export', methods=['GET'])
+async def export_comments(post_id):
+    try:
+        if await fetch_one("SELECT 1 FROM posts WHERE id = %s;", (post_id,)) is None:
+            return jsonify({"error": "Post not found"}), 404
+        query, params = build_comments_query(post_id, 1, None, None)
+        return stream_ndjson(query, params)
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/comments/<int:comment_id>', methods=['DELETE'])
+@async_token_required
+async def delete_comment(comment_id):
+    try:
+        current_user = g.user
+        connection = await get_async_db_connection()
+        comment = await fetch_one(
+            "DELETE FROM comments WHERE id = %s AND (user_id = %s OR %s) RETURNING post_id;",
+            (comment_id, current_user["id"], bool(current_user.get("is_admin")))
+        )
+        if not comment:
+            if await fetch_one("SELECT 1 FROM comments WHERE id = %s;", (comment_id,)) is None:
+                return jsonify({"error": "Comment not found"}), 404
+            return jsonify({"error": "You are not authorized to delete this comment"}), 403
+        await connection.commit()
+        read_cache.invalidate("comments:%d" % comment["post_id"], "post:%d" % comment["post_id"])
+        return jsonify({"message": "Comment deleted successfully"}), 200
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/<int:post_id>/like', methods=['POST'])
+@async_token_required
+async def like_post(post_id):
+    try:
+        current_user = g.user
+        if LIKE_WRITE_BEHIND:
+            recorded = await record_buffered_like(post_id, True)
+            if recorded is None:
+                return jsonify({"error": "Post not found"}), 404
+            if not recorded:
+                return jsonify({"error": "You have already liked this post"}), 400
+            return jsonify({"message": "Post liked successfully", "like": {"user_id": current_user["id"], "post_id": post_id}}), 201
+        connection = await get_async_db_connection()
+        try:
+            new_like = await fetch_one(
+                "INSERT INTO likes (user_id, post_id) VALUES (%s, %s) ON CONFLICT (user_id, post_id) DO NOTHING RETURNING *;",
+                (current_user["id"], post_id)
+            )
+        except psycopg.errors.ForeignKeyViolation as err:
+            await connection.rollback()
+            if err.diag.constraint_name == "likes_post_id_fkey":
+                return jsonify({"error": "Post not found"}), 404
+            # The token outlived its user (deleted account)
+            return jsonify({"error": "User not found"}), 401
+        if not new_like:
+            return jsonify({"error": "You have already liked this post"}), 400
+        await connection.commit()
+        read_cache.invalidate("post:%d" % post_id)
+        return jsonify({"message": "Post liked successfully", "like": new_like}), 201
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/<int:post_id>/like', methods=['DELETE'])
+@async_token_required
+async def unlike_post(post_id):
+    try:
+        current_user = g.user
+        if LIKE_WRITE_BEHIND:
+            if not await record_buffered_like(post_id, False):
+                return jsonify({"error": "You have not liked this post"}), 400
+            return jsonify({"message": "Post unliked successfully"}), 200
+        connection = await get_async_db_connection()
+        like = await fetch_one("DELETE FROM likes WHERE user_id = %s AND post_id = %s RETURNING post_id;", (current_user["id"], post_id))
+        if not like:
+            return jsonify({"error": "You have not liked this post"}), 400
+        await connection.commit()
+        read_cache.invalidate("post:%d" % post_id)
+        return jsonify({"message": "Post unliked successfully"}), 200
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/<int:post_id>/likes', methods=['GET'])
+async def get_like_count(post_id):
+    try:
+        async def load_like_count():
+            return await fetch_one("SELECT like_count FROM posts WHERE id = %s;", (post_id,))
+
+        post = await read_cache.get_or_load_async("likes:%d" % post_id, ["post:%d" % post_id], load_like_count)
+        if not post:
+            return jsonify({"error": "Post not found"}), 404
+        return jsonify({"like_count": post["like_count"] + pending_like_delta(post_id)}), 200
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/users/<int:user_id>', methods=['GET'])
+async def get_user_profile(user_id):
+    try:
+        async def load_user():
+            return await fetch_one("SELECT id, username, email, created_at FROM users WHERE id = %s;", (user_id,))
+
+        user = await read_cache.get_or_load_async("user:%d" % user_id, ["user:%d" % user_id], load_user)
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+        return jsonify({"user": user}), 200
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/users/<int:user_id>', methods=['PUT'])
+@async_token_required
+async def update_user_profile(user_id):
+    try:
+        current_user = g.user
+        if current_user["id"] != user_id:
+            return jsonify({"error": "You are not authorized to update this profile"}), 403
+        profile_data = await request.get_json()
+        if not profile_data:
+            return jsonify({"error": "No data provided"}), 400
+        connection = await get_async_db_connection()
+        query, update_values = build_update_user_query(user_id, profile_data)
+        if query is None:
+            return jsonify({"error": "No valid fields to update"}), 400
+        updated_user = await fetch_one(query, update_values)
+        await connection.commit()
+        read_cache.invalidate("user:%d" % user_id, "users")
+        return jsonify({"user": updated_user}), 200
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/users/<int:user_id>/posts', methods=['GET'])
+async def get_user_posts(user_id):
+    try:
+        page, limit, page_cursor = get_page_args(request.args)
+        user = await fetch_one("SELECT * FROM users WHERE id = %s;", (user_id,))
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+        query, params = build_user_posts_query(user_id, request.args, page, limit, page_cursor)
+        posts, next_cursor = finish_user_posts_page(await fetch_all(query, params), limit)
+        return jsonify({"posts": with_pending_likes(posts), "page": page, "limit": limit, "next_cursor": next_cursor}), 200
+    except (PaginationError, FieldsError) as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/users/<int:user_id>/posts/export', methods=['GET'])
+async def export_user_posts(user_id):
+    try:
+        if await fetch_one("SELECT 1 FROM users WHERE id = %s;", (user_id,)) is None:
+            return jsonify({"error": "User not found"}), 404
+        query, params = build_user_posts_query(user_id, request.args, 1, None, None)
+        return stream_ndjson(query, params)
+    except FieldsError as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/tags', methods=['GET'])
+async def get_tags():
+    try:
+        limit = bounded_int_arg(request.args, 'limit', 50, 100)
+        tags = await fetch_all(
+            """
+            SELECT name, post_count FROM tags
+            WHERE post_count > 0
+            ORDER BY post_count DESC, name
+            LIMIT %s;
+            """,
+            (limit,)
+        )
+        return jsonify({"tags": tags}), 200
+    except FieldsError as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@async_post_routes.route('/posts/suggest-tags', methods=['POST'])
+@async_token_required
+async def suggest_tags():
+    try:
+        post_data = await request.get_json()
+        contents = post_data.get("contents")
+        if contents is not None:
+            if not isinstance(contents, list) or not contents or not all(isinstance(c, str) and c for c in contents):
+                return jsonify({"error": "Contents must be a non-empty list of post contents"}), 400
+            return jsonify({"suggested_tags": await suggest_tags_many_async(contents)}), 200
+
+        content = post_data.get("content")
+        if not content:
+            return jsonify({"error": "Post content is required"}), 400
+        return jsonify({"suggested_tags": await suggest_tags_async(content)}), 200
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
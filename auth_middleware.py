@@ -1,17 +1,89 @@
 from functools import wraps
 from flask import request, jsonify, g
+from collections import OrderedDict
+from dotenv import load_dotenv
+import hashlib
+import threading
+import time
 import jwt
 import os
 
+load_dotenv()
+
+# Read once at startup instead of on every request
+JWT_SECRET = os.getenv('JWT_SECRET')
+JWT_ALGORITHM = "HS256"
+JWT_TTL = int(os.getenv('JWT_TTL', 24 * 60 * 60))  # Lifetime of issued tokens, in seconds
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of tokens whose signature has already been checked.
+
+    Keyed by a SHA-256 of the token so raw tokens are never kept in memory.
+    Entries expire with the token's own ``exp`` claim; tokens without one are
+    never cached.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # token hash -> (claims, exp)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, claims, exp):
+        with self._lock:
+            self._entries[key] = (claims, exp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+verified_tokens = VerifiedTokenCache(max_entries=int(os.getenv('JWT_CACHE_SIZE', 10000)))
+
+
+def issue_token(claims):
+    return jwt.encode(dict(claims, exp=int(time.time()) + JWT_TTL), JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+
+def decode_token(token):
+    # Shared by token_required and /verify-token; claims must be treated as read-only
+    key = hashlib.sha256(token.encode()).hexdigest()
+    claims = verified_tokens.get(key)
+    if claims is not None:
+        return claims
+    claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    if isinstance(claims.get("exp"), (int, float)):
+        verified_tokens.put(key, claims, claims["exp"])
+    return claims
+
+
 def token_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
+        started = time.perf_counter()
         authorization_header = request.headers.get('Authorization')
         if authorization_header is None:
             return jsonify({"error": "Authorization header is missing"}), 401
-        try:          
+        try:
             token = authorization_header.split(' ')[1]
-            token_data = jwt.decode(token, os.getenv('JWT_SECRET'), algorithms=["HS256"])
+            token_data = decode_token(token)
             g.user = token_data.get("payload") or token_data
             if g.user is None:
                 return jsonify({"error": "Invalid token: 'payload' key not found"}), 401
@@ -21,7 +93,9 @@ def token_required(f):
             return jsonify({"error": "Invalid token"}), 401
         except Exception as error:
             return jsonify({"error": f"An error occurred: {str(error)}"}), 500
+        finally:
+            g.auth_time = time.perf_counter() - started
+
 
-        
         return f(*args, **kwargs)
-    return decorated_function
\ No newline at end of file
+    return decorated_function
@@ -0,0 +1,48 @@
+"""Compare two load-test result files.
+
+    python -m bench.compare bench/results/before.json bench/results/after.json
+
+Prints throughput, p50/p95/p99 latency and queries per request for each
+endpoint side by side, with the relative change.
+"""
+import argparse
+import json
+
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return ""
+    return "%+.1f%%" % ((after - before) / before * 100)
+
+
+def compare(before, after):
+    print("%-36s %-7s %10s %10s %9s" % ("endpoint", "metric", "before", "after", "change"))
+    endpoints = sorted(set(before["endpoints"]) | set(after["endpoints"]))
+    for endpoint in endpoints + ["TOTAL"]:
+        old = before["total"] if endpoint == "TOTAL" else before["endpoints"].get(endpoint)
+        new = after["total"] if endpoint == "TOTAL" else after["endpoints"].get(endpoint)
+        if old is None or new is None:
+            print("%-36s only in %s" % (endpoint, "after" if old is None else "before"))
+            continue
+        metrics = [
+            ("rps", old["throughput_rps"], new["throughput_rps"]),
+            ("p50", old["latency_ms"]["p50"], new["latency_ms"]["p50"]),
+            ("p95", old["latency_ms"]["p95"], new["latency_ms"]["p95"]),
+            ("p99", old["latency_ms"]["p99"], new["latency_ms"]["p99"]),
+            ("q/req", old["queries_per_request"], new["queries_per_request"]),
+        ]
+        for index, (metric, old_value, new_value) in enumerate(metrics):
+            print("%-36s %-7s %10s %10s %9s" % (endpoint if index == 0 else "", metric, old_value, new_value, change(old_value, new_value)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+    with open(args.before) as before, open(args.after) as after:
+        compare(json.load(before), json.load(after))
+
+
+if __name__ == "__main__":
+    main()
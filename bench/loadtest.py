@@ -0,0 +1,404 @@
+"""Drive every route with a mixed read/write workload at fixed concurrency.
+
+    DB_STATS_HEADERS=1 flask --app app run            # or gunicorn / hypercorn asgi:application
+    python -m bench.seed --reset
+    python -m bench.loadtest --concurrency 16 --duration 60
+
+Each worker signs in as a seeded ``bench_user_<n>`` and then repeatedly picks
+an operation by weight. Per endpoint the report has throughput, p50/p95/p99
+latency, error count and mean queries per request (from the ``X-DB-Queries``
+header the app sends when started with ``DB_STATS_HEADERS=1``). Results are
+written as JSON so runs can be compared with ``python -m bench.compare``.
+Uses only the standard library against a local server; nothing leaves the
+machine.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import subprocess
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit
+from bench.seed import PASSWORD, TAGS, USERNAME_PREFIX, WORDS
+from db_utils import pooled_connection
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def load_fixtures(sample_size=2000):
+    # Ids to aim requests at, read once from the seeded database
+    with pooled_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT id, username FROM users WHERE username LIKE %s ORDER BY id;", (USERNAME_PREFIX + "%",))
+        users = cursor.fetchall()
+        cursor.execute("SELECT id FROM posts ORDER BY random() LIMIT %s;", (sample_size,))
+        post_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT name FROM tags WHERE post_count > 0 ORDER BY post_count DESC LIMIT 50;")
+        tags = [row[0] for row in cursor.fetchall()] or TAGS
+        connection.rollback()
+    if not users or not post_ids:
+        raise SystemExit("No benchmark data found; run `python -m bench.seed` first")
+    return {"users": users, "post_ids": post_ids, "tags": tags}
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}  # endpoint -> list of (latency, status, queries)
+        self.enabled = False
+
+    def record(self, endpoint, latency, status, queries):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((latency, status, queries))
+
+    def summary(self, elapsed):
+        endpoints = {}
+        everything = []
+        for endpoint, samples in sorted(self.samples.items()):
+            endpoints[endpoint] = summarize(samples, elapsed)
+            everything.extend(samples)
+        return endpoints, summarize(everything, elapsed)
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    queries = [sample[2] for sample in samples if sample[2] is not None]
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, status, _ in samples if status == 0 or status >= 500),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 3) if latencies else None,
+            "p95": round(percentile(latencies, 0.95), 3) if latencies else None,
+            "p99": round(percentile(latencies, 0.99), 3) if latencies else None,
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "max": round(latencies[-1], 3) if latencies else None
+        },
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        "status_codes": statuses
+    }
+
+
+class Worker(threading.Thread):
+    def __init__(self, number, base_url, fixtures, recorder, stop, args):
+        super().__init__(name="loadtest-%d" % number, daemon=True)
+        self.rng = random.Random(args.seed + number)
+        self.base = urlsplit(base_url)
+        self.fixtures = fixtures
+        self.recorder = recorder
+        self.stop = stop
+        self.args = args
+        self.user_id, self.username = self.rng.choice(fixtures["users"])
+        self.token = None
+        self.http = None
+        # Rows this worker created, so deletes and updates have something to act on
+        self.own_posts = []
+        self.own_comments = []
+        self.liked = set()
+        self.next_cursor = None
+        self.operations = [
+            ("GET /", 1, self.index),
+            ("GET /sign-token", 1, self.sign_token),
+            ("POST /verify-token", 1, self.verify_token),
+            ("POST /auth/sign-up", 1, self.sign_up),
+            ("POST /auth/sign-in", 1, self.sign_in),
+            ("GET /api/posts", 20, self.list_posts),
+            ("GET /api/posts?cursor", 5, self.list_posts_cursor),
+            ("GET /api/posts?q", 8, self.search_posts),
+            ("GET /api/posts?tag", 6, self.posts_by_tag),
+            ("GET /api/posts?author", 3, self.posts_by_author),
+            ("GET /api/posts/<id>", 20, self.get_post),
+            ("GET /api/posts/<id>/tags-status", 1, self.tags_status),
+            ("GET /api/posts/<id>/comments", 10, self.get_comments),
+            ("GET /api/posts/<id>/likes", 8, self.get_likes),
+            ("GET /api/users/<id>", 4, self.get_user),
+            ("GET /api/users/<id>/posts", 4, self.get_user_posts),
+            ("GET /api/tags", 3, self.get_tags),
+            ("POST /api/posts", 3, self.create_post),
+            ("PUT /api/posts/<id>", 1, self.update_post),
+            ("DELETE /api/posts/<id>", 1, self.delete_post),
+            ("POST /api/posts/<id>/comments", 4, self.add_comment),
+            ("DELETE /api/comments/<id>", 1, self.delete_comment),
+            ("POST /api/posts/<id>/like", 4, self.like),
+            ("DELETE /api/posts/<id>/like", 2, self.unlike),
+            ("PUT /api/users/<id>", 1, self.update_user),
+        ]
+        if args.nlp:
+            # spaCy dominates these; off by default so runs measure the database path
+            self.operations.append(("POST /api/posts/suggest-tags", 1, self.suggest_tags))
+            self.operations.append(("POST /api/posts (untagged)", 1, self.create_untagged_post))
+        self.weights = [weight for _, weight, _ in self.operations]
+
+    # HTTP
+
+    def request(self, endpoint, method, path, body=None, auth=False):
+        headers = {"Connection": "keep-alive"}
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        if auth:
+            headers["Authorization"] = "Bearer %s" % self.token
+        started = time.perf_counter()
+        try:
+            if self.http is None:
+                self.http = http.client.HTTPConnection(self.base.hostname, self.base.port or 80, timeout=self.args.timeout)
+            self.http.request(method, path, body=body, headers=headers)
+            response = self.http.getresponse()
+            data = response.read()
+            status = response.status
+            queries = response.getheader("X-DB-Queries")
+        except (OSError, http.client.HTTPException):
+            if self.http is not None:
+                self.http.close()
+            self.http = None
+            self.recorder.record(endpoint, time.perf_counter() - started, 0, None)
+            return 0, None
+        self.recorder.record(endpoint, time.perf_counter() - started, status, int(queries) if queries is not None else None)
+        try:
+            return status, json.loads(data) if data else None
+        except ValueError:
+            return status, None
+
+    def login(self):
+        status, data = self.request("POST /auth/sign-in", "POST", "/auth/sign-in", {"username": self.username, "password": PASSWORD})
+        if status != 200:
+            raise RuntimeError("Could not sign in as %s (HTTP %s)" % (self.username, status))
+        self.token = data["token"]
+
+    def run(self):
+        try:
+            self.login()
+        except RuntimeError as err:
+            print(err)
+            return
+        while not self.stop.is_set():
+            endpoint, _, operation = self.rng.choices(self.operations, weights=self.weights)[0]
+            operation(endpoint)
+
+    # Workload helpers
+
+    def text(self, low, high):
+        return " ".join(self.rng.choices(WORDS, k=self.rng.randint(low, high)))
+
+    def post_id(self):
+        # Skewed towards the front of the sample so some posts are hot
+        post_ids = self.fixtures["post_ids"]
+        return post_ids[min(len(post_ids) - 1, int(self.rng.paretovariate(1.2)) - 1)]
+
+    def other_user_id(self):
+        return self.rng.choice(self.fixtures["users"])[0]
+
+    # Operations, one per route
+
+    def index(self, endpoint):
+        self.request(endpoint, "GET", "/")
+
+    def sign_token(self, endpoint):
+        self.request(endpoint, "GET", "/sign-token")
+
+    def verify_token(self, endpoint):
+        self.request(endpoint, "POST", "/verify-token", auth=True)
+
+    def sign_up(self, endpoint):
+        username = "bench_signup_%s" % uuid.uuid4().hex[:12]
+        self.request(endpoint, "POST", "/auth/sign-up", {"username": username, "email": username + "@example.com", "password": PASSWORD})
+
+    def sign_in(self, endpoint):
+        self.request(endpoint, "POST", "/auth/sign-in", {"username": self.username, "password": PASSWORD})
+
+    def list_posts(self, endpoint):
+        page = min(50, int(self.rng.paretovariate(1.5)))
+        status, data = self.request(endpoint, "GET", "/api/posts?" + urlencode({"page": page}))
+        if status == 200:
+            self.next_cursor = data.get("next_cursor")
+
+    def list_posts_cursor(self, endpoint):
+        if not self.next_cursor:
+            return self.list_posts("GET /api/posts")
+        status, data = self.request(endpoint, "GET", "/api/posts?" + urlencode({"cursor": self.next_cursor}))
+        self.next_cursor = data.get("next_cursor") if status == 200 else None
+
+    def search_posts(self, endpoint):
+        query = " ".join(self.rng.choices(WORDS[:40], k=self.rng.randint(1, 2)))
+        self.request(endpoint, "GET", "/api/posts?" + urlencode({"q": query}))
+
+    def posts_by_tag(self, endpoint):
+        tags = self.rng.sample(self.fixtures["tags"], k=min(len(self.fixtures["tags"]), self.rng.choice([1, 1, 2])))
+        params = {"tag": ",".join(tags)}
+        if len(tags) > 1 and self.rng.random() < 0.5:
+            params["tag_mode"] = "any"
+        self.request(endpoint, "GET", "/api/posts?" + urlencode(params))
+
+    def posts_by_author(self, endpoint):
+        self.request(endpoint, "GET", "/api/posts?" + urlencode({"author": self.rng.choice(self.fixtures["users"])[1]}))
+
+    def get_post(self, endpoint):
+        self.request(endpoint, "GET", "/api/posts/%d" % self.post_id())
+
+    def tags_status(self, endpoint):
+        self.request(endpoint, "GET", "/api/posts/%d/tags-status" % self.post_id())
+
+    def get_comments(self, endpoint):
+        self.request(endpoint, "GET", "/api/posts/%d/comments" % self.post_id())
+
+    def get_likes(self, endpoint):
+        self.request(endpoint, "GET", "/api/posts/%d/likes" % self.post_id())
+
+    def get_user(self, endpoint):
+        self.request(endpoint, "GET", "/api/users/%d" % self.other_user_id())
+
+    def get_user_posts(self, endpoint):
+        self.request(endpoint, "GET", "/api/users/%d/posts" % self.other_user_id())
+
+    def get_tags(self, endpoint):
+        self.request(endpoint, "GET", "/api/tags")
+
+    def create_post(self, endpoint, tagged=True):
+        body = {"title": self.text(3, 8).capitalize(), "content": self.text(30, 300)}
+        if tagged:
+            body["tags"] = ", ".join(self.rng.sample(self.fixtures["tags"], k=min(3, len(self.fixtures["tags"]))))
+        status, data = self.request(endpoint, "POST", "/api/posts", body, auth=True)
+        if status == 201:
+            self.own_posts.append(data["post"]["id"])
+
+    def create_untagged_post(self, endpoint):
+        self.create_post(endpoint, tagged=False)
+
+    def update_post(self, endpoint):
+        if not self.own_posts:
+            return self.create_post("POST /api/posts")
+        self.request(endpoint, "PUT", "/api/posts/%d" % self.rng.choice(self.own_posts), {"content": self.text(30, 300)}, auth=True)
+
+    def delete_post(self, endpoint):
+        if not self.own_posts:
+            return self.create_post("POST /api/posts")
+        post_id = self.own_posts.pop(self.rng.randrange(len(self.own_posts)))
+        self.request(endpoint, "DELETE", "/api/posts/%d" % post_id, auth=True)
+
+    def add_comment(self, endpoint):
+        status, data = self.request(endpoint, "POST", "/api/posts/%d/comments" % self.post_id(), {"content": self.text(3, 40)}, auth=True)
+        if status == 201:
+            self.own_comments.append(data["comment"]["id"])
+
+    def delete_comment(self, endpoint):
+        if not self.own_comments:
+            return self.add_comment("POST /api/posts/<id>/comments")
+        comment_id = self.own_comments.pop(self.rng.randrange(len(self.own_comments)))
+        self.request(endpoint, "DELETE", "/api/comments/%d" % comment_id, auth=True)
+
+    def like(self, endpoint):
+        post_id = self.post_id()
+        status, _ = self.request(endpoint, "POST", "/api/posts/%d/like" % post_id, auth=True)
+        if status in (201, 400):
+            self.liked.add(post_id)
+
+    def unlike(self, endpoint):
+        if not self.liked:
+            return self.like("POST /api/posts/<id>/like")
+        post_id = self.liked.pop()
+        self.request(endpoint, "DELETE", "/api/posts/%d/like" % post_id, auth=True)
+
+    def update_user(self, endpoint):
+        # Rewrites the seeded email, so the table ends up where it started
+        self.request(endpoint, "PUT", "/api/users/%d" % self.user_id, {"email": self.username + "@example.com"}, auth=True)
+
+    def suggest_tags(self, endpoint):
+        self.request(endpoint, "POST", "/api/posts/suggest-tags", {"content": self.text(30, 300)}, auth=True)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    fixtures = load_fixtures()
+    recorder = Recorder()
+    stop = threading.Event()
+    workers = [Worker(number, args.base_url, fixtures, recorder, stop, args) for number in range(args.concurrency)]
+    for worker in workers:
+        worker.start()
+
+    # Warm caches and connection pools before measuring
+    time.sleep(args.warmup)
+    recorder.enabled = True
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    recorder.enabled = False
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for worker in workers:
+        worker.join(args.timeout + 1)
+
+    endpoints, total = recorder.summary(elapsed)
+    return {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "nlp": args.nlp
+        },
+        "total": total,
+        "endpoints": endpoints
+    }
+
+
+def print_report(result):
+    print("%-36s %8s %8s %9s %9s %9s %7s" % ("endpoint", "reqs", "rps", "p50 ms", "p95 ms", "p99 ms", "q/req"))
+    rows = list(result["endpoints"].items()) + [("TOTAL", result["total"])]
+    for endpoint, stats in rows:
+        latency = stats["latency_ms"]
+        print("%-36s %8d %8.1f %9s %9s %9s %7s" % (
+            endpoint, stats["requests"], stats["throughput_rps"],
+            latency["p50"], latency["p95"], latency["p99"], stats["queries_per_request"]
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before the run")
+    parser.add_argument("--timeout", type=float, default=30, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--nlp", action="store_true", help="include spaCy-bound requests (suggest-tags, untagged posts)")
+    parser.add_argument("--output", help="result file (default: bench/results/<timestamp>.json)")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(result, file, indent=2, sort_keys=True)
+    print("\nWrote %s" % output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Seed a local Postgres with benchmark data.
+
+    python -m bench.seed --users 200 --posts 5000 --comments 20000 --likes 50000
+
+Authors, tags, words and post popularity follow Zipf-like distributions, so a
+few posts and tags are hot and most are cold, as on a real blog. Every seeded
+user is ``bench_user_<n>`` with password ``benchmark``. Runs fully offline and
+is deterministic for a given ``--seed``.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+import psycopg2.extras
+from db_utils import pooled_connection
+from passwords import hash_password
+
+USERNAME_PREFIX = "bench_user_"
+PASSWORD = "benchmark"
+
+TAGS = [
+    "anime", "manga", "review", "one piece", "naruto", "jujutsu kaisen", "attack on titan",
+    "demon slayer", "my hero academia", "spy x family", "chainsaw man", "studio ghibli",
+    "shonen", "seinen", "shojo", "isekai", "mecha", "slice of life", "romance", "horror",
+    "fantasy", "sci-fi", "sports", "music", "opening", "ending", "soundtrack", "cosplay",
+    "figures", "convention", "season premiere", "finale", "recap", "theory", "ranking",
+    "voice acting", "animation", "light novel", "webtoon", "adaptation"
+]
+
+WORDS = (
+    "the episode season arc character story animation studio fight scene opening ending "
+    "soundtrack villain hero friendship training power tournament battle emotional plot twist "
+    "adaptation manga chapter panel artist director voice actor sakuga pacing filler canon "
+    "cliffhanger flashback backstory worldbuilding magic school rival team mission sacrifice "
+    "betrayal redemption comedy drama romance mystery thriller horror mecha robot pilot space "
+    "dragon demon spirit sword ninja pirate captain crew island treasure journey quest kingdom "
+    "festival summer winter rain city village forest ocean mountain sky night dream memory"
+).split()
+
+
+def zipf_weights(n, s=1.1):
+    return [1.0 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def sentence(rng, word_weights, low, high):
+    return " ".join(rng.choices(WORDS, weights=word_weights, k=rng.randint(low, high)))
+
+
+def reset(cursor):
+    # Removes only data created by the seeder and the load test
+    cursor.execute("SELECT id FROM users WHERE username LIKE 'bench\\_%%';")
+    user_ids = [row[0] for row in cursor.fetchall()]
+    if not user_ids:
+        return
+    cursor.execute("DELETE FROM likes WHERE user_id = ANY(%s) OR post_id IN (SELECT id FROM posts WHERE user_id = ANY(%s));", (user_ids, user_ids))
+    cursor.execute("DELETE FROM comments WHERE user_id = ANY(%s) OR post_id IN (SELECT id FROM posts WHERE user_id = ANY(%s));", (user_ids, user_ids))
+    cursor.execute("DELETE FROM posts WHERE user_id = ANY(%s);", (user_ids,))
+    cursor.execute("DELETE FROM users WHERE id = ANY(%s);", (user_ids,))
+
+
+def seed(users, posts, comments, likes, seed_value=42, batch_size=1000):
+    rng = random.Random(seed_value)
+    word_weights = zipf_weights(len(WORDS))
+    tag_weights = zipf_weights(len(TAGS))
+    now = datetime.now(timezone.utc)
+    password_hash = hash_password(PASSWORD)
+
+    with pooled_connection() as connection:
+        cursor = connection.cursor()
+
+        started = time.perf_counter()
+        user_ids = [row[0] for row in psycopg2.extras.execute_values(
+            cursor,
+            "INSERT INTO users (username, email, password) VALUES %s RETURNING id;",
+            [(f"{USERNAME_PREFIX}{n}", f"{USERNAME_PREFIX}{n}@example.com", password_hash) for n in range(users)],
+            page_size=batch_size,
+            fetch=True
+        )]
+        connection.commit()
+        print(f"users: {len(user_ids)} in {time.perf_counter() - started:.1f}s")
+
+        # A few prolific authors write most of the posts
+        author_weights = zipf_weights(len(user_ids), s=0.9)
+        started = time.perf_counter()
+        post_ids = []
+        for offset in range(0, posts, batch_size):
+            rows = []
+            for _ in range(min(batch_size, posts - offset)):
+                tags = list(dict.fromkeys(rng.choices(TAGS, weights=tag_weights, k=rng.randint(1, 5))))
+                rows.append((
+                    sentence(rng, word_weights, 3, 8).capitalize(),
+                    sentence(rng, word_weights, 30, 400),
+                    ", ".join(tags),
+                    rng.choices(user_ids, weights=author_weights)[0],
+                    now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+                ))
+            post_ids.extend(row[0] for row in psycopg2.extras.execute_values(
+                cursor,
+                "INSERT INTO posts (title, content, tags, user_id, created_at) VALUES %s RETURNING id;",
+                rows,
+                page_size=batch_size,
+                fetch=True
+            ))
+            connection.commit()
+        print(f"posts: {len(post_ids)} in {time.perf_counter() - started:.1f}s")
+
+        # Comments and likes concentrate on popular posts
+        post_weights = zipf_weights(len(post_ids), s=1.0)
+        started = time.perf_counter()
+        for offset in range(0, comments, batch_size):
+            rows = [
+                (sentence(rng, word_weights, 3, 60), rng.choice(user_ids), rng.choices(post_ids, weights=post_weights)[0])
+                for _ in range(min(batch_size, comments - offset))
+            ]
+            psycopg2.extras.execute_values(cursor, "INSERT INTO comments (content, user_id, post_id) VALUES %s;", rows, page_size=batch_size)
+            connection.commit()
+        print(f"comments: {comments} in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        pairs = set()
+        attempts = 0
+        while len(pairs) < likes and attempts < likes * 10:
+            pairs.add((rng.choice(user_ids), rng.choices(post_ids, weights=post_weights)[0]))
+            attempts += 1
+        pairs = sorted(pairs)
+        for offset in range(0, len(pairs), batch_size):
+            psycopg2.extras.execute_values(
+                cursor,
+                "INSERT INTO likes (user_id, post_id) VALUES %s ON CONFLICT DO NOTHING;",
+                pairs[offset:offset + batch_size],
+                page_size=batch_size
+            )
+            connection.commit()
+        print(f"likes: {len(pairs)} in {time.perf_counter() - started:.1f}s")
+
+        cursor.execute("ANALYZE;")
+        connection.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--comments", type=int, default=20000)
+    parser.add_argument("--likes", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--reset", action="store_true", help="delete previously seeded bench_* users and their data first")
+    args = parser.parse_args()
+
+    if args.reset:
+        with pooled_connection() as connection:
+            reset(connection.cursor())
+            connection.commit()
+    seed(args.users, args.posts, args.comments, args.likes, args.seed, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
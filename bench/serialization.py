@@ -0,0 +1,77 @@
+"""Time JSON serialization of a page of posts, per JSON provider.
+
+    python -m bench.serialization --posts 100 --repeat 2000
+
+Builds a synthetic page shaped like a ``GET /api/posts`` response and times
+``jsonify`` with Flask's stdlib provider and with the orjson provider (both
+date formats), plus the size after gzip and brotli. Needs no database.
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from bench.seed import TAGS, WORDS
+import responses
+
+
+def make_page(posts, rng):
+    now = datetime.now()
+    return {
+        "posts": [
+            {
+                "id": n, "title": " ".join(rng.choices(WORDS, k=6)), "content": " ".join(rng.choices(WORDS, k=rng.randint(30, 400))),
+                "tags": ", ".join(rng.sample(TAGS, 3)), "tags_status": "done", "media_url": None, "user_id": rng.randint(1, 200),
+                "author": "bench_user_%d" % rng.randint(1, 200), "created_at": now - timedelta(minutes=n), "updated_at": now,
+                "like_count": rng.randint(0, 500), "comment_count": rng.randint(0, 50)
+            }
+            for n in range(posts)
+        ],
+        "page": 1, "limit": posts, "next_cursor": "WyJkYXRlIiwiMjAyNi0xMC0xN1QxMjowMDowMCIsMTAwXQ"
+    }
+
+
+def time_provider(app, page, repeat):
+    with app.app_context():
+        app.json.response(page)  # warm up
+        started = time.perf_counter()
+        for _ in range(repeat):
+            body = app.json.response(page).get_data()
+        return (time.perf_counter() - started) / repeat, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    page = make_page(args.posts, random.Random(42))
+    providers = [("stdlib", DefaultJSONProvider, "http")]
+    if responses.orjson is not None:
+        providers += [("orjson", responses.OrJSONProvider, "http"), ("orjson-iso", responses.OrJSONProvider, "iso")]
+
+    results = {}
+    for name, provider, date_format in providers:
+        responses.JSON_DATETIME_FORMAT = date_format
+        app = Flask(__name__)
+        app.json = provider(app)
+        seconds, body = time_provider(app, page, args.repeat)
+        results[name] = {"ms_per_page": round(seconds * 1000, 4), "bytes": len(body), "gzip_bytes": len(gzip.compress(body, responses.GZIP_LEVEL))}
+        if responses.brotli is not None:
+            results[name]["brotli_bytes"] = len(responses.brotli.compress(body, quality=responses.BROTLI_QUALITY))
+    responses.JSON_DATETIME_FORMAT = "http"
+
+    for name, result in results.items():
+        print("%-12s %8.3f ms/page  %s" % (name, result["ms_per_page"], ", ".join("%s=%d" % item for item in result.items() if item[0] != "ms_per_page")))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"posts": args.posts, "repeat": args.repeat, "providers": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
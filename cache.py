@@ -0,0 +1,310 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlencode
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MISSING = object()
+
+
+class MemoryCache:
+    """Per-process LRU cache with a size bound and per-entry TTL."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        # namespace -> (generation, bumped_at), oldest bump first. Generations come
+        # from one counter and are never reused, so a namespace can be forgotten
+        # (back to 0) once every entry stored before its last bump has expired.
+        self._generations = OrderedDict()
+        self._last_generation = 0
+        self._max_ttl = 0.0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._max_ttl = max(self._max_ttl, ttl)
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def generation(self, namespace):
+        with self._lock:
+            entry = self._generations.get(namespace)
+            return 0 if entry is None else entry[0]
+
+    def bump(self, namespace):
+        with self._lock:
+            now = time.monotonic()
+            self._last_generation += 1
+            self._generations[namespace] = (self._last_generation, now)
+            self._generations.move_to_end(namespace)
+            while self._generations:
+                _, bumped_at = next(iter(self._generations.values()))
+                if bumped_at + self._max_ttl > now:
+                    break
+                self._generations.popitem(last=False)
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteCache:
+    """Cache shared by every worker process on the host, stored in one SQLite file.
+
+    A local stand-in for a shared cache server. Entries past the size bound are
+    evicted oldest-written first, so reads never have to write.
+    """
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self.evictions = 0
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL;")
+        connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, expires_at REAL, stored_at REAL);")
+        connection.execute("CREATE INDEX IF NOT EXISTS entries_stored_at ON entries (stored_at);")
+        connection.execute("CREATE TABLE IF NOT EXISTS generations (namespace TEXT PRIMARY KEY, generation INTEGER);")
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads, or across fork()
+        connection, pid = getattr(self._local, "connection", (None, None))
+        if connection is None or pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.connection = (connection, os.getpid())
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute("SELECT value, expires_at FROM entries WHERE key = ?;", (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return MISSING
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl):
+        connection = self._connection()
+        now = time.time()
+        connection.execute(
+            "INSERT OR REPLACE INTO entries (key, value, expires_at, stored_at) VALUES (?, ?, ?, ?);",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), now + ttl, now)
+        )
+        (count,) = connection.execute("SELECT COUNT(*) FROM entries;").fetchone()
+        if count > self.max_entries:
+            excess = count - self.max_entries
+            connection.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY expires_at <= ? DESC, stored_at LIMIT ?);",
+                (now, excess)
+            )
+            self.evictions += excess
+
+    def generation(self, namespace):
+        row = self._connection().execute("SELECT generation FROM generations WHERE namespace = ?;", (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, namespace):
+        self._connection().execute(
+            """
+            INSERT INTO generations (namespace, generation) VALUES (?, 1)
+            ON CONFLICT (namespace) DO UPDATE SET generation = generation + 1;
+            """,
+            (namespace,)
+        )
+
+    def size(self):
+        return self._connection().execute("SELECT COUNT(*) FROM entries;").fetchone()[0]
+
+
+class ReadCache:
+    """Read-through cache for handler results with namespace invalidation.
+
+    Every entry is stored under the current generation of each namespace it
+    depends on (a post, a post's comments, the post listings, ...). Bumping a
+    namespace on write makes all of its entries unreachable at once; they then
+    age out through the backend's TTL and size bound.
+
+    With ``reinvalidate_after`` set, every invalidation is repeated that many
+    seconds later, so an entry filled from a replica that hadn't caught up
+    with the write yet is dropped too. The repeat runs on this process's next
+    cache call: exact for the memory backend, best effort for the shared ones.
+    """
+
+    def __init__(self, backend, default_ttl=30.0, reinvalidate_after=0.0):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.reinvalidate_after = reinvalidate_after
+        self._deferred = deque()  # (monotonic due time, namespaces)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return not isinstance(self.backend, NullCache)
+
+    def tolerates_lag(self, seconds):
+        # Whether fills may read a replica up to this far behind without caching pre-write data
+        return not self.enabled or self.reinvalidate_after >= seconds
+
+    def _bump_due(self):
+        if not self._deferred:
+            return
+        now = time.monotonic()
+        due = set()
+        with self._lock:
+            while self._deferred and self._deferred[0][0] <= now:
+                due.update(self._deferred.popleft()[1])
+        self._bump(due)
+
+    def _versioned_key(self, key, namespaces):
+        self._bump_due()
+        versions = ",".join("%s@%d" % (namespace, self.backend.generation(namespace)) for namespace in namespaces)
+        return "%s|%s" % (key, versions)
+
+    def get_or_load(self, key, namespaces, loader, ttl=None):
+        # Cached values must be treated as read-only; the memory backend shares them between requests
+        try:
+            versioned_key = self._versioned_key(key, namespaces)
+            value = self.backend.get(versioned_key)
+        except Exception:
+            # A broken cache must never take reads down with it
+            with self._lock:
+                self.errors += 1
+            return loader()
+        if value is not MISSING:
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._lock:
+            self.misses += 1
+        value = loader()
+        if value is not None:
+            try:
+                self.backend.set(versioned_key, value, self.default_ttl if ttl is None else ttl)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+        return value
+
+    async def get_or_load_async(self, key, namespaces, loader, ttl=None):
+        # Same as get_or_load for the async handlers; loader is a coroutine function
+        try:
+            versioned_key = self._versioned_key(key, namespaces)
+            value = self.backend.get(versioned_key)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            return await loader()
+        if value is not MISSING:
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._lock:
+            self.misses += 1
+        value = await loader()
+        if value is not None:
+            try:
+                self.backend.set(versioned_key, value, self.default_ttl if ttl is None else ttl)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+        return value
+
+    def invalidate(self, *namespaces):
+        self._bump_due()
+        self._bump(namespaces)
+        if self.reinvalidate_after > 0:
+            with self._lock:
+                self._deferred.append((time.monotonic() + self.reinvalidate_after, namespaces))
+
+    def _bump(self, namespaces):
+        for namespace in namespaces:
+            try:
+                self.backend.bump(namespace)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": type(self.backend).__name__,
+                "entries": self.backend.size(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.backend.evictions,
+                "errors": self.errors,
+            }
+
+
+class NullCache:
+    """Disables caching (CACHE_BACKEND=none)."""
+
+    evictions = 0
+
+    def get(self, key):
+        return MISSING
+
+    def set(self, key, value, ttl):
+        pass
+
+    def generation(self, namespace):
+        return 0
+
+    def bump(self, namespace):
+        pass
+
+    def size(self):
+        return 0
+
+
+def cache_key(prefix, args):
+    # Canonical key for a listing: same query parameters in any order share an entry
+    # (urlencoded, so a value containing & or = can't pass for a different query)
+    return prefix + "?" + urlencode(sorted(args.items(multi=True)))
+
+
+def _create_backend():
+    backend = os.getenv('CACHE_BACKEND', 'memory')
+    if backend == 'none':
+        return NullCache()
+    if backend == 'sqlite':
+        return SQLiteCache(
+            os.getenv('CACHE_SQLITE_PATH', '/tmp/anime_blog_cache.sqlite3'),
+            max_entries=int(os.getenv('CACHE_MAX_ENTRIES', 10000))
+        )
+    if backend == 'memory':
+        return MemoryCache(max_entries=int(os.getenv('CACHE_MAX_ENTRIES', 1024)))
+    raise ValueError("Unknown CACHE_BACKEND: %s" % backend)
+
+
+# With read replicas, cache fills may read a replica (see db_utils.get_read_connection)
+# as long as invalidations are repeated after the assumed replication lag
+read_cache = ReadCache(
+    _create_backend(),
+    default_ttl=float(os.getenv('CACHE_TTL', 30)),
+    reinvalidate_after=float(os.getenv(
+        'CACHE_REINVALIDATE_SECONDS', os.getenv('DB_READ_YOUR_WRITES_SECONDS', 5) if os.getenv('DB_REPLICA_HOSTS') else 0
+    ))
+)
@@ -0,0 +1,280 @@
+import csv
+import io
+import itertools
+import json
+import os
+import time
+import click
+from db_utils import pooled_connection
+
+
+# Actual counts vs. the denormalized ones kept by the count triggers
+POST_COUNTER_DRIFT = """
+    SELECT posts.id, posts.like_count, posts.comment_count,
+           COALESCE(likes.actual, 0) AS actual_like_count,
+           COALESCE(comments.actual, 0) AS actual_comment_count
+    FROM posts
+    LEFT JOIN (SELECT post_id, COUNT(*) AS actual FROM likes GROUP BY post_id) AS likes ON likes.post_id = posts.id
+    LEFT JOIN (SELECT post_id, COUNT(*) AS actual FROM comments GROUP BY post_id) AS comments ON comments.post_id = posts.id
+    WHERE posts.like_count <> COALESCE(likes.actual, 0)
+       OR posts.comment_count <> COALESCE(comments.actual, 0)
+"""
+
+TAG_COUNTER_DRIFT = """
+    SELECT tags.id, tags.name, tags.post_count, COALESCE(counts.actual, 0) AS actual_post_count
+    FROM tags
+    LEFT JOIN (SELECT tag_id, COUNT(*) AS actual FROM post_tags GROUP BY tag_id) AS counts ON counts.tag_id = tags.id
+    WHERE tags.post_count <> COALESCE(counts.actual, 0)
+"""
+
+
+@click.command('reconcile-counters')
+@click.option('--dry-run', is_flag=True, help="Report drift without repairing it.")
+def reconcile_counters(dry_run):
+    """Check denormalized like, comment and tag counts and repair any drift."""
+    with pooled_connection() as connection:
+        cursor = connection.cursor()
+
+        cursor.execute(POST_COUNTER_DRIFT + " FOR UPDATE OF posts;")
+        posts = cursor.fetchall()
+        for post_id, like_count, comment_count, actual_likes, actual_comments in posts:
+            click.echo(f"post {post_id}: like_count {like_count} -> {actual_likes}, comment_count {comment_count} -> {actual_comments}")
+        if posts and not dry_run:
+            cursor.executemany(
+                "UPDATE posts SET like_count = %s, comment_count = %s WHERE id = %s;",
+                [(actual_likes, actual_comments, post_id) for post_id, _, _, actual_likes, actual_comments in posts]
+            )
+
+        cursor.execute(TAG_COUNTER_DRIFT + " FOR UPDATE OF tags;")
+        tags = cursor.fetchall()
+        for tag_id, name, post_count, actual in tags:
+            click.echo(f"tag {name!r}: post_count {post_count} -> {actual}")
+        if tags and not dry_run:
+            cursor.executemany(
+                "UPDATE tags SET post_count = %s WHERE id = %s;",
+                [(actual, tag_id) for tag_id, _, _, actual in tags]
+            )
+
+        if dry_run:
+            connection.rollback()
+            click.echo(f"{len(posts)} posts and {len(tags)} tags have drifted (dry run, nothing changed)")
+        else:
+            connection.commit()
+            click.echo(f"Repaired {len(posts)} posts and {len(tags)} tags")
+
+
+IMPORT_COLUMNS = ["record", "title", "content", "author", "tags", "media_url", "created_at"]
+
+# Rows are COPYed here, then merged into posts with one set-based INSERT per batch
+CREATE_IMPORT_STAGING = """
+    CREATE TEMP TABLE IF NOT EXISTS post_import_staging (
+        record BIGINT,
+        title TEXT,
+        content TEXT,
+        author TEXT,
+        tags TEXT,
+        media_url TEXT,
+        created_at TIMESTAMP
+    ) ON COMMIT DELETE ROWS;
+"""
+
+MERGE_IMPORT_STAGING = """
+    INSERT INTO posts (title, content, tags, tags_status, user_id, media_url, created_at)
+    SELECT staging.title, staging.content, COALESCE(staging.tags, ''), 'done', users.id,
+           staging.media_url, COALESCE(staging.created_at, CURRENT_TIMESTAMP)
+    FROM post_import_staging AS staging
+    JOIN users ON users.username = staging.author
+    ORDER BY staging.record;
+"""
+
+UNKNOWN_IMPORT_AUTHORS = """
+    SELECT staging.record, staging.author
+    FROM post_import_staging AS staging
+    LEFT JOIN users ON users.username = staging.author
+    WHERE users.id IS NULL
+    ORDER BY staging.record;
+"""
+
+
+def read_import_records(file, file_format):
+    # Yields one dict per post without reading the whole file
+    if file_format == "csv":
+        yield from csv.DictReader(file)
+        return
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as err:
+            raise click.ClickException(f"Line {line_number} is not valid JSON: {err}")
+
+
+def import_tags(value):
+    # NDJSON may carry a list of tags; the posts.tags column is comma-separated
+    if isinstance(value, list):
+        return ", ".join(str(tag) for tag in value if tag)
+    return value or None
+
+
+def copy_import_batch(cursor, batch):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        # In CSV COPY an unquoted empty field is NULL
+        writer.writerow(["" if value is None else value for value in row])
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY post_import_staging ({', '.join(IMPORT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+@click.command('import-posts')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(["ndjson", "csv"]), help="Defaults to the file extension.")
+@click.option('--batch-size', default=5000, show_default=True, help="Posts per COPY and commit.")
+@click.option('--suggest-tags', is_flag=True, help="Tag untagged posts with spaCy, a batch at a time.")
+@click.option('--source', help="Name used to track progress; defaults to the file's absolute path.")
+@click.option('--restart', is_flag=True, help="Ignore saved progress and start from the first record.")
+def import_posts(path, file_format, batch_size, suggest_tags, source, restart):
+    """Bulk import posts from NDJSON or CSV.
+
+    Each record needs title, content and author (a username), and may have
+    tags, media_url and created_at. Batches are COPYed into a staging table and
+    merged into posts in one statement; progress is committed with each batch,
+    so re-running the command resumes after the last committed batch.
+    """
+    file_format = file_format or ("csv" if path.lower().endswith(".csv") else "ndjson")
+    source = source or os.path.abspath(path)
+    if suggest_tags:
+        from tagging import suggest_tags_many
+
+    with pooled_connection() as connection, open(path, newline="" if file_format == "csv" else None, encoding="utf-8") as file:
+        cursor = connection.cursor()
+        cursor.execute(CREATE_IMPORT_STAGING)
+        cursor.execute(
+            "INSERT INTO post_imports (source) VALUES (%s) ON CONFLICT (source) DO NOTHING;",
+            (source,)
+        )
+        if restart:
+            cursor.execute("UPDATE post_imports SET records_done = 0, posts_imported = 0 WHERE source = %s;", (source,))
+        cursor.execute("SELECT records_done, posts_imported FROM post_imports WHERE source = %s;", (source,))
+        records_done, posts_imported = cursor.fetchone()
+        connection.commit()
+        if records_done:
+            click.echo(f"Resuming {source} after record {records_done}")
+
+        records = enumerate(read_import_records(file, file_format), 1)
+        records = itertools.islice(records, records_done, None)
+        started = time.monotonic()
+        skipped = 0
+        while True:
+            batch = []
+            read = 0
+            for record_number, record in itertools.islice(records, batch_size):
+                read += 1
+                records_done = record_number
+                if not record.get("title") or not record.get("content") or not record.get("author"):
+                    click.echo(f"record {record_number}: skipped, title, content and author are required", err=True)
+                    skipped += 1
+                    continue
+                batch.append([
+                    record_number, record["title"], record["content"], record["author"],
+                    import_tags(record.get("tags")), record.get("media_url") or None, record.get("created_at") or None
+                ])
+            if not read:
+                break
+
+            if suggest_tags and batch:
+                untagged = [row for row in batch if not row[4]]
+                if untagged:
+                    for row, tags in zip(untagged, suggest_tags_many([row[2] for row in untagged])):
+                        row[4] = ", ".join(tags)
+
+            if batch:
+                copy_import_batch(cursor, batch)
+                cursor.execute(UNKNOWN_IMPORT_AUTHORS)
+                for record_number, author in cursor.fetchall():
+                    click.echo(f"record {record_number}: skipped, unknown author {author!r}", err=True)
+                    skipped += 1
+                cursor.execute(MERGE_IMPORT_STAGING)
+                posts_imported += cursor.rowcount
+            # Progress commits with the batch, so a crash never imports a record twice
+            cursor.execute(
+                "UPDATE post_imports SET records_done = %s, posts_imported = %s, updated_at = CURRENT_TIMESTAMP WHERE source = %s;",
+                (records_done, posts_imported, source)
+            )
+            connection.commit()
+
+            elapsed = time.monotonic() - started
+            click.echo(f"{records_done} records read, {posts_imported} posts imported, {skipped} skipped ({elapsed:.0f}s)")
+
+        click.echo(f"Done: {posts_imported} posts imported from {source}, {skipped} skipped in this run")
+
+
+@click.command('refresh-trending')
+def refresh_trending():
+    """Fold pending like and comment events into the trending scores now."""
+    from trending import get_trending_refresher
+    events, pruned = get_trending_refresher().refresh()
+    click.echo(f"Folded {events} events, pruned {pruned} stale scores")
+
+
+@click.group('db')
+def db():
+    """Apply and inspect schema migrations (migrations/NNN_name.sql)."""
+
+
+@db.command('upgrade')
+@click.option('--to', 'target', type=int, help="Stop after this version.")
+def db_upgrade(target):
+    """Apply pending migrations in order."""
+    from schema import MigrationError, upgrade
+    try:
+        applied = upgrade(target, echo=click.echo)
+    except MigrationError as err:
+        raise click.ClickException(str(err))
+    click.echo(f"Applied {len(applied)} migrations" if applied else "Already up to date")
+
+
+@db.command('status')
+def db_status():
+    """List migrations and when each was applied."""
+    from schema import migration_status
+    for migration, applied_at, changed in migration_status():
+        state = f"applied {applied_at:%Y-%m-%d %H:%M}" if applied_at else "pending"
+        if changed:
+            state += ", file changed since"
+        click.echo(f"{migration.version:03d}_{migration.name}: {state}")
+
+
+@db.command('stamp')
+@click.argument('version', type=int)
+def db_stamp(version):
+    """Mark migrations up to VERSION as applied without running them, for
+    databases set up before migrations were tracked."""
+    from schema import stamp
+    stamped = stamp(version)
+    click.echo(f"Marked {len(stamped)} migrations as applied")
+
+
+@db.command('check-plans')
+@click.option('--min-rows', default=10000, show_default=True, help="Sequential scans of smaller tables are allowed.")
+def db_check_plans(min_rows):
+    """EXPLAIN each route's query and fail on sequential scans of large tables.
+
+    Uses the planner's row estimates, so run it against a database with
+    production-like data that has been ANALYZEd.
+    """
+    from schema import check_plans
+    problems = check_plans(min_rows)
+    for route, table, rows in problems:
+        click.echo(f"{route}: sequential scan on {table} (~{rows} rows)", err=True)
+    if problems:
+        raise click.ClickException(f"{len(problems)} queries scan large tables sequentially")
+    click.echo("No sequential scans on large tables")
+
+
+def register_commands(app):
+    app.cli.add_command(reconcile_counters)
+    app.cli.add_command(import_posts)
+    app.cli.add_command(refresh_trending)
+    app.cli.add_command(db)
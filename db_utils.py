@@ -1,15 +1,503 @@
 import psycopg2
+import itertools
 import os
+import threading
+import time
 import psycopg2.extras
+import psycopg2.extensions
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from flask import g, has_app_context, request
+from cache import read_cache
+from slow_queries import slow_query_log
 
 load_dotenv()
 
-def get_db_connection():
-    connection = psycopg2.connect(
-        host='localhost',
-        database='anime_blog',
-        user=os.getenv('POSTGRES_USERNAME'),
-        password=os.getenv('POSTGRES_PASSWORD')
+
+class PoolTimeout(Exception):
+    pass
+
+
+def record_query(duration):
+    # Per-request query count and DB time, read by the request instrumentation
+    if has_app_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        g.db_time = g.get('db_time', 0.0) + duration
+
+
+class DictRowCursor(psycopg2.extensions.cursor):
+    """Returns rows as plain dicts.
+
+    Lighter than RealDictCursor (no RealDictRow, no per-row column mapping
+    object) and serialized directly by the JSON provider.
+    """
+
+    def _columns(self):
+        return [column.name for column in self.description]
+
+    def fetchone(self):
+        row = super().fetchone()
+        return None if row is None else dict(zip(self._columns(), row))
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if not rows:
+            return rows
+        columns = self._columns()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if not rows:
+            return rows
+        columns = self._columns()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def __iter__(self):
+        # super().__iter__() is the cursor itself; next() on it hits the C iterator, which yields tuples
+        rows = super().__iter__()
+        columns = None
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            if columns is None:
+                columns = self._columns()
+            yield dict(zip(columns, row))
+
+
+_instrumented_cursors = {}
+
+
+def _instrumented_cursor(cursor_class):
+    # Subclass whichever cursor the caller asked for (RealDictCursor, plain, named)
+    # so every statement is timed without changing call sites
+    instrumented = _instrumented_cursors.get(cursor_class)
+    if instrumented is None:
+        class InstrumentedCursor(cursor_class):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    result = super().execute(query, vars)
+                except Exception:
+                    record_query(time.perf_counter() - started)
+                    raise
+                duration = time.perf_counter() - started
+                record_query(duration)
+                if slow_query_log is not None and duration >= slow_query_log.threshold:
+                    slow_query_log.record(self, query, vars, duration)
+                return result
+
+            def executemany(self, query, vars_list):
+                started = time.perf_counter()
+                try:
+                    result = super().executemany(query, vars_list)
+                except Exception:
+                    record_query(time.perf_counter() - started)
+                    raise
+                duration = time.perf_counter() - started
+                record_query(duration)
+                if slow_query_log is not None and duration >= slow_query_log.threshold:
+                    slow_query_log.record(self, query, None, duration, explain=False)
+                return result
+
+        instrumented = _instrumented_cursors.setdefault(cursor_class, InstrumentedCursor)
+    return instrumented
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        cursor_class = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _instrumented_cursor(cursor_class)
+        return super().cursor(*args, **kwargs)
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool.
+
+    Connections are opened lazily up to ``maxconn``; callers block for up to
+    ``timeout`` seconds when the pool is exhausted. A connection that has sat
+    idle for longer than ``health_check_after`` seconds is pinged before it is
+    handed out, and replaced if the ping fails.
+    """
+
+    def __init__(self, minconn, maxconn, timeout=10.0, health_check_after=30.0, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: min=%s max=%s" % (minconn, maxconn))
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self._connect_kwargs = connect_kwargs
+        self._cond = threading.Condition()
+        self._idle = []  # stack of (connection, returned_at)
+        self._size = 0  # open connections, including ones being opened
+        self._in_use = 0
+
+        # Stats
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        return psycopg2.connect(**self._connect_kwargs)
+
+    def _checkout(self, deadline):
+        # Returns (connection, returned_at) for an idle connection, or
+        # (None, None) when the caller has reserved a slot to open a new one.
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.maxconn:
+                    self._size += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout("Timed out after %.1fs waiting for a database connection" % self.timeout)
+                self._cond.wait(remaining)
+
+    def _is_healthy(self, connection, returned_at):
+        if connection.closed:
+            return False
+        if time.monotonic() - returned_at < self.health_check_after:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.close()
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._discarded += 1
+            self._cond.notify()
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            connection, returned_at = self._checkout(deadline)
+            if connection is None:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(connection, returned_at):
+                self._discard(connection)
+                continue
+            waited = time.monotonic() - started
+            with self._cond:
+                self._in_use += 1
+                self._checkouts += 1
+                if waited > 0.001:
+                    self._waits += 1
+                self._wait_time_total += waited
+                self._wait_time_max = max(self._wait_time_max, waited)
+            return connection
+
+    def putconn(self, connection, discard=False):
+        if not discard and not connection.closed:
+            try:
+                # Never hand the next caller an open or aborted transaction
+                if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                if connection.autocommit:
+                    connection.autocommit = False
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+        if discard or connection.closed:
+            self._discard(connection)
+            return
+        with self._cond:
+            self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for connection, _ in idle:
+            try:
+                connection.close()
+            except psycopg2.Error:
+                pass
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time_total": round(self._wait_time_total, 6),
+                "wait_time_avg": round(self._wait_time_total / self._checkouts, 6) if self._checkouts else 0.0,
+                "wait_time_max": round(self._wait_time_max, 6),
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+            }
+
+
+def get_connect_kwargs(host=None, port=None):
+    # Shared by the psycopg2 pools and the psycopg 3 async pool (async_db.py); defaults to the primary
+    kwargs = {
+        "host": host or os.getenv('DB_HOST', 'localhost'),
+        "dbname": 'anime_blog',
+        "user": os.getenv('POSTGRES_USERNAME'),
+        "password": os.getenv('POSTGRES_PASSWORD')
+    }
+    port = port or os.getenv('DB_PORT')
+    if port:
+        kwargs["port"] = int(port)
+    return kwargs
+
+
+def parse_replica_hosts(value):
+    # DB_REPLICA_HOSTS="replica1,replica2:5433" -> [("replica1", None), ("replica2", 5433)]
+    replicas = []
+    for entry in (value or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.partition(":")
+        replicas.append((host, int(port) if port else None))
+    return replicas
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def create_pool(minconn, maxconn, **connect_kwargs):
+    return ConnectionPool(
+        minconn=minconn,
+        maxconn=maxconn,
+        timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        health_check_after=float(os.getenv('DB_POOL_HEALTH_CHECK_AFTER', 30)),
+        connection_factory=InstrumentedConnection,
+        **connect_kwargs
     )
-    return connection
\ No newline at end of file
+
+
+def get_pool():
+    # Pools are per process: a pool inherited across fork() shares sockets with the parent
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = create_pool(int(os.getenv('DB_POOL_MIN', 1)), int(os.getenv('DB_POOL_MAX', 10)), **get_connect_kwargs())
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def get_pool_stats():
+    # None until this process has opened its pool; never connects, so /stats
+    # and /metrics still answer while the database is down
+    pool = _pool
+    if pool is None or _pool_pid != os.getpid():
+        return None
+    return pool.stats()
+
+
+class Replica:
+    """A read replica's pool plus its health.
+
+    A replica that refuses connections is skipped for ``retry_after`` seconds;
+    the pool's own idle ping catches connections that died in between.
+    """
+
+    def __init__(self, host, port, retry_after):
+        self.name = host if port is None else "%s:%s" % (host, port)
+        # minconn=0 so a replica that is down at startup doesn't stop the app
+        self.pool = create_pool(0, int(os.getenv('DB_REPLICA_POOL_MAX', os.getenv('DB_POOL_MAX', 10))), **get_connect_kwargs(host, port))
+        self.retry_after = retry_after
+        self.down_until = 0.0
+        self.failures = 0
+
+    def is_up(self):
+        return time.monotonic() >= self.down_until
+
+    def mark_down(self):
+        self.down_until = time.monotonic() + self.retry_after
+        self.failures += 1
+
+    def stats(self):
+        return dict(self.pool.stats(), name=self.name, up=self.is_up(), failures=self.failures)
+
+
+_replicas = None
+_replicas_pid = None
+_replica_turn = itertools.count()
+
+# Reads stay on the primary this long after a user's own write, to cover replication lag
+READ_YOUR_WRITES_SECONDS = float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', 5))
+PRIMARY_UNTIL_COOKIE = 'db_primary_until'
+_recent_writers = {}  # user id -> monotonic time until which their reads go to the primary
+_recent_writers_lock = threading.Lock()
+
+
+def get_replicas():
+    global _replicas, _replicas_pid
+    if _replicas is None or _replicas_pid != os.getpid():
+        with _pool_lock:
+            if _replicas is None or _replicas_pid != os.getpid():
+                retry_after = float(os.getenv('DB_REPLICA_RETRY_AFTER', 30))
+                _replicas = [Replica(host, port, retry_after) for host, port in parse_replica_hosts(os.getenv('DB_REPLICA_HOSTS'))]
+                _replicas_pid = os.getpid()
+    return _replicas
+
+
+def choose_replicas(replicas):
+    # Healthy replicas, least busy first; round-robin among equally busy ones
+    turn = next(_replica_turn)
+    count = len(replicas)
+    healthy = [(index, replica) for index, replica in enumerate(replicas) if replica.is_up()]
+    healthy.sort(key=lambda item: (item[1].pool.stats()["in_use"], (item[0] - turn) % count))
+    return [replica for _, replica in healthy]
+
+
+def _request_user_id():
+    # GET routes are public, so look at the bearer token only if the client sent one
+    if 'user' in g:
+        return g.user.get("id")
+    header = request.headers.get('Authorization')
+    if not header:
+        return None
+    try:
+        from auth_middleware import decode_token
+        claims = decode_token(header.split(' ')[1])
+        return (claims.get("payload") or claims).get("id")
+    except Exception:
+        return None
+
+
+def reads_pinned_to_primary():
+    if request.method not in ("GET", "HEAD"):
+        return True
+    try:
+        if float(request.cookies.get(PRIMARY_UNTIL_COOKIE, 0)) > time.time():
+            return True
+    except ValueError:
+        pass
+    user_id = _request_user_id()
+    if user_id is None:
+        return False
+    with _recent_writers_lock:
+        return _recent_writers.get(user_id, 0) > time.monotonic()
+
+
+def get_read_connection(shared=False):
+    # A replica connection for read-only handlers, falling back to the primary when
+    # there are no healthy replicas, the request already writes, or the user just wrote.
+    # shared=True is for results that outlive the request (read_cache fills): those
+    # only come from the primary when the cache is on and doesn't repeat invalidations
+    # after the replication lag, or a lagging replica could put pre-write data back in it.
+    if 'db_connection' in g:
+        return g.db_connection
+    replica_ok = not shared or read_cache.tolerates_lag(READ_YOUR_WRITES_SECONDS)
+    if 'db_read_connection' in g and replica_ok:
+        return g.db_read_connection
+    replicas = get_replicas()
+    if replicas and replica_ok and not reads_pinned_to_primary():
+        for replica in choose_replicas(replicas):
+            started = time.perf_counter()
+            try:
+                connection = replica.pool.getconn()
+            except psycopg2.OperationalError:
+                replica.mark_down()
+                continue
+            except PoolTimeout:
+                continue
+            g.db_acquire_time = g.get('db_acquire_time', 0.0) + time.perf_counter() - started
+            g.db_read_connection = connection
+            g.db_read_replica = replica
+            return connection
+    return get_db_connection()
+
+
+def remember_write(response):
+    # After a successful write, keep this user's reads on the primary for a while:
+    # in-process by user id, and across worker processes via a cookie
+    if request.method in ("GET", "HEAD", "OPTIONS") or response.status_code >= 400:
+        return response
+    user_id = _request_user_id()
+    if user_id is not None:
+        with _recent_writers_lock:
+            now = time.monotonic()
+            _recent_writers[user_id] = now + READ_YOUR_WRITES_SECONDS
+            if len(_recent_writers) > 10000:
+                for key in [key for key, until in _recent_writers.items() if until <= now]:
+                    del _recent_writers[key]
+    response.set_cookie(PRIMARY_UNTIL_COOKIE, "%.3f" % (time.time() + READ_YOUR_WRITES_SECONDS),
+                        max_age=int(READ_YOUR_WRITES_SECONDS) + 1, httponly=True, samesite='Lax')
+    return response
+
+
+def get_db_connection():
+    # One pooled connection per request, returned by the teardown hook registered in init_app
+    if 'db_connection' not in g:
+        started = time.perf_counter()
+        g.db_connection = get_pool().getconn()
+        g.db_acquire_time = g.get('db_acquire_time', 0.0) + time.perf_counter() - started
+    return g.db_connection
+
+
+def release_db_connection(exception=None):
+    connection = g.pop('db_connection', None)
+    if connection is not None:
+        get_pool().putconn(connection)
+    connection = g.pop('db_read_connection', None)
+    if connection is not None:
+        g.pop('db_read_replica').pool.putconn(connection)
+
+
+@contextmanager
+def pooled_connection():
+    # For code running outside a request (CLI commands, background workers)
+    pool = get_pool()
+    connection = pool.getconn()
+    try:
+        yield connection
+    finally:
+        pool.putconn(connection)
+
+
+def add_query_stats_headers(response):
+    # Opt-in (DB_STATS_HEADERS=1) so the benchmark can attribute queries to endpoints
+    response.headers['X-DB-Queries'] = str(g.get('db_queries', 0))
+    response.headers['X-DB-Time'] = "%.6f" % g.get('db_time', 0.0)
+    return response
+
+
+def init_app(app):
+    app.teardown_appcontext(release_db_connection)
+    if parse_replica_hosts(os.getenv('DB_REPLICA_HOSTS')):
+        app.after_request(remember_write)
+    if os.getenv('DB_STATS_HEADERS') == '1':
+        app.after_request(add_query_stats_headers)
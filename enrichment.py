@@ -0,0 +1,183 @@
+import logging
+import os
+import queue
+import threading
+import time
+from dotenv import load_dotenv
+from db_utils import pooled_connection
+from tagging import suggest_tags
+from cache import read_cache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 'async' inserts posts with tags_status = 'pending' and tags them in the background
+ASYNC_ENRICHMENT = os.getenv('TAG_ENRICHMENT', 'sync') == 'async'
+
+
+class TagEnrichmentQueue:
+    """Bounded in-process job queue that fills in tags for pending posts.
+
+    Failed jobs are retried with exponential backoff and marked 'failed' after
+    ``max_attempts``. Jobs that could not be queued (backlog full, process
+    restart) stay 'pending' in the database and are picked up by a periodic
+    sweep.
+    """
+
+    def __init__(self, workers=2, max_backlog=1000, max_attempts=3, retry_backoff=1.0, sweep_interval=60.0):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.sweep_interval = sweep_interval
+        self._queue = queue.Queue(maxsize=max_backlog)
+        self._queued = set()  # post ids queued or in progress
+        self._lock = threading.Lock()
+        self._threads = []
+
+        # Stats
+        self._completed = 0
+        self._retried = 0
+        self._failed = 0
+        self._dropped = 0
+
+    def start(self):
+        # Idempotent; also called at app startup so the sweep runs after a restart
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name="tag-enrichment-%d" % index, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            sweeper = threading.Thread(target=self._sweep, name="tag-enrichment-sweep", daemon=True)
+            sweeper.start()
+            self._threads.append(sweeper)
+
+    def enqueue(self, post_id, attempt=1):
+        # Returns False when the backlog is full; the post stays pending for the sweep
+        self.start()
+        with self._lock:
+            if attempt == 1 and post_id in self._queued:
+                return True
+            self._queued.add(post_id)
+        try:
+            self._queue.put_nowait((post_id, attempt))
+            return True
+        except queue.Full:
+            with self._lock:
+                self._queued.discard(post_id)
+                self._dropped += 1
+            return False
+
+    def _work(self):
+        while True:
+            post_id, attempt = self._queue.get()
+            try:
+                self._enrich(post_id)
+                with self._lock:
+                    self._queued.discard(post_id)
+                    self._completed += 1
+            except Exception:
+                logger.exception("Tag enrichment failed for post %s (attempt %s)", post_id, attempt)
+                if attempt < self.max_attempts:
+                    with self._lock:
+                        self._retried += 1
+                    delay = self.retry_backoff * 2 ** (attempt - 1)
+                    timer = threading.Timer(delay, self.enqueue, (post_id, attempt + 1))
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    with self._lock:
+                        self._queued.discard(post_id)
+                        self._failed += 1
+                    self._mark_failed(post_id)
+            finally:
+                self._queue.task_done()
+
+    def _enrich(self, post_id):
+        with pooled_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT content FROM posts WHERE id = %s AND tags_status = 'pending';", (post_id,))
+            row = cursor.fetchone()
+        if row is None:
+            # Deleted, or tagged explicitly by an update in the meantime
+            return
+        # Don't hold a pooled connection while the model runs
+        tags = ", ".join(suggest_tags(row[0]))
+        with pooled_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "UPDATE posts SET tags = %s, tags_status = 'done' WHERE id = %s AND tags_status = 'pending';",
+                (tags, post_id)
+            )
+            connection.commit()
+        read_cache.invalidate("post:%d" % post_id, "posts")
+
+    def _mark_failed(self, post_id):
+        try:
+            with pooled_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("UPDATE posts SET tags_status = 'failed' WHERE id = %s AND tags_status = 'pending';", (post_id,))
+                connection.commit()
+        except Exception:
+            logger.exception("Could not mark tag enrichment failed for post %s", post_id)
+
+    def _sweep(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                with pooled_connection() as connection:
+                    cursor = connection.cursor()
+                    # Only posts old enough that no live request is about to queue them
+                    cursor.execute(
+                        """
+                        SELECT id FROM posts
+                        WHERE tags_status = 'pending' AND created_at < NOW() - make_interval(secs => %s)
+                        ORDER BY created_at
+                        LIMIT %s;
+                        """,
+                        (self.sweep_interval, self._queue.maxsize)
+                    )
+                    post_ids = [row[0] for row in cursor.fetchall()]
+                    connection.rollback()
+                for post_id in post_ids:
+                    if not self.enqueue(post_id):
+                        break
+            except Exception:
+                logger.exception("Tag enrichment sweep failed")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backlog": self._queue.qsize(),
+                "max_backlog": self._queue.maxsize,
+                "in_progress": len(self._queued),
+                "completed": self._completed,
+                "retried": self._retried,
+                "failed": self._failed,
+                "dropped": self._dropped,
+            }
+
+
+_enrichment_queue = None
+_enrichment_pid = None
+_enrichment_lock = threading.Lock()
+
+
+def get_enrichment_queue():
+    global _enrichment_queue, _enrichment_pid
+    if _enrichment_queue is None or _enrichment_pid != os.getpid():
+        with _enrichment_lock:
+            if _enrichment_queue is None or _enrichment_pid != os.getpid():
+                _enrichment_queue = TagEnrichmentQueue(
+                    workers=int(os.getenv('TAG_ENRICHMENT_WORKERS', 2)),
+                    max_backlog=int(os.getenv('TAG_ENRICHMENT_MAX_BACKLOG', 1000)),
+                    max_attempts=int(os.getenv('TAG_ENRICHMENT_MAX_ATTEMPTS', 3)),
+                    retry_backoff=float(os.getenv('TAG_ENRICHMENT_RETRY_BACKOFF', 1)),
+                    sweep_interval=float(os.getenv('TAG_ENRICHMENT_SWEEP_INTERVAL', 60))
+                )
+                _enrichment_pid = os.getpid()
+    return _enrichment_queue
@@ -0,0 +1,315 @@
+import atexit
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import psycopg2
+from dotenv import load_dotenv
+from db_utils import pooled_connection
+from cache import read_cache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 'on' buffers like/unlike in memory and writes them in batches; see LikeBuffer
+LIKE_WRITE_BEHIND = os.getenv('LIKE_WRITE_BEHIND', 'off') == 'on'
+
+# Whether the post exists, and whether the user has liked it
+LIKE_STATE = """
+    SELECT EXISTS (SELECT 1 FROM posts WHERE id = %s) AS post_exists,
+           EXISTS (SELECT 1 FROM likes WHERE user_id = %s AND post_id = %s) AS liked;
+"""
+
+# Likes on posts (or by users) deleted since they were buffered are dropped by
+# the joins, and counted as skipped in LikeBuffer.stats(). A fixed row order
+# keeps concurrent flushes from deadlocking on posts rows.
+INSERT_LIKES = """
+    INSERT INTO likes (user_id, post_id)
+    SELECT pending.user_id, pending.post_id
+    FROM unnest(%s::int[], %s::int[]) AS pending (user_id, post_id)
+    JOIN posts ON posts.id = pending.post_id
+    JOIN users ON users.id = pending.user_id
+    ORDER BY pending.post_id, pending.user_id
+    ON CONFLICT (user_id, post_id) DO NOTHING;
+"""
+
+DELETE_LIKES = """
+    DELETE FROM likes
+    USING unnest(%s::int[], %s::int[]) AS pending (user_id, post_id)
+    WHERE likes.user_id = pending.user_id AND likes.post_id = pending.post_id;
+"""
+
+
+class LikeBuffer:
+    """Write-behind buffer for like and unlike.
+
+    Each (user, post) keeps only its latest pending change, and a change that
+    undoes a pending one cancels it, so a burst of toggles costs at most one
+    row write. Pending changes are written with one multi-row INSERT and one
+    multi-row DELETE every ``interval`` seconds, or as soon as ``max_pending``
+    have built up, and on interpreter exit. A batch that fails is retried
+    with the next one, up to ``max_retries`` flushes in a row; one that fails
+    with an error retrying can't fix (a constraint violation, bad data) or
+    runs out of retries is logged and dropped, so it can't hold up every
+    later like.
+
+    Like state and per-post count deltas are answered from the buffer first, so
+    a user sees their own likes immediately: get_post, like counts and the
+    post listings (with_pending_likes) add the deltas to what the database or
+    cache returned. The NDJSON exports stream straight from the database and
+    only show flushed likes. The buffer is per process: with several workers,
+    another worker sees the change once it has been flushed.
+    """
+
+    # Errors that will fail the same batch again however often it is retried
+    PERMANENT_ERRORS = (psycopg2.IntegrityError, psycopg2.DataError, psycopg2.ProgrammingError)
+
+    def __init__(self, interval=0.2, max_pending=500, max_retries=50):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self._pending = {}  # (user id, post id) -> liked
+        self._flushing = {}  # the batch being written
+        self._deltas = {}  # post id -> like_count change not yet in the database
+        self._generation = 0  # bumped after every flush, so stale database reads are retried
+        self._failures = 0  # flushes failed in a row
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+        # Stats
+        self._recorded = 0
+        self._cancelled = 0
+        self._flushes = 0
+        self._flushed = 0
+        self._errors = 0
+        self._dropped = 0
+        self._skipped = 0  # likes the joins left out: post or user deleted (or already liked)
+        self._last_flush_seconds = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="like-buffer", daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+        # Turn SIGTERM into a normal exit so the atexit flush runs; servers that
+        # handle SIGTERM themselves (gunicorn, hypercorn) already exit cleanly
+        if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) is signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing buffered likes failed; retrying")
+                time.sleep(self.interval)
+
+    def _known_state(self, key):
+        liked = self._pending.get(key)
+        return self._flushing.get(key) if liked is None else liked
+
+    def _record(self, key, liked, stored, generation):
+        # True if recorded, False if already in that state, None to re-read the database
+        with self._lock:
+            current = self._known_state(key)
+            if current is None:
+                if stored is None or generation != self._generation:
+                    return None
+                current = stored
+            if current == liked:
+                return False
+            if key in self._pending:
+                del self._pending[key]  # Undoes the pending change
+                self._cancelled += 1
+            else:
+                self._pending[key] = liked
+            post_id = key[1]
+            self._deltas[post_id] = self._deltas.get(post_id, 0) + (1 if liked else -1)
+            if not self._deltas[post_id]:
+                del self._deltas[post_id]
+            self._recorded += 1
+            if len(self._pending) >= self.max_pending:
+                self._wake.set()
+            return True
+
+    def _state(self, key):
+        with self._lock:
+            return self._known_state(key), self._generation
+
+    def record(self, user_id, post_id, liked, load_state):
+        """Buffer a like (``liked=True``) or unlike.
+
+        ``load_state()`` returns whether the user has liked the post according
+        to the database, or None if the post doesn't exist; it is only called
+        when the buffer doesn't know. Returns True once buffered, False if the
+        user has already liked (or not liked) the post, and None for a missing
+        post.
+        """
+        self.start()
+        key = (user_id, post_id)
+        while True:
+            known, generation = self._state(key)
+            stored = None
+            if known is None:
+                stored = load_state()
+                if stored is None:
+                    return None
+            outcome = self._record(key, liked, stored, generation)
+            if outcome is not None:
+                return outcome
+
+    async def record_async(self, user_id, post_id, liked, load_state):
+        # Same as record, with a coroutine for load_state
+        self.start()
+        key = (user_id, post_id)
+        while True:
+            known, generation = self._state(key)
+            stored = None
+            if known is None:
+                stored = await load_state()
+                if stored is None:
+                    return None
+            outcome = self._record(key, liked, stored, generation)
+            if outcome is not None:
+                return outcome
+
+    def pending_delta(self, post_id):
+        # Change to the post's stored like_count once pending likes are written
+        with self._lock:
+            return self._deltas.get(post_id, 0)
+
+    def pending_deltas(self, post_ids):
+        # post id -> delta, for the posts that have one
+        with self._lock:
+            return {post_id: self._deltas[post_id] for post_id in post_ids if post_id in self._deltas}
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch = self._flushing = self._pending
+                self._pending = {}
+            started = time.perf_counter()
+            likes = [key for key, liked in batch.items() if liked]
+            unlikes = [key for key, liked in batch.items() if not liked]
+            skipped = 0
+            try:
+                with pooled_connection() as connection:
+                    try:
+                        cursor = connection.cursor()
+                        if likes:
+                            cursor.execute(INSERT_LIKES, ([user_id for user_id, _ in likes], [post_id for _, post_id in likes]))
+                            skipped = len(likes) - cursor.rowcount
+                        if unlikes:
+                            cursor.execute(DELETE_LIKES, ([user_id for user_id, _ in unlikes], [post_id for _, post_id in unlikes]))
+                        connection.commit()
+                    except Exception:
+                        connection.rollback()
+                        raise
+            except Exception as err:
+                with self._lock:
+                    self._errors += 1
+                    self._failures += 1
+                    drop = isinstance(err, self.PERMANENT_ERRORS) or self._failures > self.max_retries
+                    for key, liked in batch.items():
+                        # A change made since then undoes this one, so both go either way
+                        undone = self._pending.pop(key, None) is not None
+                        if undone:
+                            continue  # Their count changes cancel out too
+                        if drop:
+                            post_id = key[1]
+                            self._deltas[post_id] = self._deltas.get(post_id, 0) - (1 if liked else -1)
+                            if not self._deltas[post_id]:
+                                del self._deltas[post_id]
+                        else:
+                            self._pending[key] = liked  # Put back for the next flush
+                    self._flushing = {}
+                    self._generation += 1
+                    if drop:
+                        self._dropped += len(batch)
+                        self._failures = 0
+                if drop:
+                    logger.error("Dropped %d buffered like changes after a failed flush: %s", len(batch), err)
+                    return 0
+                raise
+
+            # The batch is in the database now: stop adding it on top before the
+            # cache is invalidated, or a fresh read would count it twice
+            with self._lock:
+                for (_, post_id), liked in batch.items():
+                    self._deltas[post_id] = self._deltas.get(post_id, 0) - (1 if liked else -1)
+                    if not self._deltas[post_id]:
+                        del self._deltas[post_id]
+                self._flushing = {}
+                self._generation += 1
+                self._failures = 0
+                self._flushes += 1
+                self._flushed += len(batch)
+                self._skipped += skipped
+                self._last_flush_seconds = time.perf_counter() - started
+            if skipped:
+                logger.warning("Skipped %d buffered likes whose post or user no longer exists", skipped)
+            # Cached listings hold like_count from before the flush, and their
+            # deltas are gone now, so they have to be reloaded as well
+            read_cache.invalidate("posts", "trending", *{"post:%d" % post_id for _, post_id in batch})
+            return len(batch)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "recorded": self._recorded,
+                "cancelled": self._cancelled,
+                "flushes": self._flushes,
+                "flushed": self._flushed,
+                "errors": self._errors,
+                "dropped": self._dropped,
+                "skipped": self._skipped,
+                "last_flush_seconds": round(self._last_flush_seconds, 6),
+            }
+
+
+_buffer = None
+_buffer_pid = None
+_buffer_lock = threading.Lock()
+
+
+def get_like_buffer():
+    global _buffer, _buffer_pid
+    if _buffer is None or _buffer_pid != os.getpid():
+        with _buffer_lock:
+            if _buffer is None or _buffer_pid != os.getpid():
+                _buffer = LikeBuffer(
+                    interval=float(os.getenv('LIKE_FLUSH_INTERVAL_MS', 200)) / 1000,
+                    max_pending=int(os.getenv('LIKE_FLUSH_SIZE', 500)),
+                    max_retries=int(os.getenv('LIKE_FLUSH_RETRIES', 50))
+                )
+                _buffer_pid = os.getpid()
+    return _buffer
+
+
+def pending_like_delta(post_id):
+    return get_like_buffer().pending_delta(post_id) if LIKE_WRITE_BEHIND else 0
+
+
+def with_pending_likes(posts):
+    # Listing rows with pending likes added to like_count; rows may come from the
+    # cache and be shared, so changed ones are copied
+    if not LIKE_WRITE_BEHIND or not posts or "like_count" not in posts[0]:
+        return posts
+    deltas = get_like_buffer().pending_deltas([post["id"] for post in posts])
+    if not deltas:
+        return posts
+    return [dict(post, like_count=post["like_count"] + deltas[post["id"]]) if post["id"] in deltas else post for post in posts]
@@ -0,0 +1,152 @@
+import bisect
+import threading
+import time
+from flask import g, has_app_context, request
+
+# In-process request metrics, rendered in the Prometheus text format at /metrics.
+# Each worker process keeps its own numbers; scrape every worker (or run one
+# worker per target) when serving with several processes.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 7, 10, 15, 20, 50)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join('%s="%s"' % (name, value) for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s counter" % self.name]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append("%s%s %s" % (self.name, _format_labels(self.labels, label_values), _format_value(value)))
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram; an observation is one bisect and one locked update."""
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts (last is +Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s histogram" % self.name]
+        with self._lock:
+            series = sorted((label_values, (list(counts), total)) for label_values, (counts, total) in self._series.items())
+        for label_values, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, ("le", _format_value(float(bound))))
+                lines.append("%s_bucket%s %d" % (self.name, labels, cumulative))
+            labels = _format_labels(self.labels, label_values)
+            lines.append("%s_sum%s %s" % (self.name, labels, repr(total)))
+            lines.append("%s_count%s %d" % (self.name, labels, cumulative))
+        return lines
+
+
+request_duration = Histogram("http_request_duration_seconds", "Time spent handling a request, including JSON serialization.", ("method", "route"))
+requests_total = Counter("http_requests_total", "Requests handled, by status code.", ("method", "route", "status"))
+db_queries = Histogram("db_queries_per_request", "Statements executed per request.", ("route",), QUERY_COUNT_BUCKETS)
+db_time = Histogram("db_query_duration_seconds", "Time spent in cursor.execute per request.", ("route",))
+db_acquire_time = Histogram("db_pool_acquire_duration_seconds", "Time spent waiting for a pooled connection per request.", ("route",))
+auth_time = Histogram("auth_duration_seconds", "Time spent verifying the bearer token per request.", ("route",))
+nlp_time = Histogram("nlp_duration_seconds", "Time a request spent waiting for spaCy tag suggestions.", ("route",))
+nlp_batch_time = Histogram("nlp_batch_duration_seconds", "Time to tag one micro-batch with spaCy.")
+nlp_batch_size = Histogram("nlp_batch_size", "Texts per spaCy micro-batch.", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+related_query_time = Histogram("related_posts_query_duration_seconds", "Time to find a post's most similar posts in the TF-IDF index.")
+related_build_time = Histogram("related_index_build_duration_seconds", "Time to compile the related-posts TF-IDF matrix.", buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+REGISTRY = [
+    request_duration, requests_total, db_queries, db_time, db_acquire_time, auth_time, nlp_time, nlp_batch_time, nlp_batch_size,
+    related_query_time, related_build_time,
+]
+
+
+def record_nlp(duration):
+    # Per-request spaCy wait, read by the request instrumentation
+    if has_app_context():
+        g.nlp_time = g.get('nlp_time', 0.0) + duration
+
+
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+def record_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    request_duration.observe(time.perf_counter() - started, request.method, route)
+    requests_total.inc(request.method, route, str(response.status_code))
+    db_queries.observe(g.get('db_queries', 0), route)
+    if 'db_time' in g:
+        db_time.observe(g.db_time, route)
+    if 'db_acquire_time' in g:
+        db_acquire_time.observe(g.db_acquire_time, route)
+    if 'auth_time' in g:
+        auth_time.observe(g.auth_time, route)
+    if 'nlp_time' in g:
+        nlp_time.observe(g.nlp_time, route)
+    return response
+
+
+def _sample(name, documentation, value, kind="gauge"):
+    return ["# HELP %s %s" % (name, documentation), "# TYPE %s %s" % (name, kind), "%s %s" % (name, _format_value(value))]
+
+
+def render(pool_stats=None):
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    if pool_stats is not None:
+        lines.extend(_sample("db_pool_size", "Open pooled connections.", pool_stats["size"]))
+        lines.extend(_sample("db_pool_in_use", "Pooled connections checked out.", pool_stats["in_use"]))
+        lines.extend(_sample("db_pool_idle", "Idle pooled connections.", pool_stats["idle"]))
+        lines.extend(_sample("db_pool_timeouts_total", "Connection requests that timed out waiting for the pool.", pool_stats["timeouts"], "counter"))
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    app.before_request(start_request_timer)
+    app.after_request(record_request)
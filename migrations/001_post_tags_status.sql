@@ -0,0 +1,3 @@
+-- Tag enrichment state: 'pending' while tags are computed in the background, then 'done' or 'failed'
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS tags_status VARCHAR(10) NOT NULL DEFAULT 'done';
+-- Its partial index is built concurrently in 012
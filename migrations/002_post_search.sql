@@ -0,0 +1,31 @@
+-- Full-text search document per post, title weighted above content.
+-- Kept in its own table so posts.* responses don't carry the tsvector.
+-- Existing posts are backfilled in batches by 014, outside this transaction's
+-- lock on posts.
+CREATE TABLE IF NOT EXISTS post_search (
+    post_id INTEGER PRIMARY KEY REFERENCES posts (id) ON DELETE CASCADE,
+    document TSVECTOR NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS post_search_document_idx ON post_search USING GIN (document);
+
+CREATE OR REPLACE FUNCTION post_search_refresh() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO post_search (post_id, document)
+    VALUES (
+        NEW.id,
+        setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.content, '')), 'B')
+    )
+    ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_search_insert ON posts;
+CREATE TRIGGER posts_search_insert AFTER INSERT ON posts
+    FOR EACH ROW EXECUTE FUNCTION post_search_refresh();
+
+DROP TRIGGER IF EXISTS posts_search_update ON posts;
+CREATE TRIGGER posts_search_update AFTER UPDATE OF title, content ON posts
+    FOR EACH ROW EXECUTE FUNCTION post_search_refresh();
@@ -0,0 +1,6 @@
+-- migrate: no-transaction
+-- Composite indexes matching the (created_at, id) keyset ordering of the listing endpoints.
+-- They also cover posts(created_at), posts(user_id, created_at) and comments(post_id, created_at).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS posts_created_at_id_idx ON posts (created_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS posts_user_id_created_at_id_idx ON posts (user_id, created_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS comments_post_id_created_at_id_idx ON comments (post_id, created_at, id);
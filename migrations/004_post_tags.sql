@@ -0,0 +1,69 @@
+-- Normalized tags. posts.tags stays the source of truth that the API reads and
+-- writes; triggers mirror it into post_tags and keep tags.post_count current.
+-- The triggers exist before any existing post is copied (in batches, by 015),
+-- so a post written or retagged meanwhile can't be missed.
+CREATE TABLE IF NOT EXISTS tags (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    post_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS post_tags (
+    post_id INTEGER NOT NULL REFERENCES posts (id) ON DELETE CASCADE,
+    tag_id INTEGER NOT NULL REFERENCES tags (id) ON DELETE CASCADE,
+    PRIMARY KEY (post_id, tag_id)
+);
+
+CREATE INDEX IF NOT EXISTS post_tags_tag_id_post_id_idx ON post_tags (tag_id, post_id);
+CREATE INDEX IF NOT EXISTS tags_post_count_idx ON tags (post_count DESC, name) WHERE post_count > 0;
+
+-- Incremental facet counts
+CREATE OR REPLACE FUNCTION post_tags_count() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE tags SET post_count = post_count + 1 WHERE id = NEW.tag_id;
+    ELSE
+        UPDATE tags SET post_count = post_count - 1 WHERE id = OLD.tag_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS post_tags_count ON post_tags;
+CREATE TRIGGER post_tags_count AFTER INSERT OR DELETE ON post_tags
+    FOR EACH ROW EXECUTE FUNCTION post_tags_count();
+
+-- Mirror posts.tags into post_tags
+CREATE OR REPLACE FUNCTION post_tags_sync() RETURNS TRIGGER AS $$
+DECLARE
+    names TEXT[];
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.tags IS NOT DISTINCT FROM OLD.tags THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT coalesce(array_agg(DISTINCT lower(btrim(tag))), '{}') INTO names
+    FROM unnest(string_to_array(NEW.tags, ',')) AS tag
+    WHERE btrim(tag) <> '';
+
+    INSERT INTO tags (name) SELECT unnest(names) ON CONFLICT (name) DO NOTHING;
+
+    DELETE FROM post_tags
+    WHERE post_id = NEW.id
+      AND tag_id NOT IN (SELECT id FROM tags WHERE name = ANY (names));
+
+    INSERT INTO post_tags (post_id, tag_id)
+    SELECT NEW.id, id FROM tags WHERE name = ANY (names)
+    ON CONFLICT DO NOTHING;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_tags_sync_insert ON posts;
+CREATE TRIGGER posts_tags_sync_insert AFTER INSERT ON posts
+    FOR EACH ROW EXECUTE FUNCTION post_tags_sync();
+
+DROP TRIGGER IF EXISTS posts_tags_sync_update ON posts;
+CREATE TRIGGER posts_tags_sync_update AFTER UPDATE OF tags ON posts
+    FOR EACH ROW EXECUTE FUNCTION post_tags_sync();
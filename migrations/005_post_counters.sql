@@ -0,0 +1,34 @@
+-- Denormalized like/comment counts, maintained by triggers in the same transaction.
+-- Existing posts are backfilled in batches by 013.
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS like_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS comment_count INTEGER NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION posts_like_count() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE posts SET like_count = like_count + 1 WHERE id = NEW.post_id;
+    ELSE
+        UPDATE posts SET like_count = like_count - 1 WHERE id = OLD.post_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS likes_count ON likes;
+CREATE TRIGGER likes_count AFTER INSERT OR DELETE ON likes
+    FOR EACH ROW EXECUTE FUNCTION posts_like_count();
+
+CREATE OR REPLACE FUNCTION posts_comment_count() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE posts SET comment_count = comment_count + 1 WHERE id = NEW.post_id;
+    ELSE
+        UPDATE posts SET comment_count = comment_count - 1 WHERE id = OLD.post_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS comments_count ON comments;
+CREATE TRIGGER comments_count AFTER INSERT OR DELETE ON comments
+    FOR EACH ROW EXECUTE FUNCTION posts_comment_count();
@@ -0,0 +1,4 @@
+-- migrate: no-transaction
+-- Sign-up relies on these instead of checking for an existing user first
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_username_key ON users (username);
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_email_key ON users (email);
@@ -0,0 +1,7 @@
+-- migrate: no-transaction
+-- like_post relies on this for INSERT ... ON CONFLICT instead of checking for an existing like first
+-- Drop duplicate likes left by the old check-then-insert race; the likes_count trigger keeps like_count right
+DELETE FROM likes a USING likes b
+WHERE a.user_id = b.user_id AND a.post_id = b.post_id AND a.ctid > b.ctid;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS likes_user_id_post_id_key ON likes (user_id, post_id);
@@ -0,0 +1,7 @@
+-- Progress of `flask import-posts`, committed with each batch so an interrupted import resumes where it stopped
+CREATE TABLE IF NOT EXISTS post_imports (
+    source TEXT PRIMARY KEY,
+    records_done BIGINT NOT NULL DEFAULT 0,
+    posts_imported BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,42 @@
+-- Trending feed: like/comment events are queued in post_events by triggers and
+-- folded into per-window, time-decayed scores by the in-app refresher (trending.py)
+CREATE TABLE IF NOT EXISTS post_events (
+    id BIGSERIAL PRIMARY KEY,
+    post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+    weight REAL NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- score is log(sum(weight * exp(decay * (event time - 2020-01-01)))): scores are
+-- never rewritten as time passes, yet newer events always outweigh older ones
+CREATE TABLE IF NOT EXISTS trending_scores (
+    window_name VARCHAR(8) NOT NULL,
+    post_id INTEGER NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+    score DOUBLE PRECISION NOT NULL,
+    last_event_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (window_name, post_id)
+);
+CREATE INDEX IF NOT EXISTS trending_scores_rank_idx ON trending_scores (window_name, score DESC);
+CREATE INDEX IF NOT EXISTS trending_scores_last_event_idx ON trending_scores (window_name, last_event_at);
+
+CREATE OR REPLACE FUNCTION record_post_event() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO post_events (post_id, weight) VALUES (NEW.post_id, TG_ARGV[0]::REAL);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A comment counts for more than a like; unlikes and deleted comments are not subtracted
+DROP TRIGGER IF EXISTS likes_trending ON likes;
+CREATE TRIGGER likes_trending AFTER INSERT ON likes
+    FOR EACH ROW EXECUTE FUNCTION record_post_event('1');
+
+DROP TRIGGER IF EXISTS comments_trending ON comments;
+CREATE TRIGGER comments_trending AFTER INSERT ON comments
+    FOR EACH ROW EXECUTE FUNCTION record_post_event('3');
+
+-- Seed the queue with the last week of comments so the feed isn't empty on day one
+INSERT INTO post_events (post_id, weight, created_at)
+SELECT post_id, 3, created_at FROM comments
+WHERE created_at > CURRENT_TIMESTAMP - INTERVAL '7 days'
+  AND NOT EXISTS (SELECT 1 FROM post_events) AND NOT EXISTS (SELECT 1 FROM trending_scores);
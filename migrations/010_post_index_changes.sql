@@ -0,0 +1,25 @@
+-- Posts whose title, content or tags changed, so every worker's in-memory
+-- related-posts index (related.py) can catch up with writes made elsewhere.
+-- Rows are kept for a day (RELATED_CHANGES_RETENTION) and then pruned.
+CREATE TABLE IF NOT EXISTS post_index_changes (
+    id BIGSERIAL PRIMARY KEY,
+    post_id INTEGER NOT NULL,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS post_index_changes_changed_at_idx ON post_index_changes (changed_at);
+
+CREATE OR REPLACE FUNCTION record_post_index_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO post_index_changes (post_id) VALUES (OLD.id);
+    ELSE
+        INSERT INTO post_index_changes (post_id) VALUES (NEW.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS posts_index_change ON posts;
+CREATE TRIGGER posts_index_change AFTER INSERT OR DELETE OR UPDATE OF title, content, tags ON posts
+    FOR EACH ROW EXECUTE FUNCTION record_post_index_change();
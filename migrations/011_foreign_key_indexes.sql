@@ -0,0 +1,4 @@
+-- migrate: no-transaction
+-- delete_post cascades to these tables by post_id, which no existing index leads with
+CREATE INDEX CONCURRENTLY IF NOT EXISTS likes_post_id_idx ON likes (post_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS trending_scores_post_id_idx ON trending_scores (post_id);
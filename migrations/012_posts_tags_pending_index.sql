@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- Moved out of 001 so the build doesn't block writes to posts
+CREATE INDEX CONCURRENTLY IF NOT EXISTS posts_tags_pending_idx ON posts (created_at) WHERE tags_status = 'pending';
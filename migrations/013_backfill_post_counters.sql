@@ -0,0 +1,11 @@
+-- migrate: no-transaction
+-- Backfills the counters added in 005, a few thousand posts per transaction so
+-- the backfill never holds row locks on most of posts at once. The triggers are
+-- already counting new likes and comments; a like or comment racing its post's
+-- batch can be missed, which `flask reconcile-counters` repairs.
+-- migrate: batch
+UPDATE posts SET
+    like_count = (SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id),
+    comment_count = (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id)
+WHERE id IN (SELECT id FROM posts WHERE id > %(after)s ORDER BY id LIMIT 5000)
+RETURNING id;
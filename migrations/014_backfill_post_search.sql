@@ -0,0 +1,17 @@
+-- migrate: no-transaction
+-- Search documents for the posts that existed before 002's triggers, a batch
+-- at a time so post writes are never blocked for long. Posts written since
+-- already have theirs; ON CONFLICT leaves those alone. Every post of the batch
+-- is returned, inserted or not, so the keyset keeps moving.
+-- migrate: batch
+WITH batch AS (
+    SELECT id, title, content FROM posts WHERE id > %(after)s ORDER BY id LIMIT 2000
+), inserted AS (
+    INSERT INTO post_search (post_id, document)
+    SELECT id,
+           setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+           setweight(to_tsvector('english', coalesce(content, '')), 'B')
+    FROM batch
+    ON CONFLICT (post_id) DO NOTHING
+)
+SELECT id FROM batch;
@@ -0,0 +1,30 @@
+-- migrate: no-transaction
+-- post_tags rows for the posts that existed before 004's triggers, a batch at a
+-- time. Tag names go in first: statements in one batch share a snapshot, so
+-- post_tags couldn't see names inserted alongside it. The post_tags_count
+-- trigger counts each inserted row, and ON CONFLICT skips the rows the sync
+-- trigger already wrote, so tags.post_count stays right. Every post of the
+-- batch is returned, so the keyset keeps moving.
+-- migrate: batch
+WITH batch AS (
+    SELECT id, tags FROM posts WHERE id > %(after)s ORDER BY id LIMIT 2000
+), inserted AS (
+    INSERT INTO tags (name)
+    SELECT DISTINCT lower(btrim(tag))
+    FROM batch CROSS JOIN LATERAL unnest(string_to_array(batch.tags, ',')) AS tag
+    WHERE btrim(tag) <> ''
+    ON CONFLICT (name) DO NOTHING
+)
+SELECT id FROM batch;
+
+-- migrate: batch
+WITH batch AS (
+    SELECT id, tags FROM posts WHERE id > %(after)s ORDER BY id LIMIT 2000
+), inserted AS (
+    INSERT INTO post_tags (post_id, tag_id)
+    SELECT DISTINCT batch.id, tags.id
+    FROM batch CROSS JOIN LATERAL unnest(string_to_array(batch.tags, ',')) AS tag
+    JOIN tags ON tags.name = lower(btrim(tag))
+    ON CONFLICT DO NOTHING
+)
+SELECT id FROM batch;
@@ -0,0 +1,48 @@
+import base64
+import json
+from datetime import date, datetime
+
+
+class PaginationError(ValueError):
+    pass
+
+
+# Number of sort-key values each kind of cursor carries
+CURSOR_KEYS = {
+    "date": 2,  # (created_at, id)
+    "rank": 3,  # (search rank, created_at, id)
+}
+
+
+def encode_cursor(kind, values):
+    # Opaque to clients: base64 of [kind, *values], datetimes as ISO strings
+    payload = [kind] + [v.isoformat() if isinstance(v, (datetime, date)) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, kind):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise PaginationError("Invalid cursor")
+    # A cursor only makes sense for the ordering it was issued for
+    if not isinstance(payload, list) or not payload or payload[0] != kind or len(payload) != CURSOR_KEYS[kind] + 1:
+        raise PaginationError("Invalid cursor")
+    return payload[1:]
+
+
+def get_page_args(args, default_limit=10):
+    page = int(args.get('page', 1))  # Ignored when a cursor is given
+    limit = int(args.get('limit', default_limit))
+    if page < 1 or limit < 1:
+        raise PaginationError("page and limit must be positive")
+    return page, limit, args.get('cursor')
+
+
+def split_page(rows, limit, kind, key):
+    # Queries fetch limit + 1 rows; the extra row only tells us whether there is a next page
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(kind, key(rows[-1]))
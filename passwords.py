@@ -0,0 +1,57 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import bcrypt
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Work factor for new hashes; stored hashes with a different cost are upgraded on sign-in
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+BCRYPT_WORKERS = int(os.getenv('BCRYPT_WORKERS', 2))
+# Hash requests allowed to wait for a worker before new ones are turned away
+BCRYPT_MAX_PENDING = int(os.getenv('BCRYPT_MAX_PENDING', 32))
+BCRYPT_TIMEOUT = float(os.getenv('BCRYPT_TIMEOUT', 10))
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+# bcrypt releases the GIL, so a small dedicated pool caps how many cores a
+# burst of logins can take away from every other endpoint
+_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+_slots = threading.BoundedSemaphore(BCRYPT_WORKERS + BCRYPT_MAX_PENDING)
+
+
+def _run(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise PasswordHasherBusy("Too many sign-in requests, try again shortly")
+    try:
+        future = _executor.submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    # The slot is held until the hash actually finishes, not just until this
+    # caller stops waiting, so timed-out work still counts against the limit
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=BCRYPT_TIMEOUT)
+    except FutureTimeoutError:
+        raise PasswordHasherBusy("Sign-in is taking too long, try again shortly")
+
+
+def hash_password(password):
+    return _run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def check_password(password, hashed):
+    return _run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def needs_rehash(hashed):
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        return int(hashed.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
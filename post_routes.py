@@ -1,11 +1,66 @@
-from flask import Blueprint, jsonify, request, g
+import os
+from flask import Blueprint, Response, current_app, jsonify, request, g
 from auth_middleware import token_required
-from db_utils import get_db_connection  # Import from db_utils.py
-import psycopg2.extras
+from db_utils import DictRowCursor, get_db_connection, get_read_connection, pooled_connection  # Import from db_utils.py
+from tagging import suggest_tags as suggest_tags_for, suggest_tags_many
+from enrichment import ASYNC_ENRICHMENT, get_enrichment_queue
+from pagination import PaginationError, get_page_args
+from queries import (
+    build_comments_query, build_posts_query, build_update_post_query, build_update_user_query,
+    build_user_posts_query, finish_comments_page, finish_posts_page, finish_user_posts_page,
+    FieldsError, bounded_int_arg, build_post_query, build_related_query, build_trending_query, finish_post, group_highlight, is_full_text
+)
+from cache import cache_key, read_cache
+from trending import DEFAULT_WINDOW, TRENDING_WINDOWS, get_trending_refresher
+from related import get_related_index, index_post, unindex_post
+from like_buffer import LIKE_STATE, LIKE_WRITE_BEHIND, get_like_buffer, pending_like_delta, with_pending_likes
+import psycopg2.errors
 
 
 post_routes = Blueprint('post_routes', __name__)
 
+# Listing pages served from the read cache, and how long they may lag behind writes.
+# Like/comment counts in listings are only refreshed when these entries expire.
+CACHED_LIST_PAGES = int(os.getenv('CACHE_LIST_PAGES', 3))
+LIST_CACHE_TTL = float(os.getenv('CACHE_LIST_TTL', 10))
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 500))  # Rows per server-side cursor fetch
+
+
+def stream_ndjson(query, params, transform=None):
+    # Streams one JSON document per row from a named (server-side) cursor, so
+    # memory stays flat however many rows match. The request's connection goes
+    # back to the pool at teardown, before the body is sent, so the generator
+    # checks out its own for as long as the stream runs.
+    dumps = current_app.json.dumps
+
+    def generate():
+        with pooled_connection() as connection:
+            cursor = connection.cursor(name="ndjson_export", cursor_factory=DictRowCursor)
+            try:
+                cursor.execute(query, params)
+                while True:
+                    rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                    if not rows:
+                        break
+                    yield "".join(dumps(transform(row) if transform else row) + "\n" for row in rows)
+            finally:
+                cursor.close()
+                connection.rollback()
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+def record_buffered_like(post_id, liked):
+    # Write-behind mode: the change goes to the like buffer; the database is
+    # only read, and only when the buffer doesn't know the current state
+    def load_state():
+        cursor = get_db_connection().cursor()
+        cursor.execute(LIKE_STATE, (post_id, g.user["id"], post_id))
+        post_exists, stored = cursor.fetchone()
+        return stored if post_exists else None
+
+    return get_like_buffer().record(g.user["id"], post_id, liked, load_state)
+
 
 @post_routes.route('/posts', methods=['POST'])
 @token_required
@@ -21,135 +76,183 @@ def create_post():
         if not post_data.get("content"):
             return jsonify({"error": "Content is required"}), 400
 
-        # Use spaCy to suggest tags if none are provided
+        # Use spaCy to suggest tags if none are provided, either now or in the background
         tags = post_data.get("tags")
-        if not tags:
-            import spacy
-            nlp = spacy.load("en_core_web_sm")
-            doc = nlp(post_data["content"])
-
-            # Extract keywords and named entities as tags
-            suggested_tags = set()
-            for token in doc:
-                if token.is_alpha and not token.is_stop and token.pos_ in ["NOUN", "PROPN"]:
-                    suggested_tags.add(token.lemma_.lower())
-            for ent in doc.ents:
-                suggested_tags.add(ent.text.lower())
-
-            # Limit the number of tags to 5
-            tags = ", ".join(list(suggested_tags)[:5])
+        enrich_later = not tags and ASYNC_ENRICHMENT
+        if not tags and not enrich_later:
+            tags = ", ".join(suggest_tags_for(post_data["content"]))
 
         # Connect to the database
         connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor = connection.cursor(cursor_factory=DictRowCursor)
 
         # Insert the post into the database
         cursor.execute(
             """
-            INSERT INTO posts (title, content, tags, user_id, media_url) 
-            VALUES (%s, %s, %s, %s, %s) RETURNING *;
+            INSERT INTO posts (title, content, tags, tags_status, user_id, media_url) 
+            VALUES (%s, %s, %s, %s, %s, %s) RETURNING *;
             """,
             (
                 post_data["title"],
                 post_data["content"],
-                tags,
+                tags or "",
+                "pending" if enrich_later else "done",
                 current_user["id"],
                 post_data.get("media_url")
             )
         )
         new_post = cursor.fetchone()
         connection.commit()
+        read_cache.invalidate("posts")
+        index_post(new_post)
+
+        # Queue tagging only once the row is visible to the background workers
+        if enrich_later:
+            get_enrichment_queue().enqueue(new_post["id"])
 
         # Return the created post along with the suggested tags
         return jsonify({"post": new_post, "suggested_tags": tags}), 201
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
 
 
 
 @post_routes.route('/posts', methods=['GET'])
 def get_posts():
     try:
-        # Get query parameters for pagination
-        page = int(request.args.get('page', 1))  # Default to page 1
-        limit = int(request.args.get('limit', 10))  # Default to 10 posts per page
-        offset = (page - 1) * limit
+        # Get query parameters for pagination: an opaque cursor, or a page number
+        page, limit, page_cursor = get_page_args(request.args)  # Default to 10 posts per page
 
-        # Get query parameters for search and filtering
-        search_query = request.args.get('q')  # Search keyword
-        tag_filter = request.args.get('tag')  # Filter by tag
-        author_filter = request.args.get('author')  # Filter by author username
-
-        # Connect to the database
-        connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-        # Base query to fetch posts
-        query = """
-            SELECT posts.*, users.username AS author 
-            FROM posts 
-            JOIN users ON posts.user_id = users.id
-        """
-        conditions = []
-        params = []
-
-        # Add search condition
-        if search_query:
-            conditions.append("(posts.title ILIKE %s OR posts.content ILIKE %s)")
-            params.extend([f"%{search_query}%", f"%{search_query}%"])
-
-        # Add tag filter condition
-        if tag_filter:
-            conditions.append("posts.tags ILIKE %s")
-            params.append(f"%{tag_filter}%")
-
-        # Add author filter condition
-        if author_filter:
-            conditions.append("users.username = %s")
-            params.append(author_filter)
-
-        # Combine conditions with AND
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
-
-        # Add pagination
-        query += " ORDER BY posts.created_at DESC LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
+        # Build the filtered, ordered page query
+        query, params = build_posts_query(request.args, page, limit, page_cursor)
 
         # Execute the query
-        cursor.execute(query, params)
-        posts = cursor.fetchall()
+        def load_posts(shared=False):
+            cursor = get_read_connection(shared).cursor(cursor_factory=DictRowCursor)
+            cursor.execute(query, params)
+            return [dict(post) for post in cursor.fetchall()]
+
+        # The first pages of plain, tag and author listings come from the cache
+        if not request.args.get('q') and not page_cursor and page <= CACHED_LIST_PAGES:
+            rows = read_cache.get_or_load(cache_key("posts", request.args), ["posts", "users"], lambda: load_posts(shared=True), ttl=LIST_CACHE_TTL)
+        else:
+            rows = load_posts()
+        posts, next_cursor = finish_posts_page(rows, limit, request.args)
 
         # Return the posts as a response
-        return jsonify({"posts": posts, "page": page, "limit": limit}), 200
+        return jsonify({"posts": with_pending_likes(posts), "page": page, "limit": limit, "next_cursor": next_cursor}), 200
+    except (PaginationError, FieldsError) as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@post_routes.route('/posts/export', methods=['GET'])
+def export_posts():
+    try:
+        # Every post matching the get_posts filters (q, tag, tag_mode, author), as NDJSON
+        query, params = build_posts_query(request.args, 1, None, None)
+        return stream_ndjson(query, params, group_highlight if is_full_text(request.args.get('q')) else None)
+    except FieldsError as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@post_routes.route('/posts/trending', methods=['GET'])
+def get_trending_posts():
+    try:
+        # Posts ranked by time-decayed likes and comments, from the precomputed trending_scores
+        window = request.args.get('window', DEFAULT_WINDOW)
+        if window not in TRENDING_WINDOWS:
+            return jsonify({"error": "window must be one of: %s" % ", ".join(TRENDING_WINDOWS)}), 400
+        limit = bounded_int_arg(request.args, 'limit', 20, 100)
+        query, params = build_trending_query(request.args, window, TRENDING_WINDOWS[window][0], limit)
+
+        def load_trending():
+            cursor = get_read_connection(shared=True).cursor(cursor_factory=DictRowCursor)
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+        # Scores only change when the refresher runs, so cache for about one refresh interval
+        posts = read_cache.get_or_load(cache_key("trending", request.args), ["trending", "posts", "users"], load_trending, ttl=get_trending_refresher().interval)
+        return jsonify({"posts": with_pending_likes(posts), "window": window}), 200
+    except FieldsError as err:
+        return jsonify({"error": str(err)}), 400
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
 
 
 @post_routes.route('/posts/<int:post_id>', methods=['GET'])
 def get_post(post_id):
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        query = """
-            SELECT posts.*, users.username AS author 
-            FROM posts 
-            JOIN users ON posts.user_id = users.id
-            WHERE posts.id = %s
-        """
-        cursor.execute(query, (post_id,))
-        post = cursor.fetchone()
+        # include=comments,like_count,author_profile embeds related data in the same query
+        query, params, includes = build_post_query(post_id, request.args)
+
+        def load_post():
+            connection = get_read_connection(shared=True)
+            cursor = connection.cursor(cursor_factory=DictRowCursor)
+            cursor.execute(query, params)
+            return finish_post(cursor.fetchone())
+
+        namespaces = ["post:%d" % post_id, "users"]
+        if "comments" in includes:
+            namespaces.append("comments:%d" % post_id)
+        post = read_cache.get_or_load(cache_key("post:%d" % post_id, request.args), namespaces, load_post)
         if not post:
             return jsonify({"error": "Post not found"}), 404
+        delta = pending_like_delta(post_id)
+        if delta and "like_count" in post:
+            post = dict(post, like_count=post["like_count"] + delta)
         return jsonify({"post": post}), 200
+    except FieldsError as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@post_routes.route('/posts/<int:post_id>/related', methods=['GET'])
+def get_related_posts(post_id):
+    try:
+        # "More like this": cosine similarity of TF-IDF vectors over title, content and tags
+        index = get_related_index()
+        if index is None:
+            return jsonify({"error": "Related posts are not available yet"}), 503
+        limit = bounded_int_arg(request.args, 'limit', 10, 50)
+        related = index.related(post_id, limit)
+        cursor = get_read_connection().cursor(cursor_factory=DictRowCursor)
+        if related is None:
+            # Not indexed: no searchable text, written by another worker since the last sync, or missing
+            cursor.execute("SELECT 1 FROM posts WHERE id = %s;", (post_id,))
+            if not cursor.fetchone():
+                return jsonify({"error": "Post not found"}), 404
+            related = []
+
+        posts = {}
+        if related:
+            query, params = build_related_query(request.args, [related_id for related_id, _ in related])
+            cursor.execute(query, params)
+            posts = {post["id"]: post for post in cursor.fetchall()}
+        related = [dict(posts[related_id], similarity=round(score, 4)) for related_id, score in related if related_id in posts]
+        return jsonify({"posts": related}), 200
+    except FieldsError as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@post_routes.route('/posts/<int:post_id>/tags-status', methods=['GET'])
+def get_tags_status(post_id):
+    try:
+        connection = get_read_connection()
+        cursor = connection.cursor(cursor_factory=DictRowCursor)
+        cursor.execute("SELECT id AS post_id, tags, tags_status FROM posts WHERE id = %s;", (post_id,))
+        status = cursor.fetchone()
+        if not status:
+            return jsonify({"error": "Post not found"}), 404
+        return jsonify(status), 200
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
 
 
 @post_routes.route('/posts/<int:post_id>', methods=['PUT'])
@@ -161,35 +264,18 @@ def update_post(post_id):
         if not post_data.get("title") and not post_data.get("content") and not post_data.get("tags") and not post_data.get("media_url"):
             return jsonify({"error": "At least one field (title, content, tags, media_url) is required to update"}), 400
         connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute("SELECT * FROM posts WHERE id = %s AND user_id = %s;", (post_id, current_user["id"]))
-        post = cursor.fetchone()
-        if not post:
-            return jsonify({"error": "Post not found or you are not authorized to update this post"}), 403
-        update_fields = []
-        update_values = []
-        if post_data.get("title"):
-            update_fields.append("title = %s")
-            update_values.append(post_data["title"])
-        if post_data.get("content"):
-            update_fields.append("content = %s")
-            update_values.append(post_data["content"])
-        if post_data.get("tags"):
-            update_fields.append("tags = %s")
-            update_values.append(post_data["tags"])
-        if post_data.get("media_url"):
-            update_fields.append("media_url = %s")
-            update_values.append(post_data["media_url"])
-        update_values.append(post_id)
-        query = f"UPDATE posts SET {', '.join(update_fields)}, updated_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING *;"
+        cursor = connection.cursor(cursor_factory=DictRowCursor)
+        query, update_values = build_update_post_query(post_id, current_user["id"], post_data)
         cursor.execute(query, update_values)
         updated_post = cursor.fetchone()
+        if not updated_post:
+            return jsonify({"error": "Post not found or you are not authorized to update this post"}), 403
         connection.commit()
+        read_cache.invalidate("post:%d" % post_id, "posts")
+        index_post(updated_post)
         return jsonify({"post": updated_post}), 200
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
 
 
 @post_routes.route('/posts/<int:post_id>', methods=['DELETE'])
@@ -201,25 +287,22 @@ def delete_post(post_id):
 
         # Connect to the database
         connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor = connection.cursor(cursor_factory=DictRowCursor)
 
-        # Check if the post exists and belongs to the current user
-        cursor.execute("SELECT * FROM posts WHERE id = %s AND user_id = %s;", (post_id, current_user["id"]))
+        # Delete the post if it exists and belongs to the current user
+        cursor.execute("DELETE FROM posts WHERE id = %s AND user_id = %s RETURNING id;", (post_id, current_user["id"]))
         post = cursor.fetchone()
 
         if not post:
             return jsonify({"error": "Post not found or you are not authorized to delete this post"}), 403
-
-        # Delete the post
-        cursor.execute("DELETE FROM posts WHERE id = %s;", (post_id,))
         connection.commit()
+        read_cache.invalidate("post:%d" % post_id, "comments:%d" % post_id, "posts")
+        unindex_post(post_id)
 
         # Return a success message
         return jsonify({"message": "Post deleted successfully"}), 200
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
 
 
 @post_routes.route('/posts/<int:post_id>/comments', methods=['POST'])
@@ -236,70 +319,84 @@ def add_comment(post_id):
 
         # Connect to the database
         connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-        # Check if the post exists
-        cursor.execute("SELECT * FROM posts WHERE id = %s;", (post_id,))
-        post = cursor.fetchone()
-        if not post:
-            return jsonify({"error": "Post not found"}), 404
-
-        # Insert the comment into the database
-        cursor.execute(
-            """
-            INSERT INTO comments (content, user_id, post_id) 
-            VALUES (%s, %s, %s) RETURNING *;
-            """,
-            (comment_data["content"], current_user["id"], post_id)
-        )
+        cursor = connection.cursor(cursor_factory=DictRowCursor)
+
+        # Insert the comment into the database; the foreign key rejects a missing post
+        try:
+            cursor.execute(
+                """
+                INSERT INTO comments (content, user_id, post_id) 
+                VALUES (%s, %s, %s) RETURNING *;
+                """,
+                (comment_data["content"], current_user["id"], post_id)
+            )
+        except psycopg2.errors.ForeignKeyViolation as err:
+            connection.rollback()
+            if err.diag.constraint_name == "comments_post_id_fkey":
+                return jsonify({"error": "Post not found"}), 404
+            # The token outlived its user (deleted account)
+            return jsonify({"error": "User not found"}), 401
         new_comment = cursor.fetchone()
         connection.commit()
+        read_cache.invalidate("comments:%d" % post_id, "post:%d" % post_id)
 
         # Return the created comment as a response
         return jsonify({"comment": new_comment}), 201
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
 
 @post_routes.route('/posts/<int:post_id>/comments', methods=['GET'])
 def get_comments(post_id):
     try:
-        # Get query parameters for pagination
-        page = int(request.args.get('page', 1))  # Default to page 1
-        limit = int(request.args.get('limit', 10))  # Default to 10 comments per page
-        offset = (page - 1) * limit
+        # Get query parameters for pagination: an opaque cursor, or a page number
+        page, limit, page_cursor = get_page_args(request.args)  # Default to 10 comments per page
+
+        # Retrieve paginated comments for the post, resuming after the cursor if given
+        query, params = build_comments_query(post_id, page, limit, page_cursor)
+
+        def load_comments(shared=False):
+            connection = get_read_connection(shared)
+            cursor = connection.cursor(cursor_factory=DictRowCursor)
+
+            # Check if the post exists
+            cursor.execute("SELECT * FROM posts WHERE id = %s;", (post_id,))
+            post = cursor.fetchone()
+            if not post:
+                return None
+
+            cursor.execute(query, params)
+            return [dict(comment) for comment in cursor.fetchall()]
+
+        # The first pages of a post's comments come from the cache
+        if not page_cursor and page <= CACHED_LIST_PAGES:
+            rows = read_cache.get_or_load(cache_key("comments:%d" % post_id, request.args), ["comments:%d" % post_id, "users"], lambda: load_comments(shared=True), ttl=LIST_CACHE_TTL)
+        else:
+            rows = load_comments()
+        if rows is None:
+            return jsonify({"error": "Post not found"}), 404
+        comments, next_cursor = finish_comments_page(rows, limit)
 
-        # Connect to the database
-        connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        # Return the comments as a response
+        return jsonify({"comments": comments, "page": page, "limit": limit, "next_cursor": next_cursor}), 200
+    except PaginationError as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
 
+@post_routes.route('/posts/<int:post_id>/comments/export', methods=['GET'])
+def export_comments(post_id):
+    try:
         # Check if the post exists
-        cursor.execute("SELECT * FROM posts WHERE id = %s;", (post_id,))
-        post = cursor.fetchone()
-        if not post:
+        cursor = get_read_connection().cursor()
+        cursor.execute("SELECT 1 FROM posts WHERE id = %s;", (post_id,))
+        if cursor.fetchone() is None:
             return jsonify({"error": "Post not found"}), 404
 
-        # Retrieve paginated comments for the post
-        cursor.execute(
-            """
-            SELECT comments.*, users.username AS author 
-            FROM comments 
-            JOIN users ON comments.user_id = users.id
-            WHERE comments.post_id = %s
-            ORDER BY comments.created_at ASC
-            LIMIT %s OFFSET %s;
-            """,
-            (post_id, limit, offset)
-        )
-        comments = cursor.fetchall()
-
-        # Return the comments as a response
-        return jsonify({"comments": comments, "page": page, "limit": limit}), 200
+        # All of the post's comments, oldest first, as NDJSON
+        query, params = build_comments_query(post_id, 1, None, None)
+        return stream_ndjson(query, params)
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
 
 @post_routes.route('/comments/<int:comment_id>', methods=['DELETE'])
 @token_required
@@ -310,29 +407,28 @@ def delete_comment(comment_id):
 
         # Connect to the database
         connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor = connection.cursor(cursor_factory=DictRowCursor)
 
-        # Check if the comment exists and belongs to the current user
-        cursor.execute("SELECT * FROM comments WHERE id = %s;", (comment_id,))
+        # Delete the comment if it belongs to the current user (admins may delete any)
+        cursor.execute(
+            "DELETE FROM comments WHERE id = %s AND (user_id = %s OR %s) RETURNING post_id;",
+            (comment_id, current_user["id"], bool(current_user.get("is_admin")))
+        )
         comment = cursor.fetchone()
 
         if not comment:
-            return jsonify({"error": "Comment not found"}), 404
-
-        # Check if the user is authorized to delete the comment
-        if comment["user_id"] != current_user["id"] and not current_user.get("is_admin"):
-           return jsonify({"error": "You are not authorized to delete this comment"}), 403
-
-        # Delete the comment
-        cursor.execute("DELETE FROM comments WHERE id = %s;", (comment_id,))
+            # Only the failure path pays for telling "missing" from "not yours"
+            cursor.execute("SELECT 1 FROM comments WHERE id = %s;", (comment_id,))
+            if cursor.fetchone() is None:
+                return jsonify({"error": "Comment not found"}), 404
+            return jsonify({"error": "You are not authorized to delete this comment"}), 403
         connection.commit()
+        read_cache.invalidate("comments:%d" % comment["post_id"], "post:%d" % comment["post_id"])
 
         # Return a success message
         return jsonify({"message": "Comment deleted successfully"}), 200
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
 
 @post_routes.route('/posts/<int:post_id>/like', methods=['POST'])
 @token_required
@@ -341,36 +437,40 @@ def like_post(post_id):
         # Get the current user from the global 'g' object
         current_user = g.user
 
+        if LIKE_WRITE_BEHIND:
+            recorded = record_buffered_like(post_id, True)
+            if recorded is None:
+                return jsonify({"error": "Post not found"}), 404
+            if not recorded:
+                return jsonify({"error": "You have already liked this post"}), 400
+            return jsonify({"message": "Post liked successfully", "like": {"user_id": current_user["id"], "post_id": post_id}}), 201
+
         # Connect to the database
         connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor = connection.cursor(cursor_factory=DictRowCursor)
 
-        # Check if the post exists
-        cursor.execute("SELECT * FROM posts WHERE id = %s;", (post_id,))
-        post = cursor.fetchone()
-        if not post:
-            return jsonify({"error": "Post not found"}), 404
-
-        # Check if the user has already liked the post
-        cursor.execute("SELECT * FROM likes WHERE user_id = %s AND post_id = %s;", (current_user["id"], post_id))
-        like = cursor.fetchone()
-        if like:
-            return jsonify({"error": "You have already liked this post"}), 400
-
-        # Insert the like into the database
-        cursor.execute(
-            "INSERT INTO likes (user_id, post_id) VALUES (%s, %s) RETURNING *;",
-            (current_user["id"], post_id)
-        )
+        # Insert the like; the unique index turns a repeat into no row and the foreign key rejects a missing post
+        try:
+            cursor.execute(
+                "INSERT INTO likes (user_id, post_id) VALUES (%s, %s) ON CONFLICT (user_id, post_id) DO NOTHING RETURNING *;",
+                (current_user["id"], post_id)
+            )
+        except psycopg2.errors.ForeignKeyViolation as err:
+            connection.rollback()
+            if err.diag.constraint_name == "likes_post_id_fkey":
+                return jsonify({"error": "Post not found"}), 404
+            # The token outlived its user (deleted account)
+            return jsonify({"error": "User not found"}), 401
         new_like = cursor.fetchone()
+        if not new_like:
+            return jsonify({"error": "You have already liked this post"}), 400
         connection.commit()
+        read_cache.invalidate("post:%d" % post_id)
 
         # Return a success message
         return jsonify({"message": "Post liked successfully", "like": new_like}), 201
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
 
 @post_routes.route('/posts/<int:post_id>/like', methods=['DELETE'])
 @token_required
@@ -379,61 +479,62 @@ def unlike_post(post_id):
         # Get the current user from the global 'g' object
         current_user = g.user
 
+        if LIKE_WRITE_BEHIND:
+            if not record_buffered_like(post_id, False):
+                return jsonify({"error": "You have not liked this post"}), 400
+            return jsonify({"message": "Post unliked successfully"}), 200
+
         # Connect to the database
         connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor = connection.cursor(cursor_factory=DictRowCursor)
 
-        # Check if the like exists
-        cursor.execute("SELECT * FROM likes WHERE user_id = %s AND post_id = %s;", (current_user["id"], post_id))
+        # Delete the like if there is one
+        cursor.execute("DELETE FROM likes WHERE user_id = %s AND post_id = %s RETURNING post_id;", (current_user["id"], post_id))
         like = cursor.fetchone()
         if not like:
             return jsonify({"error": "You have not liked this post"}), 400
-
-        # Delete the like
-        cursor.execute("DELETE FROM likes WHERE user_id = %s AND post_id = %s;", (current_user["id"], post_id))
         connection.commit()
+        read_cache.invalidate("post:%d" % post_id)
 
         # Return a success message
         return jsonify({"message": "Post unliked successfully"}), 200
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
 
 @post_routes.route('/posts/<int:post_id>/likes', methods=['GET'])
 def get_like_count(post_id):
     try:
-        # Connect to the database
-        connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        def load_like_count():
+            connection = get_read_connection(shared=True)
+            cursor = connection.cursor(cursor_factory=DictRowCursor)
 
-        # Check if the post exists
-        cursor.execute("SELECT * FROM posts WHERE id = %s;", (post_id,))
-        post = cursor.fetchone()
+            # Read the denormalized like count; no row means the post doesn't exist
+            cursor.execute("SELECT like_count FROM posts WHERE id = %s;", (post_id,))
+            post = cursor.fetchone()
+            return dict(post) if post else None
+
+        post = read_cache.get_or_load("likes:%d" % post_id, ["post:%d" % post_id], load_like_count)
         if not post:
             return jsonify({"error": "Post not found"}), 404
 
-        # Get the like count for the post
-        cursor.execute("SELECT COUNT(*) AS like_count FROM likes WHERE post_id = %s;", (post_id,))
-        like_count = cursor.fetchone()
-
-        # Return the like count
-        return jsonify({"like_count": like_count["like_count"]}), 200
+        # Return the like count, counting likes still in the write-behind buffer
+        return jsonify({"like_count": post["like_count"] + pending_like_delta(post_id)}), 200
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
 
 @post_routes.route('/users/<int:user_id>', methods=['GET'])
 def get_user_profile(user_id):
     try:
-        # Connect to the database
-        connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        def load_user():
+            connection = get_read_connection(shared=True)
+            cursor = connection.cursor(cursor_factory=DictRowCursor)
 
-        # Fetch the user's profile
-        cursor.execute("SELECT id, username, email, created_at FROM users WHERE id = %s;", (user_id,))
-        user = cursor.fetchone()
+            # Fetch the user's profile
+            cursor.execute("SELECT id, username, email, created_at FROM users WHERE id = %s;", (user_id,))
+            user = cursor.fetchone()
+            return dict(user) if user else None
+
+        user = read_cache.get_or_load("user:%d" % user_id, ["user:%d" % user_id], load_user)
 
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -442,8 +543,6 @@ def get_user_profile(user_id):
         return jsonify({"user": user}), 200
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
 
 @post_routes.route('/users/<int:user_id>', methods=['PUT'])
 @token_required
@@ -463,41 +562,31 @@ def update_user_profile(user_id):
 
         # Connect to the database
         connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor = connection.cursor(cursor_factory=DictRowCursor)
 
         # Update the user's profile
-        update_fields = []
-        update_values = []
-
-        if profile_data.get("username"):
-            update_fields.append("username = %s")
-            update_values.append(profile_data["username"])
-        if profile_data.get("email"):
-            update_fields.append("email = %s")
-            update_values.append(profile_data["email"])
-
-        if not update_fields:
+        query, update_values = build_update_user_query(user_id, profile_data)
+        if query is None:
             return jsonify({"error": "No valid fields to update"}), 400
-
-        update_values.append(user_id)
-        query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = %s RETURNING id, username, email, created_at;"
         cursor.execute(query, update_values)
         updated_user = cursor.fetchone()
         connection.commit()
+        read_cache.invalidate("user:%d" % user_id, "users")
 
         # Return the updated profile
         return jsonify({"user": updated_user}), 200
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
 
 @post_routes.route('/users/<int:user_id>/posts', methods=['GET'])
 def get_user_posts(user_id):
     try:
+        # Get query parameters for pagination: an opaque cursor, or a page number
+        page, limit, page_cursor = get_page_args(request.args)  # Default to 10 posts per page
+
         # Connect to the database
-        connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        connection = get_read_connection()
+        cursor = connection.cursor(cursor_factory=DictRowCursor)
 
         # Check if the user exists
         cursor.execute("SELECT * FROM users WHERE id = %s;", (user_id,))
@@ -505,55 +594,82 @@ def get_user_posts(user_id):
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        # Fetch all posts created by the user
+        # Fetch a page of posts created by the user
+        query, params = build_user_posts_query(user_id, request.args, page, limit, page_cursor)
+        cursor.execute(query, params)
+        posts, next_cursor = finish_user_posts_page(cursor.fetchall(), limit)
+
+        return jsonify({"posts": with_pending_likes(posts), "page": page, "limit": limit, "next_cursor": next_cursor}), 200
+    except (PaginationError, FieldsError) as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+
+@post_routes.route('/users/<int:user_id>/posts/export', methods=['GET'])
+def export_user_posts(user_id):
+    try:
+        # Check if the user exists
+        cursor = get_read_connection().cursor()
+        cursor.execute("SELECT 1 FROM users WHERE id = %s;", (user_id,))
+        if cursor.fetchone() is None:
+            return jsonify({"error": "User not found"}), 404
+
+        # Every post the user has written, newest first, as NDJSON
+        query, params = build_user_posts_query(user_id, request.args, 1, None, None)
+        return stream_ndjson(query, params)
+    except FieldsError as err:
+        return jsonify({"error": str(err)}), 400
+    except Exception as err:
+        return jsonify({"error": str(err)}), 500
+
+
+@post_routes.route('/tags', methods=['GET'])
+def get_tags():
+    try:
+        limit = bounded_int_arg(request.args, 'limit', 50, 100)  # Default to the 50 most used tags
+
+        # Connect to the database
+        connection = get_read_connection()
+        cursor = connection.cursor(cursor_factory=DictRowCursor)
+
+        # Counts are maintained by triggers on post_tags, so this is an index scan
         cursor.execute(
             """
-            SELECT posts.*, users.username AS author 
-            FROM posts 
-            JOIN users ON posts.user_id = users.id
-            WHERE posts.user_id = %s
-            ORDER BY posts.created_at DESC;
+            SELECT name, post_count FROM tags
+            WHERE post_count > 0
+            ORDER BY post_count DESC, name
+            LIMIT %s;
             """,
-            (user_id,)
+            (limit,)
         )
-        posts = cursor.fetchall()
+        tags = cursor.fetchall()
 
-        
-        return jsonify({"posts": posts}), 200
+        return jsonify({"tags": tags}), 200
+    except FieldsError as err:
+        return jsonify({"error": str(err)}), 400
     except Exception as err:
         return jsonify({"error": str(err)}), 500
-    finally:
-        connection.close()
-
 
 
 @post_routes.route('/posts/suggest-tags', methods=['POST'])
 @token_required
 def suggest_tags():
     try:
-        # Get the post content from the request
+        # Accept a single "content" string or a list of "contents" to tag in one call
         post_data = request.get_json()
+        contents = post_data.get("contents")
+        if contents is not None:
+            if not isinstance(contents, list) or not contents or not all(isinstance(c, str) and c for c in contents):
+                return jsonify({"error": "Contents must be a non-empty list of post contents"}), 400
+            return jsonify({"suggested_tags": suggest_tags_many(contents)}), 200
+
         content = post_data.get("content")
         if not content:
             return jsonify({"error": "Post content is required"}), 400
 
-        # Use spaCy to analyze the content
-        import spacy
-        nlp = spacy.load("en_core_web_sm")
-        doc = nlp(content)
-
-        # Extract keywords and named entities as tags
-        tags = set()
-        for token in doc:
-            if token.is_alpha and not token.is_stop and token.pos_ in ["NOUN", "PROPN"]:
-                tags.add(token.lemma_.lower())
-        for ent in doc.ents:
-            tags.add(ent.text.lower())
-
-        # Limit the number of tags to 5
-        suggested_tags = list(tags)[:5]
-
         # Return the suggested tags
-        return jsonify({"suggested_tags": suggested_tags}), 200
+        return jsonify({"suggested_tags": suggest_tags_for(content)}), 200
     except Exception as err:
         return jsonify({"error": str(err)}), 500
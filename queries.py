@@ -0,0 +1,401 @@
+from datetime import datetime
+from pagination import decode_cursor, split_page
+
+# SQL builders shared by the sync (post_routes) and async (async_post_routes)
+# handlers. Both drivers use %s placeholders, so the same (query, params) pairs
+# run unchanged on psycopg2 and psycopg 3.
+
+# Search terms shorter than this use a substring match instead of full-text search
+MIN_FULL_TEXT_QUERY_LENGTH = 3
+
+# Selectable post fields for fields= and view=summary on the listing endpoints
+POST_FIELDS = {
+    "id": "posts.id",
+    "title": "posts.title",
+    "content": "posts.content",
+    "excerpt": "CASE WHEN char_length(posts.content) > %s THEN rtrim(left(posts.content, %s)) || '…' ELSE posts.content END AS excerpt",
+    "tags": "posts.tags",
+    "tags_status": "posts.tags_status",
+    "media_url": "posts.media_url",
+    "user_id": "posts.user_id",
+    "author": "users.username AS author",
+    "created_at": "posts.created_at",
+    "updated_at": "posts.updated_at",
+    "like_count": "posts.like_count",
+    "comment_count": "posts.comment_count",
+}
+SUMMARY_FIELDS = ["id", "title", "excerpt", "tags", "media_url", "user_id", "author", "created_at", "like_count", "comment_count"]
+# Always selected: the keyset cursors are built from them
+REQUIRED_FIELDS = ["id", "created_at"]
+DEFAULT_EXCERPT_LENGTH = 200
+MAX_EXCERPT_LENGTH = 2000
+
+
+# Related data that get_post and get_posts can embed with include=
+POST_INCLUDES = {"comments", "like_count", "author_profile"}
+POSTS_INCLUDES = {"like_count", "comment_preview"}
+DEFAULT_INCLUDED_COMMENTS = 10
+MAX_INCLUDED_COMMENTS = 100
+DEFAULT_COMMENT_PREVIEW = 3
+MAX_COMMENT_PREVIEW = 20
+
+# Embedded comments as one JSON array per post, oldest first (or newest first for previews)
+COMMENTS_LATERAL = """
+    LEFT JOIN LATERAL (
+        SELECT json_agg(included ORDER BY included.created_at {order}, included.id {order}) AS items
+        FROM (
+            SELECT comments.*, commenters.username AS author
+            FROM comments
+            JOIN users AS commenters ON commenters.id = comments.user_id
+            WHERE comments.post_id = posts.id
+            ORDER BY comments.created_at {order}, comments.id {order}
+            LIMIT %s
+        ) AS included
+    ) AS {alias} ON true
+"""
+
+
+class FieldsError(ValueError):
+    pass
+
+
+def parse_includes(args, allowed):
+    includes = parse_tag_list(args.get('include'))
+    unknown = [name for name in includes if name not in allowed]
+    if unknown:
+        raise FieldsError("Unknown include: %s (expected %s)" % (", ".join(unknown), ", ".join(sorted(allowed))))
+    return includes
+
+
+def bounded_int_arg(args, name, default, maximum):
+    try:
+        value = int(args.get(name, default))
+    except ValueError:
+        raise FieldsError("%s must be an integer" % name)
+    if not 1 <= value <= maximum:
+        raise FieldsError("%s must be between 1 and %d" % (name, maximum))
+    return value
+
+
+def parse_json_timestamps(rows):
+    # json_agg renders timestamps as ISO strings; turn them back into datetimes
+    # so embedded rows serialize exactly like top-level ones
+    for row in rows:
+        for key in ("created_at", "updated_at"):
+            if isinstance(row.get(key), str):
+                row[key] = datetime.fromisoformat(row[key])
+    return rows
+
+
+def parse_tag_list(value):
+    # Same normalization the post_tags_sync trigger applies to posts.tags
+    if not value:
+        return []
+    return list(dict.fromkeys(tag.strip().lower() for tag in value.split(",") if tag.strip()))
+
+
+def build_post_projection(args, extra_fields=()):
+    # Returns (select list, params). Without fields= or view=summary this is the
+    # full row, as before; otherwise only the requested columns (plus any
+    # extra_fields an include= needs) leave Postgres.
+    fields = parse_tag_list(args.get('fields'))
+    view = args.get('view', 'full')
+    if view not in ("full", "summary"):
+        raise FieldsError("view must be 'full' or 'summary'")
+    if not fields and view == "full":
+        return "posts.*, users.username AS author", []
+    fields = fields or SUMMARY_FIELDS
+    unknown = [field for field in fields if field not in POST_FIELDS]
+    if unknown:
+        raise FieldsError("Unknown fields: %s" % ", ".join(unknown))
+
+    params = []
+    if "excerpt" in fields:
+        excerpt_length = bounded_int_arg(args, 'excerpt_length', DEFAULT_EXCERPT_LENGTH, MAX_EXCERPT_LENGTH)
+        params = [excerpt_length, excerpt_length]
+    columns = [POST_FIELDS[field] for field in dict.fromkeys(REQUIRED_FIELDS + fields + list(extra_fields))]
+    return ", ".join(columns), params
+
+
+def is_full_text(search_query):
+    # Full-text search for real queries; very short ones fall back to ILIKE
+    return bool(search_query) and len(search_query.strip()) >= MIN_FULL_TEXT_QUERY_LENGTH
+
+
+def add_page_limit(query, params, page, limit, page_cursor):
+    # One extra row tells split_page whether there is a next page
+    if limit is None:
+        return query + ";", params
+    return query + " LIMIT %s OFFSET %s;", params + [limit + 1, 0 if page_cursor else (page - 1) * limit]
+
+
+def build_posts_query(args, page, limit, page_cursor):
+    # limit=None leaves the result unbounded, for the streaming export
+    # Get query parameters for search and filtering
+    search_query = args.get('q')  # Search keyword
+    tag_filter = args.get('tag')  # Filter by tag (comma-separated for several)
+    tag_mode = args.get('tag_mode', 'all')  # 'all' or 'any' of the tags
+    if tag_mode not in ("all", "any"):
+        raise FieldsError("tag_mode must be 'all' or 'any'")
+    author_filter = args.get('author')  # Filter by author username
+
+    full_text = is_full_text(search_query)
+    includes = parse_includes(args, POSTS_INCLUDES)
+    columns, params = build_post_projection(args, [name for name in includes if name == "like_count"])
+
+    # Base query to fetch posts
+    if full_text:
+        query = f"""
+            SELECT {columns},
+                   ts_rank(post_search.document, search)::float8 AS rank,
+                   ts_headline('english', posts.title, search, 'HighlightAll=true') AS title_highlight,
+                   ts_headline('english', posts.content, search, 'MaxFragments=2, MaxWords=20, MinWords=5') AS content_highlight
+            FROM posts
+            JOIN users ON posts.user_id = users.id
+            JOIN post_search ON post_search.post_id = posts.id
+            CROSS JOIN websearch_to_tsquery('english', %s) AS search
+        """
+        params.append(search_query)
+    else:
+        query = f"""
+            SELECT {columns}
+            FROM posts
+            JOIN users ON posts.user_id = users.id
+        """
+
+    conditions = []
+
+    # Add search condition
+    if full_text:
+        conditions.append("post_search.document @@ search")
+    elif search_query:
+        conditions.append("(posts.title ILIKE %s OR posts.content ILIKE %s)")
+        params.extend([f"%{search_query}%", f"%{search_query}%"])
+
+    # Add tag filter condition: tag=a,b matches posts with all (or, with tag_mode=any, any) of the tags
+    tag_names = parse_tag_list(tag_filter)
+    if tag_names and tag_mode == "any":
+        conditions.append("""
+            EXISTS (
+                SELECT 1 FROM post_tags JOIN tags ON tags.id = post_tags.tag_id
+                WHERE post_tags.post_id = posts.id AND tags.name = ANY(%s)
+            )
+        """)
+        params.append(tag_names)
+    elif tag_names:
+        conditions.append("""
+            posts.id IN (
+                SELECT post_tags.post_id FROM post_tags JOIN tags ON tags.id = post_tags.tag_id
+                WHERE tags.name = ANY(%s)
+                GROUP BY post_tags.post_id
+                HAVING COUNT(*) = %s
+            )
+        """)
+        params.extend([tag_names, len(tag_names)])
+
+    # Add author filter condition
+    if author_filter:
+        conditions.append("users.username = %s")
+        params.append(author_filter)
+
+    # Resume after the last row of the previous page
+    if page_cursor:
+        if full_text:
+            conditions.append("(ts_rank(post_search.document, search)::float8, posts.created_at, posts.id) < (%s, %s, %s)")
+        else:
+            conditions.append("(posts.created_at, posts.id) < (%s, %s)")
+        params.extend(decode_cursor(page_cursor, "rank" if full_text else "date"))
+
+    # Combine conditions with AND
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    # Add ordering (by relevance when searching) and pagination
+    if full_text:
+        order = " ORDER BY rank DESC, posts.created_at DESC, posts.id DESC"
+    else:
+        order = " ORDER BY posts.created_at DESC, posts.id DESC"
+    query, params = add_page_limit(query + order, params, page, limit, page_cursor)
+
+    # The newest few comments of every post on the page, in the same query. The
+    # page is cut first, so previews are only built for the rows returned, not
+    # for every row the sort reads or the OFFSET skips. Aliasing it as posts
+    # keeps COMMENTS_LATERAL and the ordering unchanged.
+    if "comment_preview" in includes:
+        query = f"""
+            SELECT posts.*, COALESCE(preview.items, '[]'::json) AS comment_preview
+            FROM ({query.rstrip(";")}) AS posts
+        """ + COMMENTS_LATERAL.format(order="DESC", alias="preview") + order + ";"
+        params.append(bounded_int_arg(args, 'preview_comments', DEFAULT_COMMENT_PREVIEW, MAX_COMMENT_PREVIEW))
+
+    return query, params
+
+
+def finish_posts_page(rows, limit, args):
+    # Returns (posts, next_cursor) for rows fetched with build_posts_query
+    for row in rows:
+        if "comment_preview" in row:
+            parse_json_timestamps(row["comment_preview"])
+    if not is_full_text(args.get('q')):
+        return split_page(rows, limit, "date", lambda post: (post["created_at"], post["id"]))
+
+    posts, next_cursor = split_page(rows, limit, "rank", lambda post: (post["rank"], post["created_at"], post["id"]))
+    return [group_highlight(post) for post in posts], next_cursor
+
+
+def group_highlight(post):
+    # Group match highlights under one key
+    post = dict(post)
+    post["highlight"] = {
+        "title": post.pop("title_highlight"),
+        "content": post.pop("content_highlight")
+    }
+    return post
+
+
+def build_post_query(post_id, args):
+    # One post with whatever include= asks for, fetched in a single statement
+    includes = parse_includes(args, POST_INCLUDES)
+    columns = "posts.*, users.username AS author"  # like_count is a column of posts
+    params = []
+    if "author_profile" in includes:
+        columns += """,
+            json_build_object('id', users.id, 'username', users.username, 'email', users.email, 'created_at', users.created_at) AS author_profile"""
+    if "comments" in includes:
+        columns += ", COALESCE(included_comments.items, '[]'::json) AS comments"
+    query = f"""
+        SELECT {columns}
+        FROM posts
+        JOIN users ON posts.user_id = users.id
+    """
+    if "comments" in includes:
+        query += COMMENTS_LATERAL.format(order="ASC", alias="included_comments")
+        params.append(bounded_int_arg(args, 'comments_limit', DEFAULT_INCLUDED_COMMENTS, MAX_INCLUDED_COMMENTS))
+    query += " WHERE posts.id = %s;"
+    params.append(post_id)
+    return query, params, includes
+
+
+def finish_post(post):
+    if post is None:
+        return None
+    post = dict(post)
+    if "author_profile" in post:
+        parse_json_timestamps([post["author_profile"]])
+    if "comments" in post:
+        parse_json_timestamps(post["comments"])
+    return post
+
+
+def build_trending_query(args, window_name, window_length, limit):
+    # The top of the precomputed ranking: an index scan on (window_name, score DESC)
+    columns, params = build_post_projection(args)
+    query = f"""
+        SELECT {columns}
+        FROM trending_scores
+        JOIN posts ON posts.id = trending_scores.post_id
+        JOIN users ON posts.user_id = users.id
+        WHERE trending_scores.window_name = %s
+          AND trending_scores.last_event_at > NOW() - make_interval(secs => %s)
+        ORDER BY trending_scores.score DESC
+        LIMIT %s;
+    """
+    params.extend([window_name, window_length, limit])
+    return query, params
+
+
+def build_related_query(args, post_ids):
+    # The related posts' rows in one primary key lookup; the caller restores the similarity order
+    columns, params = build_post_projection(args)
+    query = f"""
+        SELECT {columns}
+        FROM posts
+        JOIN users ON posts.user_id = users.id
+        WHERE posts.id = ANY(%s);
+    """
+    params.append(post_ids)
+    return query, params
+
+
+def build_comments_query(post_id, page, limit, page_cursor):
+    # Paginated comments for a post, resuming after the cursor if given
+    query = """
+        SELECT comments.*, users.username AS author
+        FROM comments
+        JOIN users ON comments.user_id = users.id
+        WHERE comments.post_id = %s
+    """
+    params = [post_id]
+    if page_cursor:
+        query += " AND (comments.created_at, comments.id) > (%s, %s)"
+        params.extend(decode_cursor(page_cursor, "date"))
+    query += " ORDER BY comments.created_at ASC, comments.id ASC"
+    return add_page_limit(query, params, page, limit, page_cursor)
+
+
+def finish_comments_page(rows, limit):
+    return split_page(rows, limit, "date", lambda comment: (comment["created_at"], comment["id"]))
+
+
+def build_user_posts_query(user_id, args, page, limit, page_cursor):
+    # A page of posts created by the user, with the same fields= and view= options as build_posts_query
+    columns, params = build_post_projection(args)
+    query = f"""
+        SELECT {columns}
+        FROM posts
+        JOIN users ON posts.user_id = users.id
+        WHERE posts.user_id = %s
+    """
+    params.append(user_id)
+    if page_cursor:
+        query += " AND (posts.created_at, posts.id) < (%s, %s)"
+        params.extend(decode_cursor(page_cursor, "date"))
+    query += " ORDER BY posts.created_at DESC, posts.id DESC"
+    return add_page_limit(query, params, page, limit, page_cursor)
+
+
+def finish_user_posts_page(rows, limit):
+    return split_page(rows, limit, "date", lambda post: (post["created_at"], post["id"]))
+
+
+def build_update_post_query(post_id, user_id, post_data):
+    # Only the author's own post matches, so no row back means not found or not theirs
+    update_fields = []
+    update_values = []
+    if post_data.get("title"):
+        update_fields.append("title = %s")
+        update_values.append(post_data["title"])
+    if post_data.get("content"):
+        update_fields.append("content = %s")
+        update_values.append(post_data["content"])
+    if post_data.get("tags"):
+        update_fields.append("tags = %s")
+        update_values.append(post_data["tags"])
+        # Explicit tags win over a pending background suggestion
+        update_fields.append("tags_status = 'done'")
+    if post_data.get("media_url"):
+        update_fields.append("media_url = %s")
+        update_values.append(post_data["media_url"])
+    update_values.extend([post_id, user_id])
+    query = f"UPDATE posts SET {', '.join(update_fields)}, updated_at = CURRENT_TIMESTAMP WHERE id = %s AND user_id = %s RETURNING *;"
+    return query, update_values
+
+
+def build_update_user_query(user_id, profile_data):
+    # Returns (None, None) when there is nothing to update
+    update_fields = []
+    update_values = []
+
+    if profile_data.get("username"):
+        update_fields.append("username = %s")
+        update_values.append(profile_data["username"])
+    if profile_data.get("email"):
+        update_fields.append("email = %s")
+        update_values.append(profile_data["email"])
+
+    if not update_fields:
+        return None, None
+
+    update_values.append(user_id)
+    query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = %s RETURNING id, username, email, created_at;"
+    return query, update_values
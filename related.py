@@ -0,0 +1,479 @@
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from db_utils import pooled_connection
+from metrics import related_build_time, related_query_time
+
+try:
+    import numpy as np
+    import scipy.sparse as sp
+except ImportError:  # GET /posts/<id>/related answers 503 without them
+    np = sp = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RELATED_POSTS = os.getenv('RELATED_POSTS', 'on') != 'off' and np is not None
+INDEX_PATH = os.getenv('RELATED_INDEX_PATH', 'related_index.npz')
+
+TITLE_WEIGHT = 2  # A title word counts as two occurrences in the content
+TAG_WEIGHT = 3  # A shared tag outweighs a shared word
+TOKEN_RE = re.compile(r"[^\W_]{2,}")
+STOP_WORDS = frozenset("""
+    about after again all also am an and any are as at be because been before being between both but by can
+    could did do does doing down during each few for from further had has have having he her here hers him his
+    how if in into is it its itself just me more most my no nor not now of off on once only or other our ours
+    out over own same she should so some such than that the their theirs them then there these they this those
+    through to too under until up very was we were what when where which while who whom why will with would you
+    your yours
+""".split())
+
+
+def post_terms(title, content, tags):
+    # Term -> weighted count; tags become "#tag" terms so they only match other tags
+    counts = {}
+    for text, weight in ((title, TITLE_WEIGHT), (content, 1)):
+        for token in TOKEN_RE.findall((text or "").lower()):
+            if token not in STOP_WORDS:
+                counts[token] = counts.get(token, 0) + weight
+    for tag in (tags or "").split(","):
+        tag = tag.strip().lower()
+        if tag:
+            counts["#" + tag] = counts.get("#" + tag, 0) + TAG_WEIGHT
+    return counts
+
+
+class RelatedIndex:
+    """In-memory TF-IDF index of posts for "more like this" lookups.
+
+    Posts are kept as raw term counts. The searchable part is an inverted
+    index (terms x posts sparse matrix) of L2-normalized TF-IDF vectors, so a
+    lookup only reads the postings of the query post's terms. Added and changed
+    posts go to a small delta that is searched alongside it; once ``max_delta``
+    posts have changed the index flags itself with ``needs_compaction`` and
+    the owner (RelatedIndexSync's thread) rebuilds the matrix with fresh IDF
+    weights, so writes never pay for a rebuild.
+    """
+
+    def __init__(self, max_delta=1000):
+        self.max_delta = max_delta
+        self.watermark = None  # post_index_changes are applied up to here
+        self.changed = False  # since the last save
+        self.needs_compaction = False  # delta too large; rebuild() off the request path
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()
+        self._building = None  # post ids changed while rebuild() runs outside the lock
+        self._vocabulary = {}  # term -> column
+        self._terms = []  # column -> term
+        self._doc_freq = []  # column -> posts containing the term
+        self._docs = {}  # post id -> (columns, counts)
+
+        # Compiled matrix, plus the posts changed since it was built
+        self._postings = None
+        self._row_ids = np.zeros(0, dtype=np.int64)
+        self._rows = {}  # post id -> row, for rows still current
+        self._stale = np.zeros(0, dtype=bool)
+        self._stale_count = 0
+        self._delta = {}  # post id -> (columns, weights)
+        self._delta_matrix = None
+        self._delta_ids = None
+
+        # Stats
+        self._builds = 0
+        self._build_seconds = 0.0
+        self._queries = 0
+        self._query_seconds = 0.0
+        self._last_query_seconds = 0.0
+
+    def _column(self, term):
+        column = self._vocabulary.get(term)
+        if column is None:
+            column = self._vocabulary[term] = len(self._terms)
+            self._terms.append(term)
+            self._doc_freq.append(0)
+        return column
+
+    def _weights(self, columns, counts):
+        # Sublinear TF times smoothed IDF, normalized so a dot product is the cosine
+        doc_freq = np.fromiter((self._doc_freq[column] for column in columns), dtype=np.float64, count=len(columns))
+        weights = (1 + np.log(counts)) * (np.log((1 + len(self._docs)) / (1 + doc_freq)) + 1)
+        return weights / np.sqrt(np.dot(weights, weights))
+
+    def _add(self, post_id, counts):
+        columns = np.fromiter((self._column(term) for term in counts), dtype=np.int32, count=len(counts))
+        self._docs[post_id] = (columns, np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))
+        for column in columns.tolist():
+            self._doc_freq[column] += 1
+
+    def _drop(self, post_id):
+        doc = self._docs.pop(post_id, None)
+        if doc is None:
+            return
+        for column in doc[0].tolist():
+            self._doc_freq[column] -= 1
+        row = self._rows.pop(post_id, None)
+        if row is not None:
+            self._stale[row] = True
+            self._stale_count += 1
+        if self._delta.pop(post_id, None) is not None:
+            self._delta_matrix = None
+
+    def set_post(self, post_id, title, content, tags):
+        counts = post_terms(title, content, tags)
+        with self._lock:
+            doc = self._docs.get(post_id)
+            if doc is not None and len(doc[0]) == len(counts):
+                columns = [self._vocabulary.get(term) for term in counts]
+                if columns == doc[0].tolist() and list(counts.values()) == doc[1].tolist():
+                    return  # Unchanged, e.g. a change seen again through the sync overlap
+            if self._building is not None:
+                self._building.add(post_id)
+            self._drop(post_id)
+            if counts:
+                self._add(post_id, counts)
+                columns, counts = self._docs[post_id]
+                self._delta[post_id] = (columns, self._weights(columns, counts))
+                self._delta_matrix = None
+            self.changed = True
+            self._maybe_compact()
+
+    def remove_post(self, post_id):
+        with self._lock:
+            if post_id in self._docs:
+                if self._building is not None:
+                    self._building.add(post_id)
+                self._drop(post_id)
+                self.changed = True
+                self._maybe_compact()
+
+    def _maybe_compact(self):
+        if len(self._delta) + self._stale_count > max(self.max_delta, len(self._row_ids) // 20):
+            self.needs_compaction = True
+
+    def rebuild(self):
+        # Recompiles the matrix from the raw counts: O(total terms), all in numpy.
+        # Only the snapshot and the swap hold the lock; queries and writes go on
+        # against the old matrix meanwhile, and posts written during the build
+        # stay in the delta.
+        started = time.perf_counter()
+        with self._rebuild_lock:
+            with self._lock:
+                items = list(self._docs.items())  # The (columns, counts) arrays are replaced, never changed
+                doc_freq = np.asarray(self._doc_freq, dtype=np.float64)
+                term_count = len(self._terms)
+                self._building = set()
+
+            try:
+                post_ids = np.fromiter((post_id for post_id, _ in items), dtype=np.int64, count=len(items))
+                lengths = np.fromiter((len(columns) for _, (columns, _) in items), dtype=np.int64, count=len(items))
+                columns = np.concatenate([columns for _, (columns, _) in items]) if items else np.zeros(0, dtype=np.int32)
+                counts = np.concatenate([counts for _, (_, counts) in items]) if items else np.zeros(0)
+                rows = np.repeat(np.arange(len(items)), lengths)
+
+                weights = (1 + np.log(counts)) * (np.log((1 + len(items)) / (1 + doc_freq)) + 1)[columns]
+                norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=len(items)))
+                weights /= norms[rows]
+                postings = sp.csr_matrix((weights, (columns, rows)), shape=(term_count, len(items)))
+            except Exception:
+                with self._lock:
+                    self._building = None
+                raise
+
+            with self._lock:
+                changed, self._building = self._building, None
+                self._postings = postings
+                self._row_ids = post_ids
+                self._rows = {post_id: row for row, post_id in enumerate(post_ids.tolist()) if post_id not in changed}
+                self._stale = np.zeros(len(items), dtype=bool)
+                self._stale[[row for row, post_id in enumerate(post_ids.tolist()) if post_id in changed]] = True
+                self._stale_count = int(self._stale.sum())
+                self._delta = {post_id: vector for post_id, vector in self._delta.items() if post_id in changed}
+                self._delta_matrix = None
+                self.needs_compaction = False
+                self._maybe_compact()
+                elapsed = time.perf_counter() - started
+                self._builds += 1
+                self._build_seconds = elapsed
+        related_build_time.observe(elapsed)
+
+    def _delta_scores(self, columns, weights):
+        if not self._delta:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        if self._delta_matrix is None:
+            vectors = list(self._delta.values())
+            indptr = np.concatenate([[0], np.cumsum([len(vector[0]) for vector in vectors])])
+            self._delta_matrix = sp.csr_matrix(
+                (np.concatenate([vector[1] for vector in vectors]), np.concatenate([vector[0] for vector in vectors]), indptr),
+                shape=(len(vectors), len(self._terms))
+            )
+            self._delta_ids = np.fromiter(self._delta.keys(), dtype=np.int64, count=len(vectors))
+        query = np.zeros(len(self._terms))
+        query[columns] = weights
+        return self._delta_ids, self._delta_matrix.dot(query)
+
+    def related(self, post_id, limit=10):
+        # [(post id, cosine similarity)], best first; None if the post isn't indexed
+        started = time.perf_counter()
+        with self._lock:
+            doc = self._docs.get(post_id)
+            if doc is None:
+                return None
+            columns = doc[0]
+            weights = self._weights(*doc)
+
+            post_ids, scores = self._delta_scores(columns, weights)
+            if self._postings is not None and len(self._row_ids):
+                known = columns < self._postings.shape[0]  # Terms first seen after the last rebuild are only in the delta
+                base_scores = self._postings[columns[known]].T.dot(weights[known])
+                base_scores[self._stale] = 0
+                post_ids = np.concatenate([self._row_ids, post_ids])
+                scores = np.concatenate([base_scores, scores])
+
+        scores[post_ids == post_id] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        related = [(int(post_ids[i]), float(scores[i])) for i in candidates]
+
+        elapsed = time.perf_counter() - started
+        related_query_time.observe(elapsed)
+        with self._lock:
+            self._queries += 1
+            self._query_seconds += elapsed
+            self._last_query_seconds = elapsed
+        return related
+
+    def save(self, path):
+        # Raw counts and vocabulary; loading recompiles the matrix, which is much
+        # faster than re-reading and re-tokenizing every post
+        with self._lock:
+            post_ids = np.fromiter(self._docs.keys(), dtype=np.int64, count=len(self._docs))
+            docs = list(self._docs.values())
+            lengths = np.fromiter((len(columns) for columns, _ in docs), dtype=np.int64, count=len(docs))
+            columns = np.concatenate([columns for columns, _ in docs]) if docs else np.zeros(0, dtype=np.int32)
+            counts = np.concatenate([counts for _, counts in docs]) if docs else np.zeros(0)
+            terms = np.array(self._terms, dtype=str)
+            watermark = self.watermark.isoformat()
+            self.changed = False
+        temporary = "%s.%d.tmp" % (path, os.getpid())
+        with open(temporary, "wb") as file:
+            np.savez(file, post_ids=post_ids, lengths=lengths, columns=columns, counts=counts, terms=terms, watermark=watermark)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path, max_delta=1000):
+        index = cls(max_delta)
+        with np.load(path, allow_pickle=False) as data:
+            index._terms = data["terms"].tolist()
+            index._vocabulary = {term: column for column, term in enumerate(index._terms)}
+            columns = data["columns"]
+            counts = data["counts"]
+            offsets = np.cumsum(data["lengths"])[:-1]
+            index._docs = dict(zip(data["post_ids"].tolist(), zip(np.split(columns, offsets), np.split(counts, offsets))))
+            index._doc_freq = np.bincount(columns, minlength=len(index._terms)).tolist()
+            index.watermark = datetime.fromisoformat(str(data["watermark"]))
+        index.rebuild()
+        return index
+
+    @classmethod
+    def build(cls, max_delta=1000, batch_size=2000):
+        index = cls(max_delta)
+        with pooled_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT NOW();")
+            index.watermark = cursor.fetchone()[0]
+            # Streamed from a server-side cursor so the posts never sit in memory as rows
+            posts = connection.cursor(name="related_index_build")
+            posts.itersize = batch_size
+            posts.execute("SELECT id, title, content, tags FROM posts;")
+            for post_id, title, content, tags in posts:
+                counts = post_terms(title, content, tags)
+                if counts:
+                    index._add(post_id, counts)
+            posts.close()
+            connection.rollback()
+        index.rebuild()
+        return index
+
+    def stats(self):
+        with self._lock:
+            return {
+                "posts": len(self._docs),
+                "terms": len(self._terms),
+                "delta": len(self._delta),
+                "stale": self._stale_count,
+                "builds": self._builds,
+                "build_seconds": round(self._build_seconds, 6),
+                "queries": self._queries,
+                "avg_query_seconds": round(self._query_seconds / self._queries, 6) if self._queries else 0.0,
+                "last_query_seconds": round(self._last_query_seconds, 6),
+            }
+
+
+class RelatedIndexSync:
+    """Loads the related-posts index in the background and keeps it current.
+
+    Starts from the snapshot at ``path`` when there is a recent one (rebuilding
+    from the posts table otherwise), then applies post_index_changes every
+    ``interval`` seconds so posts written by other workers show up too,
+    compacts the index when it asks to be rebuilt, and saves a new snapshot at
+    most every ``save_interval`` seconds.
+    """
+
+    # Changes are re-read this far back, so transactions that committed after a
+    # later-stamped one are not missed
+    OVERLAP = 10.0
+
+    def __init__(self, path=INDEX_PATH, interval=5.0, save_interval=300.0, retention=86400.0, max_delta=1000):
+        self.path = path
+        self.interval = interval
+        self.save_interval = save_interval
+        self.retention = retention
+        self.max_delta = max_delta
+        self.index = None  # None until loaded
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_save = time.monotonic()
+        self._last_prune = 0.0
+
+        # Stats
+        self._syncs = 0
+        self._changes = 0
+        self._errors = 0
+        self._loaded_from = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="related-index", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while self.index is None:
+            try:
+                self.index = self._load_or_build()
+            except Exception:
+                with self._lock:
+                    self._errors += 1
+                logger.exception("Could not load the related posts index")
+                time.sleep(self.interval)
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sync(self.index)
+                if self.index.needs_compaction:
+                    self.index.rebuild()
+                if self.index.changed and time.monotonic() - self._last_save > self.save_interval:
+                    self.index.save(self.path)
+                    self._last_save = time.monotonic()
+            except Exception:
+                with self._lock:
+                    self._errors += 1
+                logger.exception("Related posts index sync failed")
+
+    def _load_or_build(self):
+        index = None
+        if os.path.exists(self.path):
+            try:
+                index = RelatedIndex.load(self.path, self.max_delta)
+                self._loaded_from = "snapshot"
+            except Exception:
+                logger.exception("Ignoring unreadable related posts snapshot %s", self.path)
+        if index is None or index.watermark < datetime.now(timezone.utc) - timedelta(seconds=self.retention - self.OVERLAP):
+            # No snapshot, or older than the change log reaches back
+            index = RelatedIndex.build(self.max_delta)
+            self._loaded_from = "posts"
+            index.save(self.path)
+            self._last_save = time.monotonic()
+        self.sync(index)
+        return index
+
+    def sync(self, index):
+        with pooled_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT NOW();")
+            now = cursor.fetchone()[0]
+            cursor.execute(
+                "SELECT DISTINCT post_id FROM post_index_changes WHERE changed_at > %s - make_interval(secs => %s);",
+                (index.watermark, self.OVERLAP)
+            )
+            post_ids = [row[0] for row in cursor.fetchall()]
+            posts = []
+            if post_ids:
+                cursor.execute("SELECT id, title, content, tags FROM posts WHERE id = ANY(%s);", (post_ids,))
+                posts = cursor.fetchall()
+            if time.monotonic() - self._last_prune > 3600:
+                cursor.execute("DELETE FROM post_index_changes WHERE changed_at < NOW() - make_interval(secs => %s);", (self.retention,))
+                self._last_prune = time.monotonic()
+            connection.commit()
+
+        for post in posts:
+            index.set_post(*post)
+        for post_id in set(post_ids) - {post[0] for post in posts}:
+            index.remove_post(post_id)
+        index.watermark = now
+        with self._lock:
+            self._syncs += 1
+            self._changes += len(post_ids)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "ready": self.index is not None,
+                "loaded_from": self._loaded_from,
+                "syncs": self._syncs,
+                "changes": self._changes,
+                "errors": self._errors,
+            }
+        if self.index is not None:
+            stats.update(self.index.stats())
+        return stats
+
+
+_sync = None
+_sync_pid = None
+_sync_lock = threading.Lock()
+
+
+def get_related_sync():
+    global _sync, _sync_pid
+    if _sync is None or _sync_pid != os.getpid():
+        with _sync_lock:
+            if _sync is None or _sync_pid != os.getpid():
+                _sync = RelatedIndexSync(
+                    interval=float(os.getenv('RELATED_SYNC_INTERVAL', 5)),
+                    save_interval=float(os.getenv('RELATED_SAVE_INTERVAL', 300)),
+                    retention=float(os.getenv('RELATED_CHANGES_RETENTION', 86400)),
+                    max_delta=int(os.getenv('RELATED_MAX_DELTA', 1000))
+                )
+                _sync_pid = os.getpid()
+    return _sync
+
+
+def get_related_index():
+    # The loaded index, or None if disabled or still loading
+    if not RELATED_POSTS:
+        return None
+    return get_related_sync().index
+
+
+def index_post(post):
+    # Lets the writing worker serve its own change right away; others pick it up from post_index_changes
+    index = get_related_index()
+    if index is not None:
+        index.set_post(post["id"], post["title"], post["content"], post["tags"])
+
+
+def unindex_post(post_id):
+    index = get_related_index()
+    if index is not None:
+        index.remove_post(post_id)
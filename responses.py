@@ -0,0 +1,119 @@
+import gzip
+import os
+from datetime import date, datetime, timezone
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Falls back to Flask's stdlib provider
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# "http" keeps the RFC 822 dates Flask has always sent; "iso" lets orjson
+# write ISO 8601 natively, which is faster but changes the date format
+JSON_DATETIME_FORMAT = os.getenv('JSON_DATETIME_FORMAT', 'http')
+
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))  # Smaller bodies aren't worth a compressor
+GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))  # Fast levels; 11 is far too slow per request
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "text/html", "text/plain"}
+
+
+_WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def http_date(value):
+    # Same output as werkzeug.http.http_date, several times faster; naive datetimes are taken as UTC
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        hour, minute, second = value.hour, value.minute, value.second
+    else:
+        hour = minute = second = 0
+    return "%s, %02d %s %04d %02d:%02d:%02d GMT" % (
+        _WEEKDAYS[value.weekday()], value.day, _MONTHS[value.month - 1], value.year, hour, minute, second
+    )
+
+
+class OrJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson.
+
+    Serializes dicts, lists and datetimes in C and writes the response body as
+    bytes without an intermediate ``str``. Anything orjson can't handle
+    (Decimal, UUID, dataclasses) goes through Flask's usual ``default``.
+    """
+
+    sort_keys = False
+
+    def _options(self):
+        options = orjson.OPT_NON_STR_KEYS
+        if JSON_DATETIME_FORMAT != "iso":
+            options |= orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    @staticmethod
+    def _default(o):
+        if JSON_DATETIME_FORMAT != "iso" and isinstance(o, date):
+            return http_date(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self._default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self._default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def choose_encoding():
+    # Brotli when the client takes it and it is installed, otherwise gzip
+    accepted = request.accept_encodings
+    if brotli is not None and accepted.quality("br") > 0:
+        return "br"
+    if accepted.quality("gzip") > 0:
+        return "gzip"
+    return None
+
+
+def compress_response(response):
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    encoding = choose_encoding()
+    if encoding == "br":
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+    elif encoding == "gzip":
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+    else:
+        return response
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_app(app):
+    if orjson is not None:
+        app.json = OrJSONProvider(app)
+    if os.getenv('COMPRESS_RESPONSES', '1') == '1':
+        app.after_request(compress_response)
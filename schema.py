@@ -0,0 +1,268 @@
+import hashlib
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+from db_utils import pooled_connection
+from pagination import encode_cursor
+from queries import (
+    build_comments_query, build_post_query, build_posts_query, build_related_query, build_trending_query,
+    build_update_post_query, build_update_user_query, build_user_posts_query
+)
+from trending import DEFAULT_WINDOW, TRENDING_WINDOWS
+
+# Versioned schema migrations: migrations/NNN_name.sql, applied in order and
+# recorded in schema_migrations. A file is applied in one transaction unless its
+# first line is NO_TRANSACTION; those files run statement by statement in
+# autocommit, which CREATE INDEX CONCURRENTLY requires. Statements in such files
+# are split on a trailing ";", so they can't contain function bodies.
+#
+# In a no-transaction file, a statement preceded by BATCH is a backfill run in
+# batches, each committed on its own so no batch holds row locks for long. It
+# gets an %(after)s parameter (0 at first) and must return the ids it touched,
+# in a keyset it walks upwards; it runs again with the highest of them until
+# it returns none.
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE_RE = re.compile(r"^(\d+)_(\w+)\.sql$")
+NO_TRANSACTION = "-- migrate: no-transaction"
+BATCH = "-- migrate: batch"
+STATEMENT_END_RE = re.compile(r";\s*$", re.MULTILINE)
+CREATE_INDEX_RE = re.compile(r"\bCREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+
+# Transactional migrations give up instead of queueing behind long-running
+# queries (and blocking everything queued behind them) while waiting for a lock
+LOCK_TIMEOUT = os.getenv('MIGRATION_LOCK_TIMEOUT', '5s')
+ADVISORY_LOCK_ID = 724_001  # Serializes concurrent `flask db upgrade` runs
+
+CREATE_SCHEMA_MIGRATIONS = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        checksum TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+Migration = namedtuple("Migration", ["version", "name", "sql", "checksum", "transactional"])
+
+
+class MigrationError(Exception):
+    pass
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    migrations = {}
+    for filename in sorted(os.listdir(directory)):
+        match = MIGRATION_FILE_RE.match(filename)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise MigrationError(f"Two migrations share version {version}: {migrations[version].name} and {match.group(2)}")
+        with open(os.path.join(directory, filename), encoding="utf-8") as file:
+            sql = file.read()
+        migrations[version] = Migration(
+            version, match.group(2), sql, hashlib.sha256(sql.encode()).hexdigest(),
+            not sql.lstrip().startswith(NO_TRANSACTION)
+        )
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def split_statements(sql):
+    statements = []
+    for chunk in STATEMENT_END_RE.split(sql):
+        code = "\n".join(line for line in chunk.splitlines() if line.strip() == BATCH or not line.strip().startswith("--")).strip()
+        if code and code != BATCH:
+            statements.append(code)
+    return statements
+
+
+def applied_migrations(cursor):
+    # version -> (checksum, applied_at)
+    cursor.execute(CREATE_SCHEMA_MIGRATIONS)
+    cursor.execute("SELECT version, checksum, applied_at FROM schema_migrations;")
+    return {version: (checksum, applied_at) for version, checksum, applied_at in cursor.fetchall()}
+
+
+def concurrent_indexes(statements):
+    return [match.group(1) for statement in statements for match in CREATE_INDEX_RE.finditer(statement)]
+
+
+def invalid_indexes(cursor, names):
+    # Left behind when CREATE INDEX CONCURRENTLY fails; IF NOT EXISTS would then skip them forever.
+    # Only the migration's own indexes: a concurrent build elsewhere is invalid until it finishes
+    if not names:
+        return []
+    cursor.execute(
+        "SELECT indexrelid::regclass::text FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+        "WHERE NOT pg_index.indisvalid AND pg_class.relname = ANY(%s) ORDER BY 1;",
+        (names,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def run_batched(cursor, statement):
+    after = 0
+    while True:
+        cursor.execute(statement, {"after": after})
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            return
+        after = max(ids)
+
+
+def apply_migration(connection, migration):
+    cursor = connection.cursor()
+    if migration.transactional:
+        try:
+            cursor.execute("SET LOCAL lock_timeout = %s;", (LOCK_TIMEOUT,))
+            cursor.execute(migration.sql)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s);",
+                (migration.version, migration.name, migration.checksum)
+            )
+            connection.commit()
+        except Exception as err:
+            connection.rollback()
+            raise MigrationError(f"{migration.version:03d}_{migration.name} failed and was rolled back: {err}")
+        return
+
+    statements = split_statements(migration.sql)
+    connection.autocommit = True
+    try:
+        for statement in statements:
+            try:
+                if statement.startswith(BATCH):
+                    run_batched(cursor, statement)
+                else:
+                    cursor.execute(statement)
+            except Exception as err:
+                raise MigrationError(f"{migration.version:03d}_{migration.name} failed at: {statement}\n{err}")
+        invalid = invalid_indexes(cursor, concurrent_indexes(statements))
+        if invalid:
+            raise MigrationError(
+                f"{migration.version:03d}_{migration.name} left invalid indexes: {', '.join(invalid)}. "
+                "Drop them (DROP INDEX CONCURRENTLY) and run the upgrade again."
+            )
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s);",
+            (migration.version, migration.name, migration.checksum)
+        )
+    finally:
+        connection.autocommit = False
+
+
+def upgrade(target=None, echo=print):
+    """Apply pending migrations up to ``target`` (all by default); returns the versions applied."""
+    migrations = load_migrations()
+    applied = []
+    with pooled_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s);", (ADVISORY_LOCK_ID,))
+        try:
+            done = applied_migrations(cursor)
+            connection.commit()
+            for migration in migrations:
+                if migration.version in done or (target is not None and migration.version > target):
+                    continue
+                echo(f"Applying {migration.version:03d}_{migration.name}" + ("" if migration.transactional else " (no transaction)"))
+                apply_migration(connection, migration)
+                applied.append(migration.version)
+        finally:
+            connection.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(%s);", (ADVISORY_LOCK_ID,))
+            connection.commit()
+    return applied
+
+
+def stamp(version):
+    """Record migrations up to ``version`` as applied without running them."""
+    with pooled_connection() as connection:
+        cursor = connection.cursor()
+        done = applied_migrations(cursor)
+        stamped = [migration for migration in load_migrations() if migration.version <= version and migration.version not in done]
+        cursor.executemany(
+            "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s);",
+            [(migration.version, migration.name, migration.checksum) for migration in stamped]
+        )
+        connection.commit()
+    return [migration.version for migration in stamped]
+
+
+def migration_status():
+    # [(migration, applied_at or None, changed since it was applied)]
+    with pooled_connection() as connection:
+        cursor = connection.cursor()
+        done = applied_migrations(cursor)
+        connection.commit()
+    status = []
+    for migration in load_migrations():
+        checksum, applied_at = done.get(migration.version, (None, None))
+        status.append((migration, applied_at, checksum is not None and checksum != migration.checksum))
+    return status
+
+
+def route_queries():
+    # (route, query, params) for the statements the API runs, built the way the handlers build them
+    now = datetime.now()
+    date_cursor = encode_cursor("date", [now, 1])
+    rank_cursor = encode_cursor("rank", [0.1, now, 1])
+    window_length = TRENDING_WINDOWS[DEFAULT_WINDOW][0]
+    return [
+        ("GET /posts", *build_posts_query({}, 1, 10, None)),
+        ("GET /posts?cursor=", *build_posts_query({}, 1, 10, date_cursor)),
+        ("GET /posts?page=50", *build_posts_query({}, 50, 10, None)),
+        ("GET /posts?tag=", *build_posts_query({"tag": "python"}, 1, 10, None)),
+        ("GET /posts?tag=&tag_mode=any", *build_posts_query({"tag": "python,flask", "tag_mode": "any"}, 1, 10, None)),
+        ("GET /posts?author=", *build_posts_query({"author": "alice"}, 1, 10, None)),
+        ("GET /posts?q=", *build_posts_query({"q": "database performance"}, 1, 10, None)),
+        ("GET /posts?q=&cursor=", *build_posts_query({"q": "database performance"}, 1, 10, rank_cursor)),
+        ("GET /posts?include=", *build_posts_query({"include": "like_count,comment_preview"}, 1, 10, None)),
+        ("GET /posts/trending", *build_trending_query({}, DEFAULT_WINDOW, window_length, 20)),
+        ("GET /posts/<id>", *build_post_query(1, {})[:2]),
+        ("GET /posts/<id>?include=", *build_post_query(1, {"include": "comments,like_count,author_profile"})[:2]),
+        ("GET /posts/<id>/related", *build_related_query({}, [1, 2, 3])),
+        ("GET /posts/<id>/comments", *build_comments_query(1, 1, 10, None)),
+        ("GET /posts/<id>/comments?cursor=", *build_comments_query(1, 1, 10, date_cursor)),
+        ("GET /users/<id>/posts", *build_user_posts_query(1, {}, 1, 10, None)),
+        ("GET /users/<id>/posts?cursor=", *build_user_posts_query(1, {}, 1, 10, date_cursor)),
+        ("GET /users/<id>", "SELECT id, username, email, created_at FROM users WHERE id = %s;", [1]),
+        ("GET /tags", "SELECT name, post_count FROM tags WHERE post_count > 0 ORDER BY post_count DESC, name LIMIT %s;", [20]),
+        ("POST /auth/sign-in", "SELECT * FROM users WHERE username = %s;", ["alice"]),
+        ("PUT /posts/<id>", *build_update_post_query(1, 1, {"title": "title"})),
+        ("PUT /users/<id>", *build_update_user_query(1, {"email": "alice@example.com"})),
+        ("DELETE /posts/<id>", "DELETE FROM posts WHERE id = %s AND user_id = %s RETURNING id;", [1, 1]),
+        ("DELETE /comments/<id>", "DELETE FROM comments WHERE id = %s AND (user_id = %s OR %s) RETURNING post_id;", [1, 1, False]),
+        ("DELETE /posts/<id>/like", "DELETE FROM likes WHERE user_id = %s AND post_id = %s RETURNING post_id;", [1, 1]),
+    ]
+
+
+def sequential_scans(plan):
+    # Relations read by Seq Scan nodes anywhere in an EXPLAIN (FORMAT JSON) plan
+    scans = []
+    if plan.get("Node Type") == "Seq Scan":
+        scans.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        scans.extend(sequential_scans(child))
+    return scans
+
+
+def check_plans(min_rows=10000):
+    """EXPLAIN every route's query; returns [(route, table, estimated rows)] for
+    sequential scans of tables with at least ``min_rows`` rows."""
+    problems = []
+    with pooled_connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace;"
+        )
+        table_rows = dict(cursor.fetchall())
+        for route, query, params in route_queries():
+            cursor.execute("EXPLAIN (FORMAT JSON) " + query.strip(), params)
+            plan = cursor.fetchone()[0][0]["Plan"]
+            for table in sequential_scans(plan):
+                if table_rows.get(table, 0) >= min_rows:
+                    problems.append((route, table, int(table_rows[table])))
+        connection.rollback()
+    return problems
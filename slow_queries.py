@@ -0,0 +1,196 @@
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import random
+import re
+import threading
+from datetime import datetime, timezone
+import psycopg2.extensions
+from dotenv import load_dotenv
+from flask import has_request_context, request
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))  # 0 turns the recorder off
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv('SLOW_QUERY_EXPLAIN_RATE', 0.05))  # Fraction of slow statements whose plan is captured
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv('SLOW_QUERY_EXPLAIN_TIMEOUT_MS', 5000))
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', 'slow_queries.log')  # Empty keeps them in memory only
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv('SLOW_QUERY_LOG_MAX_BYTES', 10 * 1024 * 1024))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv('SLOW_QUERY_LOG_BACKUPS', 5))
+
+EXPLAINABLE = ("select", "with", "insert", "update", "delete")
+
+# Only read-only SELECTs are run again under ANALYZE. Anything that writes or
+# locks (including WITH ... DELETE) gets a plain EXPLAIN, which doesn't execute
+# it: no second run of the triggers, no sequence values used up.
+_WRITES_RE = re.compile(r"\b(insert|update|delete|nextval|for (no key )?update|for (key )?share)\b")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s")
+
+
+def normalize_query(query):
+    # Placeholders and inline literals become ?, so each builder variant (which
+    # conditions, which SET columns) is one fingerprint whatever its values
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = str(query)  # psycopg2.sql.Composed
+    return _LITERAL_RE.sub("?", _WHITESPACE_RE.sub(" ", query).strip())
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def _shape(value):
+    if value is None:
+        return "null"
+    if isinstance(value, (list, tuple)):
+        return "%s[%d]" % (type(value).__name__, len(value))
+    return type(value).__name__
+
+
+def params_shape(params):
+    # Types (and list lengths) only; values can be passwords or personal data
+    if params is None:
+        return []
+    if isinstance(params, dict):
+        return {name: _shape(value) for name, value in params.items()}
+    return [_shape(value) for value in params]
+
+
+def current_route():
+    if has_request_context():
+        rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        return "%s %s" % (request.method, rule)
+    return "<%s>" % threading.current_thread().name
+
+
+def is_read_only(normalized):
+    normalized = normalized.lower()
+    return normalized.startswith("select") and not _WRITES_RE.search(normalized)
+
+
+def explain(connection, query, params, analyze):
+    # In a savepoint that is always rolled back, so a failed or timed-out EXPLAIN
+    # leaves the caller's transaction as it was. Uses a plain cursor so the
+    # EXPLAIN isn't itself recorded.
+    cursor = psycopg2.extensions.cursor(connection)
+    cursor.execute("SAVEPOINT slow_query_explain;")
+    try:
+        cursor.execute("SET LOCAL statement_timeout = %s;", (SLOW_QUERY_EXPLAIN_TIMEOUT_MS,))
+        cursor.execute(("EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN ") + query.strip(), params)
+        return "\n".join(row[0] for row in cursor.fetchall())
+    finally:
+        cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain;")
+        cursor.execute("RELEASE SAVEPOINT slow_query_explain;")
+        cursor.close()
+
+
+class SlowQueryLog:
+    """Statements slower than ``threshold_ms``, aggregated by fingerprint.
+
+    Each slow statement is written as one JSON line to a rotating log file,
+    with its normalized SQL, parameter types, route and duration. For a
+    ``explain_rate`` fraction of them the plan is captured, logged and kept
+    with its fingerprint: read-only SELECTs are run again under EXPLAIN
+    (ANALYZE, BUFFERS), writes only get a plain EXPLAIN. The capture runs on
+    the request's connection, so keep the rate low; for full coverage of
+    writes use Postgres' auto_explain instead. At most ``max_fingerprints`` are kept in memory; the least
+    recently seen is dropped first.
+    """
+
+    def __init__(self, threshold_ms=200.0, explain_rate=0.05, path=None, max_fingerprints=500):
+        self.threshold = threshold_ms / 1000
+        self.explain_rate = explain_rate
+        self.max_fingerprints = max_fingerprints
+        self._entries = {}  # fingerprint -> aggregate
+        self._lock = threading.Lock()
+        self._log = None
+        if path:
+            self._log = logging.getLogger("slow_queries.file")
+            self._log.propagate = False
+            self._log.setLevel(logging.INFO)
+            if not self._log.handlers:
+                handler = logging.handlers.RotatingFileHandler(path, maxBytes=SLOW_QUERY_LOG_MAX_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS, delay=True)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self._log.addHandler(handler)
+
+    def record(self, cursor, query, params, duration, explain=True):
+        normalized = normalize_query(query)
+        key = fingerprint(normalized)
+        route = current_route()
+        shape = params_shape(params)
+
+        plan = None
+        if (
+            explain
+            and random.random() < self.explain_rate
+            and cursor.name is None  # Named cursors execute as DECLARE
+            and not cursor.connection.autocommit  # No transaction to hold the savepoint
+            and isinstance(query, str)
+            and normalized.lower().startswith(EXPLAINABLE)
+        ):
+            try:
+                plan = explain(cursor.connection, query, params, analyze=is_read_only(normalized))
+            except Exception:
+                logger.exception("EXPLAIN of a slow query failed")
+
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.max_fingerprints:
+                    del self._entries[min(self._entries, key=lambda k: self._entries[k]["last_seen"])]
+                entry = self._entries[key] = {
+                    "fingerprint": key, "query": normalized, "count": 0, "total_seconds": 0.0, "max_seconds": 0.0,
+                    "routes": {}, "params": shape, "last_seen": now, "plan": None, "plan_captured_at": None,
+                }
+            entry["count"] += 1
+            entry["total_seconds"] += duration
+            entry["max_seconds"] = max(entry["max_seconds"], duration)
+            entry["routes"][route] = entry["routes"].get(route, 0) + 1
+            entry["params"] = shape
+            entry["last_seen"] = now
+            if plan is not None:
+                entry["plan"] = plan
+                entry["plan_captured_at"] = now
+
+        if self._log is not None:
+            self._log.info(json.dumps({
+                "at": now.isoformat(), "fingerprint": key, "duration_ms": round(duration * 1000, 3), "route": route,
+                "query": normalized, "params": shape, "plan": plan,
+            }))
+
+    def summary(self, limit=50):
+        # Worst first, by total time spent
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda entry: entry["total_seconds"], reverse=True)[:limit]
+            return [
+                {
+                    "fingerprint": entry["fingerprint"],
+                    "query": entry["query"],
+                    "count": entry["count"],
+                    "total_ms": round(entry["total_seconds"] * 1000, 3),
+                    "mean_ms": round(entry["total_seconds"] * 1000 / entry["count"], 3),
+                    "max_ms": round(entry["max_seconds"] * 1000, 3),
+                    "routes": dict(entry["routes"]),
+                    "params": entry["params"],
+                    "last_seen": entry["last_seen"],
+                    "plan": entry["plan"],
+                    "plan_captured_at": entry["plan_captured_at"],
+                }
+                for entry in entries
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+slow_query_log = SlowQueryLog(SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN_RATE, SLOW_QUERY_LOG) if SLOW_QUERY_MS > 0 else None
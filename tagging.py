@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor
+from dotenv import load_dotenv
+from metrics import nlp_batch_size, nlp_batch_time, record_nlp
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = os.getenv('SPACY_MODEL', 'en_core_web_sm')
+MAX_TAGS = 5
+# Tag suggestions only need POS tags, lemmas and entities; the dependency parser is dead weight
+EXCLUDED_PIPES = ["parser", "senter"]
+
+_nlp = None
+_nlp_lock = threading.Lock()
+
+
+def load_model():
+    # Loaded once per process (also used as the process pool initializer)
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                import spacy
+                _nlp = spacy.load(MODEL_NAME, exclude=EXCLUDED_PIPES)
+    return _nlp
+
+
+def extract_tags(doc, max_tags=MAX_TAGS):
+    # Keywords and named entities, in order of first appearance
+    tags = {}
+    for token in doc:
+        if token.is_alpha and not token.is_stop and token.pos_ in ["NOUN", "PROPN"]:
+            tags[token.lemma_.lower()] = None
+    for ent in doc.ents:
+        tags[ent.text.lower()] = None
+    return list(tags)[:max_tags]
+
+
+def tag_texts(texts):
+    nlp = load_model()
+    return [extract_tags(doc) for doc in nlp.pipe(texts, batch_size=len(texts) or 1)]
+
+
+class TagEngine:
+    """Micro-batches concurrent tag requests through a single ``nlp.pipe`` call.
+
+    Requests are collected for up to ``max_wait`` seconds (or until
+    ``max_batch_size`` texts are queued) and tagged together, either in this
+    process or in a pool of ``processes`` worker processes that each load the
+    model once.
+    """
+
+    def __init__(self, max_batch_size=32, max_wait=0.01, processes=0):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.processes = processes
+        self._queue = queue.Queue()
+        self._executor = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            if self.processes:
+                self._executor = self._new_executor()
+            self._thread = threading.Thread(target=self._run, name="tag-engine", daemon=True)
+            self._thread.start()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(self.processes, initializer=load_model)
+
+    def _replace_executor(self):
+        # A worker that died (OOM, segfault) breaks the whole pool for good
+        broken, self._executor = self._executor, None
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._new_executor()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # Must never die: callers would wait on their futures until they time out
+        while True:
+            batch = self._next_batch()
+            texts = [text for text, _ in batch]
+            futures = [future for _, future in batch]
+            started = time.perf_counter()
+            try:
+                nlp_batch_size.observe(len(texts))
+                if self._executor is not None:
+                    self._submit(texts, futures, started)
+                else:
+                    result = Future()
+                    try:
+                        result.set_result(tag_texts(texts))
+                    except Exception as err:
+                        result.set_exception(err)
+                    self._resolve(futures, result, started)
+            except Exception as err:
+                logger.exception("Tagging a batch failed")
+                self._fail(futures, err)
+
+    def _submit(self, texts, futures, started):
+        try:
+            result = self._executor.submit(tag_texts, texts)
+        except Exception as err:
+            # e.g. BrokenProcessPool; this batch fails, the next gets a fresh pool
+            logger.warning("Tagging process pool is unusable (%s); starting a new one", err)
+            self._fail(futures, err)
+            self._replace_executor()
+            return
+        result.add_done_callback(lambda done, futures=futures, started=started: self._resolve(futures, done, started))
+
+    @staticmethod
+    def _fail(futures, error):
+        for future in futures:
+            try:
+                future.set_exception(error)
+            except InvalidStateError:
+                pass  # Already resolved, or cancelled by a caller that timed out
+
+    @staticmethod
+    def _resolve(futures, result, started):
+        nlp_batch_time.observe(time.perf_counter() - started)
+        error = result.exception()
+        if error is not None:
+            TagEngine._fail(futures, error)
+            return
+        for future, tags in zip(futures, result.result()):
+            try:
+                future.set_result(tags)
+            except InvalidStateError:
+                pass  # Cancelled by a caller that timed out
+
+    def submit(self, text):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def suggest_many(self, texts, timeout=None):
+        futures = [self.submit(text) for text in texts]
+        return [future.result(timeout) for future in futures]
+
+    def suggest(self, text, timeout=None):
+        return self.suggest_many([text], timeout)[0]
+
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+
+def get_tag_engine():
+    # One engine per process; threads and process pools do not survive fork()
+    global _engine, _engine_pid
+    if _engine is None or _engine_pid != os.getpid():
+        with _engine_lock:
+            if _engine is None or _engine_pid != os.getpid():
+                _engine = TagEngine(
+                    max_batch_size=int(os.getenv('TAGGER_BATCH_SIZE', 32)),
+                    max_wait=float(os.getenv('TAGGER_BATCH_WAIT_MS', 10)) / 1000,
+                    processes=int(os.getenv('TAGGER_PROCESSES', 0))
+                )
+                _engine_pid = os.getpid()
+    return _engine
+
+
+def suggest_tags(text):
+    started = time.perf_counter()
+    try:
+        return get_tag_engine().suggest(text, timeout=float(os.getenv('TAGGER_TIMEOUT', 30)))
+    finally:
+        record_nlp(time.perf_counter() - started)
+
+
+def suggest_tags_many(texts):
+    started = time.perf_counter()
+    try:
+        return get_tag_engine().suggest_many(texts, timeout=float(os.getenv('TAGGER_TIMEOUT', 30)))
+    finally:
+        record_nlp(time.perf_counter() - started)
+
+
+async def suggest_tags_async(text):
+    # Awaits the same micro-batched engine without blocking the event loop
+    future = asyncio.wrap_future(get_tag_engine().submit(text))
+    return await asyncio.wait_for(future, float(os.getenv('TAGGER_TIMEOUT', 30)))
+
+
+async def suggest_tags_many_async(texts):
+    futures = [asyncio.wrap_future(get_tag_engine().submit(text)) for text in texts]
+    return await asyncio.wait_for(asyncio.gather(*futures), float(os.getenv('TAGGER_TIMEOUT', 30)))
@@ -0,0 +1,165 @@
+import logging
+import math
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from db_utils import pooled_connection
+from cache import read_cache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# window name -> (length in seconds, score half-life in seconds)
+TRENDING_WINDOWS = {
+    "24h": (24 * 3600, 6 * 3600),
+    "7d": (7 * 24 * 3600, 36 * 3600),
+}
+DEFAULT_WINDOW = "24h"
+
+# 'off' for processes that serve requests but should leave refreshing to others (or to `flask refresh-trending`)
+TRENDING_REFRESH = os.getenv('TRENDING_REFRESH', 'on') != 'off'
+
+# Consumes a batch of queued events and folds them into every window's scores
+# with log-sum-exp, so each event is read once and no score is ever recomputed
+# from the likes or comments tables. SKIP LOCKED lets several worker processes
+# refresh at once without double-counting.
+FOLD_EVENTS = """
+    WITH consumed AS (
+        DELETE FROM post_events
+        WHERE id IN (SELECT id FROM post_events ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED)
+        RETURNING post_id, weight, created_at
+    ),
+    windows AS (
+        SELECT * FROM unnest(%s::text[], %s::float8[]) AS windows (window_name, decay)
+    ),
+    keyed AS (
+        SELECT windows.window_name, consumed.post_id, consumed.created_at,
+               ln(consumed.weight) + windows.decay * EXTRACT(EPOCH FROM consumed.created_at - TIMESTAMP '2020-01-01') AS k
+        FROM consumed CROSS JOIN windows
+    ),
+    per_post AS (
+        SELECT window_name, post_id, MAX(created_at) AS last_event_at,
+               MAX(max_k) + ln(SUM(exp(k - max_k))) AS score
+        FROM (SELECT keyed.*, MAX(k) OVER (PARTITION BY window_name, post_id) AS max_k FROM keyed) AS events
+        GROUP BY window_name, post_id
+    ),
+    upserted AS (
+        INSERT INTO trending_scores (window_name, post_id, score, last_event_at)
+        SELECT per_post.window_name, per_post.post_id, per_post.score, per_post.last_event_at
+        FROM per_post JOIN posts ON posts.id = per_post.post_id
+        ON CONFLICT (window_name, post_id) DO UPDATE SET
+            score = GREATEST(trending_scores.score, EXCLUDED.score)
+                    + ln(1 + exp(LEAST(trending_scores.score, EXCLUDED.score) - GREATEST(trending_scores.score, EXCLUDED.score))),
+            last_event_at = GREATEST(trending_scores.last_event_at, EXCLUDED.last_event_at)
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM consumed), (SELECT COUNT(*) FROM upserted);
+"""
+
+PRUNE_WINDOW = """
+    DELETE FROM trending_scores
+    WHERE window_name = %s AND last_event_at < NOW() - make_interval(secs => %s);
+"""
+
+
+def decay_rate(half_life):
+    return math.log(2) / half_life
+
+
+class TrendingRefresher:
+    """Background thread that keeps trending_scores up to date.
+
+    Every ``interval`` seconds it folds new like and comment events into the
+    scores, ``batch_size`` events per transaction, and drops posts whose last
+    event has left the window.
+    """
+
+    def __init__(self, interval=30.0, batch_size=5000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # Stats
+        self._runs = 0
+        self._events = 0
+        self._pruned = 0
+        self._errors = 0
+        self._last_run_seconds = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="trending-refresher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                with self._lock:
+                    self._errors += 1
+                logger.exception("Trending refresh failed")
+            time.sleep(self.interval)
+
+    def refresh(self):
+        started = time.monotonic()
+        names = list(TRENDING_WINDOWS)
+        decays = [decay_rate(half_life) for _, half_life in TRENDING_WINDOWS.values()]
+        events = 0
+        pruned = 0
+        with pooled_connection() as connection:
+            cursor = connection.cursor()
+            while True:
+                cursor.execute(FOLD_EVENTS, (self.batch_size, names, decays))
+                consumed, _ = cursor.fetchone()
+                connection.commit()
+                events += consumed
+                if consumed < self.batch_size:
+                    break
+            for name, (length, _) in TRENDING_WINDOWS.items():
+                cursor.execute(PRUNE_WINDOW, (name, length))
+                pruned += cursor.rowcount
+            connection.commit()
+        if events or pruned:
+            read_cache.invalidate("trending")
+        with self._lock:
+            self._runs += 1
+            self._events += events
+            self._pruned += pruned
+            self._last_run_seconds = time.monotonic() - started
+        return events, pruned
+
+    def stats(self):
+        with self._lock:
+            return {
+                "runs": self._runs,
+                "events": self._events,
+                "pruned": self._pruned,
+                "errors": self._errors,
+                "last_run_seconds": round(self._last_run_seconds, 6),
+            }
+
+
+_refresher = None
+_refresher_pid = None
+_refresher_lock = threading.Lock()
+
+
+def get_trending_refresher():
+    global _refresher, _refresher_pid
+    if _refresher is None or _refresher_pid != os.getpid():
+        with _refresher_lock:
+            if _refresher is None or _refresher_pid != os.getpid():
+                _refresher = TrendingRefresher(
+                    interval=float(os.getenv('TRENDING_REFRESH_INTERVAL', 30)),
+                    batch_size=int(os.getenv('TRENDING_BATCH_SIZE', 5000))
+                )
+                _refresher_pid = os.getpid()
+    return _refresher